@@ -0,0 +1,120 @@
+# baseline_cache.py
+import asyncio
+import json
+import time
+
+
+class BaselineEntry:
+    """一组条件下 noop 基准噪声的指数加权均值 (EWMA) 与方差"""
+    def __init__(self, key):
+        self.key = key
+        self.mean = {}
+        self.var = {}
+        self.samples = 0
+        self.created_at = time.time()
+        self.updated_at = None       # 最近一次成功采样的时间
+        self.attempted_at = None     # 最近一次尝试采样的时间 (无论成功与否)
+        self.last_ok = True
+        self.uses = 0
+        self.uses_since_refresh = 0
+
+    def update(self, metrics, alpha):
+        for k, x in metrics.items():
+            if k not in self.mean:
+                self.mean[k] = x
+                self.var[k] = 0.0
+                continue
+            diff = x - self.mean[k]
+            incr = alpha * diff
+            self.mean[k] += incr
+            self.var[k] = (1 - alpha) * (self.var[k] + diff * incr)
+        self.samples += 1
+        self.updated_at = time.time()
+
+    def snapshot(self, now=None):
+        now = now or time.time()
+        return {
+            "image": self.key[0],
+            "payload_bucket": self.key[1],
+            "cpu_quota": self.key[2],
+            "samples": self.samples,
+            "age_seconds": (now - self.updated_at) if self.updated_at else None,
+            "uses": self.uses,
+            "uses_since_refresh": self.uses_since_refresh,
+            "stddev": {k: v ** 0.5 for k, v in self.var.items()},
+        }
+
+
+class BaselineCache:
+    """
+    按 (镜像, payload 大小档位, CPU 配额) 缓存 noop 基准，代替每次调用前都跑一遍 noop：
+    - 某个 key 第一次出现时同步采样一次，之后的调用直接使用缓存的 EWMA 均值；
+    - 样本数不足 min_samples、距上次采样超过 max_age 秒、或被使用 refresh_every 次后，
+      在后台重新采样，不阻塞当前调用；同一 key 同时最多一个采样在进行。
+    measure: 协程 measure(image, resources, payload) -> perf 指标 dict，采样失败时返回空 dict；
+             resources 为目标函数的 ResourceProfile，noop 需要在相同镜像、相同配额的容器中运行
+    所有方法都在 dispatcher 的事件循环中调用。
+    """
+    def __init__(self, measure, alpha=0.2, max_age=600, refresh_every=50, min_samples=3):
+        self.measure = measure
+        self.alpha = alpha
+        self.max_age = max_age
+        self.refresh_every = refresh_every
+        self.min_samples = min_samples
+        self.entries = {}
+        self.inflight = {}  # key -> 正在进行的采样 Task
+
+    @staticmethod
+    def payload_bucket(payload):
+        """payload 序列化后字节数向上取到 2 的幂"""
+        size = len(json.dumps(payload, default=str))
+        return 1 << max(0, size - 1).bit_length()
+
+    def make_key(self, image, payload, resources):
+        return (image, self.payload_bucket(payload), resources.cpus)
+
+    def _stale(self, entry, now):
+        if entry.attempted_at is None:
+            return True
+        if now - entry.attempted_at > self.max_age or entry.uses_since_refresh >= self.refresh_every:
+            return True
+        # 预热阶段连续采样凑够 min_samples；上次失败时不立即重试，等到过期再说
+        return entry.samples < self.min_samples and entry.last_ok
+
+    async def _sample(self, entry, resources, payload):
+        try:
+            metrics = await self.measure(entry.key[0], resources, payload)
+        except Exception as e:
+            print(f"[Baseline] 采样失败 {entry.key}: {e}")
+            metrics = {}
+        entry.attempted_at = time.time()
+        entry.uses_since_refresh = 0
+        entry.last_ok = bool(metrics)
+        if metrics:
+            entry.update(metrics, self.alpha)
+
+    def _refresh(self, entry, resources, payload):
+        task = self.inflight.get(entry.key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._sample(entry, resources, payload))
+            self.inflight[entry.key] = task
+            task.add_done_callback(lambda _t, key=entry.key: self.inflight.pop(key, None))
+        return task
+
+    async def get(self, image, payload, resources):
+        """返回该条件下的 BaselineEntry (resources 为目标函数的 ResourceProfile)；还没有任何样本时返回的 entry.samples 为 0"""
+        key = self.make_key(image, payload, resources)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = BaselineEntry(key)
+        if entry.samples == 0 and entry.attempted_at is None:
+            await asyncio.shield(self._refresh(entry, resources, payload))
+        elif self._stale(entry, time.time()):
+            self._refresh(entry, resources, payload)
+        entry.uses += 1
+        entry.uses_since_refresh += 1
+        return entry
+
+    def describe(self):
+        now = time.time()
+        return [e.snapshot(now) for e in list(self.entries.values())]
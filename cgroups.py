@@ -0,0 +1,282 @@
+# cgroups.py
+"""宿主机上容器 cgroup 目录的定位与资源计数读取 (同时支持 cgroup v1 和 v2 / 混合模式)"""
+import os
+import threading
+
+
+def _cgroup_mounts():
+    """返回 [(挂载点, 文件系统类型, super options)]"""
+    mounts = []
+    try:
+        with open("/proc/self/mountinfo", "r") as f:
+            for line in f:
+                left, _, right = line.partition(" - ")
+                fields = left.split()
+                rfields = right.split()
+                if len(fields) < 5 or len(rfields) < 3 or rfields[0] not in ("cgroup", "cgroup2"):
+                    continue
+                mounts.append((fields[4], rfields[0], rfields[2].split(",")))
+    except OSError:
+        pass
+    return mounts
+
+
+def _proc_cgroups(pid):
+    """/proc/<pid>/cgroup -> [(层级 id, [controller], 路径)]"""
+    entries = []
+    with open(f"/proc/{pid}/cgroup", "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split(":", 2)
+            if len(parts) == 3:
+                entries.append((parts[0], [c for c in parts[1].split(",") if c], parts[2]))
+    return entries
+
+
+def cgroup_dir(pid, controller=None):
+    """
+    进程所在 cgroup 在宿主机上的 (目录, 相对挂载点的名字)，找不到返回 (None, None)。
+    controller 不为 None 时优先使用挂载了该 controller 的 v1 层级，否则使用 v2 统一层级。
+    """
+    mounts = _cgroup_mounts()
+    entries = _proc_cgroups(pid)
+    if controller:
+        for mount_point, fstype, options in mounts:
+            if fstype == "cgroup" and controller in options:
+                for _, controllers, path in entries:
+                    if controller in controllers:
+                        return os.path.join(mount_point, path.lstrip("/")), path.lstrip("/")
+    for mount_point, fstype, _ in mounts:
+        if fstype == "cgroup2":
+            for hierarchy, controllers, path in entries:
+                if hierarchy == "0" and not controllers:
+                    return os.path.join(mount_point, path.lstrip("/")), path.lstrip("/")
+    return None, None
+
+
+def parse_cpu_list(text):
+    """"0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def online_cpus():
+    try:
+        with open("/sys/devices/system/cpu/online", "r") as f:
+            return parse_cpu_list(f.read())
+    except OSError:
+        return list(range(os.cpu_count() or 1))
+
+
+def allowed_cpus(pid):
+    """进程允许运行的 CPU (受容器 cpuset 限制)"""
+    try:
+        return sorted(os.sched_getaffinity(pid))
+    except OSError:
+        return online_cpus()
+
+
+def _read_text(path):
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    text = _read_text(path)
+    try:
+        return int(text.strip()) if text else None
+    except ValueError:
+        return None
+
+
+def _read_kv(path):
+    """"key value" 每行一对的文件 (cpu.stat / memory.stat) -> dict"""
+    text = _read_text(path)
+    result = {}
+    for line in (text or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            try:
+                result[parts[0]] = int(parts[1])
+            except ValueError:
+                pass
+    return result
+
+
+class CgroupAccounting:
+    """
+    读取一个容器 cgroup 的资源计数 (不需要 sudo)。优先使用 cgroup v2 的文件，
+    v1 / 混合模式下退回 cpu、cpuacct、memory、blkio 各自层级中的对应文件。
+    snapshot() 返回统一字段名的计数，delta() 计算两次快照之间的差值。
+    """
+    # 单调递增的计数，delta 取差值；其余字段 (memory_current / memory_peak) 取结束时的值
+    COUNTERS = ("cpu_usage_usec", "cpu_user_usec", "cpu_system_usec", "nr_periods", "nr_throttled",
+                "throttled_usec", "pgfault", "pgmajfault", "io_rbytes", "io_wbytes", "io_rios", "io_wios")
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.v2_dir, _ = cgroup_dir(pid)
+        self.v1_dirs = {c: cgroup_dir(pid, c)[0] for c in ("cpu", "cpuacct", "memory", "blkio")}
+        self.v1_dirs = {c: d for c, d in self.v1_dirs.items() if d and d != self.v2_dir}
+        self._peak_fd = None
+        self.peak_scope = "lifetime"
+
+    def _file(self, v2_name, controller=None, v1_name=None):
+        if self.v2_dir and os.path.exists(os.path.join(self.v2_dir, v2_name)):
+            return os.path.join(self.v2_dir, v2_name), 2
+        if controller and controller in self.v1_dirs:
+            path = os.path.join(self.v1_dirs[controller], v1_name or v2_name)
+            if os.path.exists(path):
+                return path, 1
+        return None, None
+
+    def reset_peak(self):
+        """
+        让 memory_peak 只反映这次调用：
+        v2 (内核 >= 6.12) 向 memory.peak 的 fd 写入任意内容后，从该 fd 读到的是重置之后的峰值；
+        v1 向 memory.max_usage_in_bytes 写 0。都不支持时 memory_peak 是容器整个生命周期的峰值。
+        """
+        path, version = self._file("memory.peak", "memory", "memory.max_usage_in_bytes")
+        if path is None:
+            return
+        try:
+            if version == 2:
+                if self._peak_fd is None:
+                    self._peak_fd = os.open(path, os.O_RDWR)
+                os.write(self._peak_fd, b"reset\n")
+            else:
+                with open(path, "w") as f:
+                    f.write("0")
+            self.peak_scope = "invocation"
+        except OSError:
+            self.peak_scope = "lifetime"
+
+    def _read_peak(self):
+        if self._peak_fd is not None:
+            try:
+                return int(os.pread(self._peak_fd, 64, 0).strip())
+            except (OSError, ValueError):
+                pass
+        path, _ = self._file("memory.peak", "memory", "memory.max_usage_in_bytes")
+        return _read_int(path) if path else None
+
+    def snapshot(self):
+        stats = {}
+        # --- CPU ---
+        path, version = self._file("cpu.stat", "cpu")
+        cpu = _read_kv(path) if path else {}
+        if version == 2:
+            for key in ("usage_usec", "user_usec", "system_usec"):
+                if key in cpu:
+                    stats[f"cpu_{key}"] = cpu[key]
+            if "throttled_usec" in cpu:
+                stats["throttled_usec"] = cpu["throttled_usec"]
+            if "nr_periods" not in cpu and "cpu" in self.v1_dirs:
+                # 混合模式：v2 层级没有启用 cpu controller，节流计数在 v1 的 cpu 层级
+                cpu = _read_kv(os.path.join(self.v1_dirs["cpu"], "cpu.stat"))
+        if "throttled_time" in cpu:
+            stats["throttled_usec"] = cpu["throttled_time"] // 1000
+        for key in ("nr_periods", "nr_throttled"):
+            if key in cpu:
+                stats[key] = cpu[key]
+        if "cpu_usage_usec" not in stats and "cpuacct" in self.v1_dirs:
+            usage = _read_int(os.path.join(self.v1_dirs["cpuacct"], "cpuacct.usage"))
+            if usage is not None:
+                stats["cpu_usage_usec"] = usage // 1000
+            acct = _read_kv(os.path.join(self.v1_dirs["cpuacct"], "cpuacct.stat"))
+            tick = os.sysconf("SC_CLK_TCK")
+            if "user" in acct:
+                stats["cpu_user_usec"] = acct["user"] * 1000000 // tick
+            if "system" in acct:
+                stats["cpu_system_usec"] = acct["system"] * 1000000 // tick
+
+        # --- 内存 ---
+        path, _ = self._file("memory.current", "memory", "memory.usage_in_bytes")
+        if path:
+            stats["memory_current"] = _read_int(path)
+        peak = self._read_peak()
+        if peak is not None:
+            stats["memory_peak"] = peak
+        path, _ = self._file("memory.stat", "memory")
+        mem = _read_kv(path) if path else {}
+        for key in ("pgfault", "pgmajfault"):
+            if key in mem:
+                stats[key] = mem[key]
+
+        # --- I/O ---
+        path, version = self._file("io.stat", "blkio", "blkio.throttle.io_service_bytes")
+        text = _read_text(path) if path else None
+        if text is not None:
+            io = {"io_rbytes": 0, "io_wbytes": 0, "io_rios": 0, "io_wios": 0}
+            for line in text.splitlines():
+                parts = line.split()
+                if version == 2:
+                    for field in parts[1:]:
+                        key, _, value = field.partition("=")
+                        if f"io_{key}" in io:
+                            io[f"io_{key}"] += int(value)
+                elif len(parts) == 3 and parts[1] in ("Read", "Write"):
+                    io["io_rbytes" if parts[1] == "Read" else "io_wbytes"] += int(parts[2])
+            stats.update(io)
+        return stats
+
+    def delta(self, before, after, wall_seconds=None):
+        result = {}
+        for key in self.COUNTERS:
+            if key in before and key in after:
+                result[key] = max(0, after[key] - before[key])
+        for key in ("memory_current", "memory_peak"):
+            if after.get(key) is not None:
+                result[key] = after[key]
+        if "memory_peak" in result:
+            result["memory_peak_scope"] = self.peak_scope
+        if result.get("nr_periods"):
+            result["throttled_ratio"] = result.get("nr_throttled", 0) / result["nr_periods"]
+        if wall_seconds and "cpu_usage_usec" in result:
+            result["cpu_utilization"] = result["cpu_usage_usec"] / 1e6 / wall_seconds
+        return result
+
+    def close(self):
+        if self._peak_fd is not None:
+            try:
+                os.close(self._peak_fd)
+            except OSError:
+                pass
+            self._peak_fd = None
+
+
+class CgroupAccountingRegistry:
+    """container_id -> CgroupAccounting，容器被移除时 detach"""
+    def __init__(self):
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    def get(self, container_id):
+        with self.lock:
+            return self.accounts.get(container_id)
+
+    def attach(self, container_id, pid):
+        account = CgroupAccounting(pid)
+        with self.lock:
+            existing = self.accounts.get(container_id)
+            if existing is not None:
+                account.close()
+                return existing
+            self.accounts[container_id] = account
+        return account
+
+    def detach(self, container_id):
+        with self.lock:
+            account = self.accounts.pop(container_id, None)
+        if account is not None:
+            account.close()
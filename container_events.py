@@ -0,0 +1,129 @@
+# container_events.py
+import threading
+import time
+
+import docker
+
+# 所有由 FunctionManager 创建的容器都带有这些 label，事件订阅只关注它们
+MANAGED_LABEL = "faas.managed"
+FUNCTION_LABEL = "faas.function"
+# 容器池中的容器还带有镜像和 /create_manager 的配置 (JSON)，控制器重启后据此重建 FunctionManager 并接管容器
+IMAGE_LABEL = "faas.image"
+CONFIG_LABEL = "faas.config"
+
+
+class ReadyWaiter:
+    """一次容器启动的就绪信号：proxy 推送 ready 或容器提前退出时被触发"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.ok = False
+        self.reason = None
+
+    def set_ready(self):
+        self.ok = True
+        self.event.set()
+
+    def set_failed(self, reason):
+        self.reason = reason
+        self.event.set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+
+class ReadinessRegistry:
+    """token(容器名) -> ReadyWaiter，由 /container_ready 接口和 docker 事件流共同触发"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = {}
+
+    def expect(self, token):
+        waiter = ReadyWaiter()
+        with self.lock:
+            self.waiters[token] = waiter
+        return waiter
+
+    def notify(self, token):
+        with self.lock:
+            waiter = self.waiters.get(token)
+        if waiter is None:
+            return False
+        waiter.set_ready()
+        return True
+
+    def fail(self, token, reason):
+        with self.lock:
+            waiter = self.waiters.get(token)
+        if waiter is not None:
+            waiter.set_failed(reason)
+
+    def discard(self, token):
+        with self.lock:
+            self.waiters.pop(token, None)
+
+
+class ContainerEventWatcher:
+    """
+    订阅 docker 事件流 (只包含带 faas.managed label 的容器)，
+    容器在就绪前退出时立即让对应的 ReadyWaiter 失败，并把事件转发给订阅者。
+    """
+    def __init__(self, readiness):
+        self.readiness = readiness
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def subscribe(self, callback):
+        """callback(action, container_id, attributes)"""
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _run(self):
+        backoff = 1
+        while True:
+            try:
+                client = docker.from_env()
+                stream = client.events(decode=True, filters={"type": "container", "label": f"{MANAGED_LABEL}=true"})
+                backoff = 1
+                for event in stream:
+                    self._handle(event)
+            except Exception as e:
+                print(f"[Events] docker event stream error: {e}; reconnecting in {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _handle(self, event):
+        action = event.get("Action") or event.get("status")
+        container_id = event.get("id")
+        attributes = event.get("Actor", {}).get("Attributes", {})
+        if action in ("die", "oom", "destroy"):
+            name = attributes.get("name")
+            if name:
+                self.readiness.fail(name, f"container {action} before ready (exitCode={attributes.get('exitCode')})")
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(action, container_id, attributes)
+            except Exception as e:
+                print(f"[Events] subscriber error: {e}")
+
+
+readiness = ReadinessRegistry()
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher():
+    """进程内共享一个事件订阅线程，第一次使用时启动"""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = ContainerEventWatcher(readiness)
+        return _watcher
@@ -1,110 +1,249 @@
 # controller.py
-from flask import Flask, json, request, jsonify
+from flask import Flask, Response, json, request, jsonify
 import threading
-from function_manager import FunctionManager 
+from function_manager import FunctionManager, ManagerOverloaded
+from container_events import readiness
+from keepalive_policy import make_policy, PoolTiers
+from workflow_engine import WorkflowEngine, WorkflowError, load_workflows
+from workflow_runs import InvocationTrace, WorkflowRunRegistry
+from baseline_cache import BaselineCache
+from dispatcher import AsyncDispatcher
+from perf_collector import PerfCollector, DEFAULT_EVENTS
+from cgroups import cgroup_dir, CgroupAccountingRegistry
+from perf_output import parse_perf_csv, parse_perf_interval_csv, interval_totals, calculate_clean_metrics, metric_quality, EventSchedule
+from metrics_store import MetricsStore
+from prom_metrics import MetricsRegistry, CONTENT_TYPE
+from profiling import ProfileSession, STOP_METRICS
+from timeseries import build_timeseries
+from cpu_topology import CpuTopology
+from interference import InterferenceHarness, InterferenceRegistry, PLACEMENTS, DEFAULT_EVENTS as INTERFERENCE_DEFAULT_EVENTS
+from cpuset_allocator import CpusetAllocator, PolicyPlacement, POLICIES as CPUSET_POLICIES
+from placement import InterferenceAwarePlacement
+from resources import ResourceProfile, make_autoscaler
+import reconcile
+from runtime_backends import ProcessBackend, make_backend
+from aiohttp import web
+import asyncio
 import atexit
 import time
-import requests
-from concurrent.futures import ThreadPoolExecutor
-import subprocess
 import os
 import signal
+import re
 
 app = Flask(__name__)
+dispatcher = AsyncDispatcher()
 
 # 定义日志和存储路径
 PERF_LOG_DIR = '/home/jywang/FaaSDocker/storage/perf_logs'
 # 确保基础日志目录存在
 os.makedirs(PERF_LOG_DIR, exist_ok=True)
 
+# 修改点：每次调用的指标写入 SQLite 指标库 (后台批量写入)，不再每次调用生成 clean_*.json 和 perf 输出文件
+# FAAS_METRICS_FILES=1 时仍然保留这些文件 (旧的分析脚本需要)
+METRICS_DB = os.environ.get('FAAS_METRICS_DB', os.path.join(PERF_LOG_DIR, 'metrics.db'))
+METRICS_FILES = os.environ.get('FAAS_METRICS_FILES', '0') == '1'
+metrics_store = MetricsStore(METRICS_DB)
+
+# 容器内 proxy 启动后回调的控制器地址 (容器通过 host-gateway 访问宿主机)
+CONTROLLER_URL = os.environ.get('FAAS_CONTROLLER_URL', 'http://host.docker.internal:5000')
+READY_URL = f"{CONTROLLER_URL}/container_ready"
+
 function_managers = {}
 manager_lock = threading.Lock()
 
-# --- Perf 日志解析工具 ---
-def parse_perf_log(log_path):
-    """
-    读取 perf 输出文件，返回一个包含关键指标的字典。
-    增强版：能够正确处理带单位的指标（如 task-clock）和总结行（time elapsed）。
-    """
-    metrics = {}
-    if not os.path.exists(log_path):
-        print(f"[Parse] Warning: Log file not found: {log_path}")
-        return metrics
+# --- 核心调度函数 (含 perf 采集) ---
+# 修改点：增加了 custom_log_dir 参数
+# 修改点：改为协程，在 dispatcher 的事件循环中运行；/init、/run 走 keep-alive 连接池
+def _get_container_pid(manager, container_id):
+    with manager.lock:
+        data = manager.containers[container_id]
+        container_obj = data["container_obj"]
+        if data.get("pid"):
+            return data["pid"]
+    pid = manager.backend.pid(container_obj)
+    with manager.lock:
+        data["pid"] = pid
+    return pid
+
+
+def _get_container_logs(manager, container_id, tail=50):
+    with manager.lock:
+        if container_id not in manager.containers:
+            return None
+        container_obj = manager.containers[container_id]["container_obj"]
+    return container_obj.logs(tail=tail).decode('utf-8', errors='ignore')
+
+
+# 采集的事件列表，可以用 FAAS_PERF_EVENTS (逗号分隔) 覆盖，例如 compete_ht.sh 中的型号相关事件
+PERF_EVENTS = [e for e in os.environ.get('FAAS_PERF_EVENTS', ','.join(DEFAULT_EVENTS)).split(',') if e]
+# 每组最多的硬件事件数 (约等于 PMU 通用计数器数量)，超过时拆组并在同一函数的连续调用之间轮换
+perf_schedule = EventSchedule(PERF_EVENTS, group_size=int(os.environ.get('FAAS_PERF_GROUP_SIZE', 6)))
+# auto: perf_event_open 可用时使用常驻计数器，否则退回每次请求启动 perf stat；per-request: 总是使用 perf stat
+PERF_MODE = os.environ.get('FAAS_PERF_MODE', 'auto')
+# cgroup: 统计容器 cgroup 内所有进程 (含子进程)；process: 只统计容器 init 进程 (perf stat -p)
+PERF_SCOPE = os.environ.get('FAAS_PERF_SCOPE', 'cgroup')
+perf_collector = PerfCollector(PERF_EVENTS, scope=PERF_SCOPE,
+                               rotating=set(PERF_EVENTS) - set.intersection(*map(set, perf_schedule.groups)))
+# 大于 0 时在 /run 期间每隔这么多毫秒采样一次计数 (perf stat -I)，保存时间序列并划分阶段；默认关闭
+PERF_INTERVAL_MS = int(os.environ.get('FAAS_PERF_INTERVAL_MS', 0))
+
+
+def _use_perf_collector():
+    return PERF_MODE != 'per-request' and perf_collector.supports(PERF_EVENTS) and perf_collector.available()
+
+
+def _has_cgroup(manager, container_id):
+    """沙箱是否有自己的 cgroup (未配置 FAAS_PROCESS_CGROUP 的进程沙箱与控制器共用一个 cgroup)"""
+    with manager.lock:
+        container_obj = manager.containers[container_id]["container_obj"]
+    return manager.backend.has_cgroup(container_obj)
+
+
+def _attach_perf_collector(manager, container_id):
+    # 没有独立 cgroup 时按 cgroup 统计会把控制器和所有沙箱算进去，改为只统计沙箱的进程
+    scope = None if _has_cgroup(manager, container_id) else 'process'
+    perf_collector.attach(container_id, _get_container_pid(manager, container_id), scope)
+
+
+def _perf_stat_target(manager, container_id, events):
+    """perf stat 的统计目标参数：cgroup 模式为 -a -G <cgroup>，process 模式 (或沙箱没有独立 cgroup) 为 -p <pid>"""
+    pid = _get_container_pid(manager, container_id)
+    if not pid:
+        return None
+    if PERF_SCOPE == 'cgroup' and _has_cgroup(manager, container_id):
+        _, cgroup_name = cgroup_dir(pid, 'perf_event')
+        if cgroup_name:
+            # -G 需要为每个事件各指定一次 cgroup
+            return ['-a', '-e', ','.join(events), '-G', ','.join([cgroup_name] * len(events))]
+        print(f"[_dispatch_request] 警告: 找不到容器 {container_id[:12]} 的 cgroup，改为 -p {pid}")
+    return ['-p', str(pid), '-e', ','.join(events)]
+
+
+# 每次 /run 前后读取容器 cgroup 的 CPU (含节流)、内存峰值、I/O 计数，不需要 sudo；FAAS_CGROUP_STATS=0 关闭
+CGROUP_STATS = os.environ.get('FAAS_CGROUP_STATS', '1') != '0'
+# /create_manager 没有指定 autoscale 时是否开启纵向自动伸缩 (依赖 cgroup 计数)
+AUTOSCALE = os.environ.get('FAAS_AUTOSCALE', '0') == '1'
+cgroup_accounting = CgroupAccountingRegistry()
+
+
+def _attach_cgroup_accounting(manager, container_id):
+    return cgroup_accounting.attach(container_id, _get_container_pid(manager, container_id))
+
+
+def _on_container_removed(container_id, host_port):
+    dispatcher.close_port(host_port)
+    perf_collector.detach(container_id)
+    cgroup_accounting.detach(container_id)
+
+
+def _on_cpuset_changed(container_id):
+    # 下一次调用在新的 CPU 集合上重新打开 cgroup 计数器
+    perf_collector.invalidate(container_id)
+
+
+# 获取容器的方式 -> 时间线中的阶段名
+ACQUIRE_PHASES = {"warm": "acquire_warm", "queued": "queue_wait", "cold": "cold_start",
+                  "paused": "resume_paused", "stopped": "resume_stopped"}
+
+
+# --- Prometheus 指标 (GET /metrics) ---
+# 直方图按线程分片写入，记录时不加锁；容器池的计数在抓取时从各 manager 读取
+prom = MetricsRegistry()
+DISPATCH_SECONDS = prom.histogram('faas_dispatch_duration_seconds', '端到端调度耗时 (含去噪基准查询)', ('function',))
+ACQUIRE_SECONDS = prom.histogram('faas_acquire_duration_seconds', '获取容器耗时', ('function', 'start_type'))
+COLD_START_SECONDS = prom.histogram('faas_cold_start_duration_seconds', '等待新容器冷启动的耗时', ('function',))
+RUN_SECONDS = prom.histogram('faas_run_duration_seconds', 'proxy 报告的 /run 执行时间', ('function',))
+PERF_OVERHEAD_SECONDS = prom.histogram('faas_perf_overhead_seconds', 'perf 启动、停止和解析的耗时', ('function',))
+PERF_PHASES = ("perf_start", "perf_stop", "perf_parse")
+
+
+def _observe_dispatch(trace):
+    """一次 _dispatch_request 结束后把各阶段耗时记入直方图"""
+    perf = None
+    for p in trace.phases:
+        if p["phase"] in ACQUIRE_PHASES.values():
+            ACQUIRE_SECONDS.observe(p["duration"], trace.function, trace.start_type or "unknown")
+            if p["phase"] == "cold_start":
+                COLD_START_SECONDS.observe(p["duration"], trace.function)
+        elif p["phase"] in PERF_PHASES:
+            perf = (perf or 0.0) + p["duration"]
+    RUN_SECONDS.observe(trace.proxy_duration, trace.function)
+    PERF_OVERHEAD_SECONDS.observe(perf, trace.function)
 
-    try:
-        with open(log_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                
-                # 移除逗号以便转换数字
-                parts = line.replace(',', '').split()
-                
-                if len(parts) < 2:
-                    continue
 
-                # 提取数值
-                try:
-                    val = float(parts[0])
-                except ValueError:
-                    continue 
+def _collect_pool_metrics():
+    with manager_lock:
+        managers = dict(function_managers)
+    starts, creations, failures, depth, pending, containers, timeouts, rejected = [], [], [], [], [], [], [], []
+    cpus, memory, resumes, resume_seconds = [], [], [], []
+    for name, m in sorted(managers.items()):
+        with m.lock:
+            for start_type, count in m.start_stats.items():
+                starts.append(({"function": name, "start_type": start_type}, count))
+            creations.append(({"function": name}, m.creation_stats["created"]))
+            failures.append(({"function": name}, m.creation_stats["failed"]))
+            depth.append(({"function": name}, len(m.wait_queue)))
+            pending.append(({"function": name}, m.pending_creations))
+            containers.append(({"function": name, "state": "idle"}, m.idle_count))
+            containers.append(({"function": name, "state": "busy"}, m.busy_count))
+            for tier, count in m.tier_counts.items():
+                containers.append(({"function": name, "state": tier}, count))
+            for tier, stats in m.resume_stats.items():
+                resumes.append(({"function": name, "tier": tier, "result": "ok"}, stats["resumed"]))
+                resumes.append(({"function": name, "tier": tier, "result": "failed"}, stats["failed"]))
+                resume_seconds.append(({"function": name, "tier": tier}, stats["total_latency"]))
+            timeouts.append(({"function": name}, m.queue_stats["timeouts"]))
+            rejected.append(({"function": name}, m.queue_stats["rejected"]))
+        cpus.append(({"function": name}, m.resources.cpus))
+        if m.resources.memory_mb:
+            memory.append(({"function": name}, m.resources.memory_mb * 1024 * 1024))
+    return [
+        ("faas_container_starts_total", "counter", "按获取方式 (warm/queued/cold) 统计的容器分配次数", starts),
+        ("faas_container_creations_total", "counter", "成功创建的容器数", creations),
+        ("faas_container_creation_failures_total", "counter", "容器创建失败次数", failures),
+        ("faas_queue_depth", "gauge", "等待容器的请求数", depth),
+        ("faas_pending_creations", "gauge", "正在创建中的容器数", pending),
+        ("faas_containers", "gauge", "按状态 (idle/busy/paused/stopped) 统计的容器数", containers),
+        ("faas_container_resumes_total", "counter", "从暂停层 / 停止层恢复容器的次数", resumes),
+        ("faas_container_resume_seconds_total", "counter", "成功恢复容器的累计耗时 (除以恢复次数得到平均恢复延迟)", resume_seconds),
+        ("faas_queue_timeouts_total", "counter", "排队超时的请求数", timeouts),
+        ("faas_queue_rejected_total", "counter", "队列已满被拒绝的请求数", rejected),
+        ("faas_container_cpu_limit", "gauge", "每个容器的 CPU 配额 (核数，纵向伸缩后随之变化)", cpus),
+        ("faas_container_memory_limit_bytes", "gauge", "每个容器的内存上限", memory),
+    ]
 
-                # 提取键名 (Key)
-                second_part = parts[1]
-                
-                if second_part in ['msec', 'ms', 'sec', 'seconds']:
-                    # 情况 A: 带单位的指标 (e.g., "20537.19 msec task-clock")
-                    if len(parts) >= 3:
-                        key = parts[2]
-                        # 特殊情况: "100.89 seconds time elapsed"
-                        if key == 'time' and len(parts) >= 4 and parts[3] == 'elapsed':
-                            metrics['seconds'] = val 
-                        else:
-                            metrics[key] = val
-                else:
-                    # 情况 B: 标准指标 (e.g., "16950758454 cycles")
-                    key = parts[1]
-                    metrics[key] = val
-                    
-    except Exception as e:
-        print(f"[Parse] Error parsing {log_path}: {e}")
-    
-    return metrics
 
-def calculate_clean_metrics(real_metrics, noise_metrics):
-    """
-    计算差值：Real - Noise，确保不为负数
-    """
-    clean = {}
-    # 我们关心的核心指标
-    keys_of_interest = [
-        'cycles', 'instructions', 'task-clock', 'context-switches', 
-        'cache-misses', 'L1-dcache-load-misses', 'LLC-load-misses', 
-        'page-faults'
-    ]
-    
-    for k in keys_of_interest:
-        r_val = real_metrics.get(k, 0.0)
-        n_val = noise_metrics.get(k, 0.0)
-        clean[k] = max(0.0, r_val - n_val)
-    
-    # 计算 IPC (Instructions Per Cycle)
-    if clean.get('cycles', 0) > 0:
-        clean['IPC'] = clean['instructions'] / clean['cycles']
-    else:
-        clean['IPC'] = 0.0
-        
-    return clean
+prom.register_collector(_collect_pool_metrics)
 
 
-# --- 核心调度函数 (含 perf 采集) ---
-# 修改点：增加了 custom_log_dir 参数
-def _dispatch_request(function_name, payload, run_perf=True, custom_log_dir=None):
+async def _acquire_container(manager, trace):
+    """
+    在事件循环中等待 manager 分配容器：排队期间不占用任何线程，
+    超过 manager.queue_timeout 仍未拿到容器则抛出 ManagerOverloaded。
+    """
+    start = time.time()
+    fut = manager.request_container()
+    try:
+        result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), timeout=manager.queue_timeout)
+    except asyncio.TimeoutError:
+        if not manager.cancel_request(fut):
+            # 超时的同时恰好拿到了容器
+            result = fut.result()
+        else:
+            trace.add("queue_wait", start)
+            raise ManagerOverloaded(f"{manager.function_name}: no container available within {manager.queue_timeout}s")
+    trace.start_type = getattr(fut, "start_type", None)
+    trace.add(ACQUIRE_PHASES.get(trace.start_type, "acquire"), start)
+    return result
+
+
+async def _dispatch_request(function_name, payload, run_perf=True, custom_log_dir=None, trace=None):
     """
     内部共享逻辑：为函数获取、初始化、运行(带perf)并释放一个容器。
+    trace: 可选的 InvocationTrace，记录各阶段耗时
     返回: (result_payload, container_id)
     """
+    trace = trace or InvocationTrace(function_name)
     # print(f"[_dispatch_request] 正在为 '{function_name}' 寻找 manager...")
     with manager_lock:
         if function_name not in function_managers:
@@ -112,7 +251,8 @@ def _dispatch_request(function_name, payload, run_perf=True, custom_log_dir=None
         manager = function_managers[function_name]
 
     # print(f"[_dispatch_request] 正在为 '{function_name}' 获取容器...")
-    host_port, container_id = manager.get_container_for_request()
+    host_port, container_id = await _acquire_container(manager, trace)
+    trace.container = container_id
     if not host_port:
         print(f"[_dispatch_request] 错误: 无法获取容器 {function_name}")
         raise Exception(f"无法获取容器 {function_name}")
@@ -120,71 +260,109 @@ def _dispatch_request(function_name, payload, run_perf=True, custom_log_dir=None
     perf_process = None
     output_file = ""
     perf_log_file = None
-    pid = None
+    counters_before = None
+    sampler = None
+    cgroup_before = None
+    perf_start = None
 
     try:
         # --- 1. 运行 INIT ---
-        try:
-            init_data = {"action": function_name}
-            manager_url = f"http://127.0.0.1:{host_port}"
-            requests.post(f"{manager_url}/init", json=init_data, timeout=10)
-        except Exception as e:
-            print(f"[_dispatch_request] init 错误 (非致命): {e}")
+        # 修改点：温容器已经初始化过同一个 action 时跳过 /init，温调用只需要一次 /run 往返
+        # 配置中的 action 默认与函数同名 (各个 noop manager 都运行 noop action)
+        action = (manager.config or {}).get("action", function_name)
+        if manager.get_initialized_action(container_id) != action:
+            try:
+                init_data = {"action": action}
+                with trace.phase("init"):
+                    await dispatcher.post_json(host_port, "/init", init_data, timeout=10)
+                manager.mark_initialized(container_id, action)
+            except Exception as e:
+                print(f"[_dispatch_request] init 错误 (非致命): {e}")
 
 
         # --- 2. 启动 PERF ---
+        # 修改点：优先使用常驻计数器，/run 前后各读一次快照；不可用时才每次请求启动 perf stat
         if run_perf:
+            group_index, group_events = perf_schedule.next_group(function_name)
+            trace.event_group = {"index": group_index, "count": len(perf_schedule.groups), "events": group_events}
+
+        # 挂载常驻计数器失败的容器 (例如控制器不是 root) 退回每次请求启动 perf stat，不再重试挂载
+        use_collector = run_perf and _use_perf_collector() and not perf_collector.attach_failed(container_id)
+        if use_collector:
+            perf_start = time.time()
+            try:
+                if not perf_collector.is_attached(container_id):
+                    await dispatcher.run_blocking(_attach_perf_collector, manager, container_id)
+            except OSError:
+                # attach() 已经记录了失败原因，本次调用直接改用 perf stat (perf_start 计入挂载的尝试)
+                use_collector = False
+            except Exception as e:
+                print(f"[_dispatch_request] 警告: 挂载计数器失败 (将继续执行): {e}")
+            else:
+                try:
+                    counters_before = perf_collector.snapshot(container_id, group_events)
+                    if PERF_INTERVAL_MS > 0:
+                        sampler = perf_collector.start_sampling(container_id, PERF_INTERVAL_MS / 1000.0)
+                except Exception as e:
+                    print(f"[_dispatch_request] 警告: 读取计数器失败 (将继续执行): {e}")
+            if use_collector:
+                trace.add("perf_start", perf_start)
+
+        if run_perf and not use_collector:
+            perf_start = perf_start or time.time()
             try:
-                with manager.lock:
-                    container_obj = manager.containers[container_id]["container_obj"]
-                    container_obj.reload()
-                    pid = container_obj.attrs['State']['Pid']
+                perf_target = await dispatcher.run_blocking(_perf_stat_target, manager, container_id, group_events)
                 
-                if pid:
+                if perf_target:
                     # 修改点：确定日志保存目录
                     # 如果传了 custom_log_dir 就用它，否则用默认的 PERF_LOG_DIR
                     log_target_dir = custom_log_dir if custom_log_dir else PERF_LOG_DIR
                     os.makedirs(log_target_dir, exist_ok=True)
                     
-                    output_file = os.path.join(log_target_dir, f"{function_name}_{container_id[:12]}.txt")
-                    
-                    events = (
-                        'cycles,instructions,task-clock,context-switches,'
-                        'cache-misses,L1-dcache-load-misses,LLC-load-misses,'
-                        'page-faults,major-faults,minor-faults'
-                    )
+                    output_file = os.path.join(log_target_dir, f"{function_name}_{container_id[:12]}.csv")
                     
+                    # -x, 输出 CSV：保留每个事件的运行时间比例，<not counted>/<not supported> 也能识别
                     perf_cmd = [
-                        'sudo', 'perf', 'stat',
-                        '-p', str(pid),
-                        '-e', events,
+                        'sudo', 'perf', 'stat', '-x', ',',
+                        *(['-I', str(PERF_INTERVAL_MS)] if PERF_INTERVAL_MS > 0 else []),
+                        *perf_target,
                         'sleep', '300' 
                     ]
                     
                     perf_log_file = open(output_file, 'w')
-                    perf_process = subprocess.Popen(
-                        perf_cmd, 
-                        stdout=subprocess.PIPE, 
+                    perf_process = await asyncio.create_subprocess_exec(
+                        *perf_cmd, 
+                        stdout=asyncio.subprocess.DEVNULL, 
                         stderr=perf_log_file, 
-                        preexec_fn=os.setsid 
+                        start_new_session=True 
                     )
                     
                     # 保留短暂 Sleep 防止 Race Condition
-                    time.sleep(0.1)
+                    await asyncio.sleep(0.1)
                     
             except Exception as e:
                 print(f"[_dispatch_request] 警告: 启动 perf 失败 (将继续执行): {e}")
                 if perf_log_file:
                     perf_log_file.close()
+            trace.add("perf_start", perf_start)
+
+        # 没有独立 cgroup 的沙箱不做 cgroup 计数 (读到的是控制器和所有沙箱的总和)
+        if CGROUP_STATS and _has_cgroup(manager, container_id):
+            try:
+                account = cgroup_accounting.get(container_id)
+                if account is None:
+                    account = await dispatcher.run_blocking(_attach_cgroup_accounting, manager, container_id)
+                account.reset_peak()
+                cgroup_before = (time.time(), account.snapshot())
+            except Exception as e:
+                print(f"[_dispatch_request] 警告: 读取 cgroup 计数失败 (将继续执行): {e}")
 
         # --- 3. 运行 RUN ---
-        r = requests.post(f"http://127.0.0.1:{host_port}/run", json=payload, timeout=600)
-        r.raise_for_status()
-        
-        try:
-            data = r.json()
-        except Exception:
-            data = {"raw": r.text}
+        with trace.phase("run"):
+            data = await dispatcher.post_json(host_port, "/run", payload, timeout=600)
+        trace.proxy_duration = data.get("duration")
+        if manager.placement is not None:
+            manager.placement.observe(manager.get_placement(container_id), trace.proxy_duration)
         
         return data.get("result"), container_id
     
@@ -192,10 +370,9 @@ def _dispatch_request(function_name, payload, run_perf=True, custom_log_dir=None
         print(f"[_dispatch_request] 调用容器 {container_id[:12]} 时出错: {e}")
         try:
             print(f"--- 正在抓取容器 {container_id[:12]} 的日志 ---")
-            with manager.lock:
-                if container_id in manager.containers:
-                    logs = manager.containers[container_id]["container_obj"].logs(tail=50).decode('utf-8', errors='ignore')
-                    print(logs)
+            logs = await dispatcher.run_blocking(_get_container_logs, manager, container_id)
+            if logs:
+                print(logs)
             print(f"--- 容器日志结束 ---")
         except Exception as log_e:
             pass
@@ -203,31 +380,120 @@ def _dispatch_request(function_name, payload, run_perf=True, custom_log_dir=None
         
     finally:
         # --- 4. 停止 PERF ---
+        if cgroup_before is not None:
+            try:
+                start, before = cgroup_before
+                trace.cgroup_stats = account.delta(before, account.snapshot(), time.time() - start)
+                if manager.autoscaler is not None:
+                    target = manager.autoscaler.observe(manager.resources, trace.cgroup_stats)
+                    if target:
+                        # docker update 在线程池中执行，不阻塞本次调用的返回
+                        dispatcher.spawn(dispatcher.run_blocking(manager.resize, **target))
+            except Exception as e:
+                print(f"[_dispatch_request] 警告: 读取 cgroup 计数失败: {e}")
+
+        if sampler is not None:
+            samples = sampler.stop()
+            trace.timeseries = build_timeseries(samples, PERF_INTERVAL_MS)
+
+        if counters_before is not None:
+            try:
+                with trace.phase("perf_stop"):
+                    trace.counters, trace.counter_quality = perf_collector.delta(container_id, counters_before)
+            except Exception as e:
+                print(f"[_dispatch_request] 警告: 读取计数器失败: {e}")
+
         if run_perf and perf_process:
+            perf_stop = time.time()
             try:
                 os.killpg(os.getpgid(perf_process.pid), signal.SIGINT)
             except ProcessLookupError:
                 pass 
             
             try:
-                perf_process.communicate(timeout=5)
-            except subprocess.TimeoutExpired:
+                await asyncio.wait_for(perf_process.wait(), timeout=5)
+            except asyncio.TimeoutError:
                 perf_process.kill()
             
             if perf_log_file:
                 perf_log_file.close()
+            trace.add("perf_stop", perf_stop)
+            with trace.phase("perf_parse"):
+                if PERF_INTERVAL_MS > 0:
+                    # -I 模式下 perf 只输出各区间的计数，总数由各区间相加 (时间从 perf 启动算起，包含 /run 前后的空闲)
+                    samples, trace.counter_quality = parse_perf_interval_csv(output_file)
+                    trace.counters = interval_totals(samples)
+                    trace.timeseries = build_timeseries(samples, PERF_INTERVAL_MS)
+                else:
+                    trace.counters, trace.counter_quality = parse_perf_csv(output_file)
+            if not METRICS_FILES:
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
         
         # --- 5. 释放容器 ---
         manager.release_container(container_id)
+        _observe_dispatch(trace)
 
 
 # --- 自动去噪的调度逻辑 (Wrapper) ---
-def dispatch_with_denoising(target_function, payload):
+# noop 基准函数的配置 (与 /create_manager 的请求体格式相同，同样写入容器 label，重启后可以接管)
+NOOP_CONFIG = {
+    "function_name": "noop",
+    "image_name": "video-proxy:latest",
+    "container_port": 5000,
+    "host_storage_path": "/home/jywang/FaaSDocker/storage",
+    "min_idle_containers": 1,
+    "autoscale": False,
+}
+
+
+def _noop_function_name(image, cpus):
+    """默认配置 (NOOP_CONFIG) 的 noop 仍叫 noop；其他 (镜像, CPU 配额) 的 noop 各用一个 manager，名字可以用作容器名"""
+    if image == NOOP_CONFIG["image_name"] and cpus == ResourceProfile().cpus:
+        return 'noop'
+    return f"noop--{re.sub(r'[^a-zA-Z0-9_.-]', '_', image)}--{cpus:g}cpu"
+
+
+def _ensure_noop_manager(image, resources):
+    """返回在与目标函数相同的镜像、相同 CPU 配额的容器中运行 noop action 的 manager 名字，不存在时创建"""
+    name = _noop_function_name(image, resources.cpus)
+    with manager_lock:
+        if name not in function_managers:
+            print(f">>> [Auto-Denoise] '{name}' manager not found. Creating it now...")
+            function_managers[name] = _build_manager(dict(NOOP_CONFIG, function_name=name, action="noop",
+                                                          image_name=image, cpus=resources.cpus))
+    return name
+
+
+async def _measure_noop_baseline(image, resources, payload):
+    """用与目标函数相同的 payload、镜像和 CPU 配额跑一次 noop，返回 perf 指标 (即测量本身的噪声)"""
+    # 自动检查并创建 noop Manager (构造 FunctionManager 会连接 docker，放到线程池中)
+    name = await dispatcher.run_blocking(_ensure_noop_manager, image, resources)
+    noop_log_dir = os.path.join(PERF_LOG_DIR, 'noop')
+    os.makedirs(noop_log_dir, exist_ok=True)
+    trace = InvocationTrace(name)
+    await _dispatch_request(name, payload, custom_log_dir=noop_log_dir, trace=trace)
+    return trace.counters
+
+
+# 修改点：noop 基准按 (镜像, payload 大小档位, CPU 配额) 缓存，不再在每次调用前都跑一遍 noop
+baseline_cache = BaselineCache(
+    _measure_noop_baseline,
+    max_age=float(os.environ.get('FAAS_BASELINE_MAX_AGE', 600)),
+    refresh_every=int(os.environ.get('FAAS_BASELINE_REFRESH_EVERY', 50)),
+)
+
+
+async def dispatch_with_denoising(target_function, payload, trace=None):
     """
-    1. 运行 noop (带相同 payload) -> 获取 Noise Metrics
+    1. 从缓存取 noop 基准 (带相同 payload 测得) -> 获取 Noise Metrics
     2. 运行 target_function -> 获取 Real Metrics
     3. 计算 Clean Metrics 并保存
+    trace: 可选的 InvocationTrace，记录各阶段耗时
     """
+    trace = trace or InvocationTrace(target_function)
     print(f"\n>>> [Auto-Denoise] Starting sequence for '{target_function}'...")
 
     # 修改点：定义该 Action 专属的日志文件夹
@@ -237,68 +503,144 @@ def dispatch_with_denoising(target_function, payload):
     # --- 步骤 A: 运行基准 (Noop) ---
     if target_function == 'noop':
         # 如果直接调 noop，也存到 noop 文件夹下
-        return _dispatch_request('noop', payload, custom_log_dir=action_log_dir)
+        result = await _dispatch_request('noop', payload, custom_log_dir=action_log_dir, trace=trace)
+        DISPATCH_SECONDS.observe(time.time() - trace.start, target_function)
+        return result
 
-    print(f">>> [Auto-Denoise] Phase 1: Running Baseline (noop)...")
+    print(f">>> [Auto-Denoise] Phase 1: Looking up cached baseline (noop)...")
     noise_metrics = {}
-    try:
-        # 自动检查并创建 noop Manager
-        with manager_lock:
-            if 'noop' not in function_managers:
-                print(f">>> [Auto-Denoise] 'noop' manager not found. Creating it now...")
-                function_managers['noop'] = FunctionManager(
-                    function_name='noop',
-                    image_name='video-proxy:latest', 
-                    container_port=5000,
-                    host_storage_path='/home/jywang/FaaSDocker/storage',
-                    min_idle_containers=1 
-                )
-        
-        # 修改点：传入 custom_log_dir
-        _, noop_container_id = _dispatch_request('noop', payload, custom_log_dir=action_log_dir)
-        
-        # 修改点：从子文件夹读取
-        noop_log_path = os.path.join(action_log_dir, f"noop_{noop_container_id[:12]}.txt")
-        noise_metrics = parse_perf_log(noop_log_path)
-        
-    except Exception as e:
-        print(f">>> [Auto-Denoise] Warning: Failed to run baseline (noop). Error: {e}")
-        print(f">>> [Auto-Denoise] Proceeding without denoising...")
+    baseline_info = None
+    baseline_start = time.time()
+    with manager_lock:
+        target_manager = function_managers.get(target_function)
+    if target_manager is not None:
+        baseline = await baseline_cache.get(target_manager.image_name, payload, target_manager.resources)
+        noise_metrics = dict(baseline.mean)
+        baseline_info = baseline.snapshot()
+        if not baseline.samples:
+            print(f">>> [Auto-Denoise] Warning: No baseline available yet. Proceeding without denoising...")
+    trace.add("baseline", baseline_start)
 
     # --- 步骤 B: 运行真实任务 ---
     print(f">>> [Auto-Denoise] Phase 2: Running Target ({target_function})...")
     # 修改点：传入 custom_log_dir
-    result_data, container_id = _dispatch_request(target_function, payload, custom_log_dir=action_log_dir)
-    
-    # 修改点：从子文件夹读取
-    real_log_path = os.path.join(action_log_dir, f"{target_function}_{container_id[:12]}.txt")
-    real_metrics = parse_perf_log(real_log_path)
+    result_data, container_id = await _dispatch_request(target_function, payload, custom_log_dir=action_log_dir, trace=trace)
+    # 本次调用的计数 (常驻计数器的快照差值，或 perf stat 输出的解析结果)
+    real_metrics = trace.counters
 
     # --- 步骤 C: 计算并保存 ---
     print(f">>> [Auto-Denoise] Phase 3: Calculating & Saving...")
     clean_metrics = calculate_clean_metrics(real_metrics, noise_metrics)
-    
-    # 修改点：保存到子文件夹
-    clean_output_path = os.path.join(action_log_dir, f"clean_{target_function}_{container_id[:12]}.json")
+    save_start = time.time()
     
     final_record = {
         "function": target_function,
+        "container": container_id[:12],
         "timestamp": time.time(),
         "raw_metrics": real_metrics,
         "noise_baseline": noise_metrics,
+        "baseline": baseline_info,
         "clean_metrics": clean_metrics, 
+        # 每个指标的计数器运行时间占比 (multiplexing 放大比例) 和可信度
+        "metric_quality": metric_quality(clean_metrics, trace.counter_quality),
+        "event_group": trace.event_group,
+        # cgroup 资源计数：CPU 使用/节流、内存峰值、缺页、I/O
+        "cgroup_metrics": trace.cgroup_stats,
+        # FAAS_PERF_INTERVAL_MS > 0 时：按列存放的分区间计数和划分出的阶段
+        "timeseries": trace.timeseries,
+        # 调度各阶段耗时 (save 阶段本身不含在内)
+        "timing": {"start_type": trace.start_type, "proxy_duration": trace.proxy_duration, "phases": list(trace.phases)},
         "result_payload": result_data 
     }
-    
-    with open(clean_output_path, 'w') as f:
-        json.dump(final_record, f, indent=2)
+
+    # 修改点：写入指标库 (只是放进队列，由后台线程批量提交)
+    metrics_store.record(final_record)
+    if METRICS_FILES:
+        clean_output_path = os.path.join(action_log_dir, f"clean_{target_function}_{container_id[:12]}.json")
+        with open(clean_output_path, 'w') as f:
+            json.dump(final_record, f, indent=2)
+    trace.add("save", save_start)
         
-    print(f">>> [Auto-Denoise] Success! Clean data saved to: {clean_output_path}")
+    print(f">>> [Auto-Denoise] Success! Clean data recorded for {target_function} ({container_id[:12]})")
+    DISPATCH_SECONDS.observe(time.time() - trace.start, target_function)
 
     return result_data, container_id
 
 
+# --- 运行时后端 ---
+# FAAS_RUNTIME: docker (默认) 或 process (本机直接运行 proxy.py 子进程，不需要 docker)；/create_manager 可以用 "runtime" 覆盖。
+# 进程沙箱的工作目录在 FAAS_PROCESS_ROOT 下；FAAS_PROCESS_CGROUP 为 cgroup v2 目录时按函数的资源配置限制 CPU / 内存
+RUNTIME = os.environ.get('FAAS_RUNTIME', 'docker')
+process_backend = None
+process_backend_lock = threading.Lock()
+
+
+def _get_process_backend():
+    """所有函数共享一个进程后端，第一次有函数使用 process 运行时才创建 (全部用 docker 时不创建沙箱目录和 cgroup)"""
+    global process_backend
+    with process_backend_lock:
+        if process_backend is None:
+            process_backend = ProcessBackend(root=os.environ.get('FAAS_PROCESS_ROOT') or None,
+                                             cgroup_root=os.environ.get('FAAS_PROCESS_CGROUP') or None)
+        return process_backend
+
+
 # --- 接口: Create Manager ---
+def _build_manager(body, adopted=None):
+    """
+    按 /create_manager 的请求体创建 FunctionManager；body 也写入容器的 label，控制器重启后用它重建 (reconcile.py)。
+    adopted: 重启后接管的容器。参数不合法时抛出 ValueError / TypeError
+    """
+    function_name = body["function_name"]
+    image_name = body.get("image_name", "video-proxy:latest")
+    container_port = int(body.get("container_port", 5000))
+    host_storage_path = body.get("host_storage_path", None)
+    host_port_start = int(body.get("host_port_start", 8000))
+    idle_timeout = int(body.get("idle_timeout", 300))
+    min_idle = int(body.get("min_idle_containers", 0))
+    max_containers = body.get("max_containers", 16)
+    max_containers = int(max_containers) if max_containers is not None else None
+    queue_timeout = float(body.get("queue_timeout", 60))
+    max_queue_length = body.get("max_queue_length")
+    max_queue_length = int(max_queue_length) if max_queue_length is not None else None
+    # keepalive_policy: "fixed" (默认) 或 "hybrid"；keepalive_params 透传给策略构造函数
+    policy = make_policy(body.get("keepalive_policy", "fixed"), idle_timeout, min_idle,
+                         **(body.get("keepalive_params") or {}))
+    placement = _make_placement(body.get("placement", PLACEMENT))
+    # 资源配置: cpus (默认 0.2) / memory_mb / cpu_shares；autoscale: true 或 VerticalAutoscaler 的参数
+    resources = ResourceProfile.from_body(body)
+    autoscaler = make_autoscaler(body.get("autoscale", AUTOSCALE), resources)
+    # 分层容器池: {"max_paused": 4, "paused_timeout": 600, "max_stopped": 8, "stopped_timeout": 1800, "min_stopped": 0}
+    tiers = PoolTiers(**(body.get("tiers") or {}))
+    runtime = body.get("runtime", RUNTIME)
+    backend = make_backend(runtime, _get_process_backend() if runtime == "process" else None)
+
+    return FunctionManager(
+        function_name=function_name,
+        image_name=image_name,
+        container_port=container_port,
+        host_storage_path=host_storage_path,
+        host_port_start=host_port_start,
+        idle_timeout=idle_timeout,
+        min_idle_containers=min_idle,
+        on_container_removed=_on_container_removed,
+        on_cpuset_changed=_on_cpuset_changed,
+        max_containers=max_containers,
+        queue_timeout=queue_timeout,
+        max_queue_length=max_queue_length,
+        ready_url=READY_URL,
+        keepalive_policy=policy,
+        container_memory_mb=int(body.get("container_memory_mb", resources.memory_mb or 256)),
+        placement=placement,
+        resources=resources,
+        autoscaler=autoscaler,
+        tiers=tiers,
+        config=dict(body),
+        adopted=adopted,
+        backend=backend
+    )
+
+
 @app.route('/create_manager', methods=['POST'])
 def create_manager():
     body = request.get_json(silent=True) or {}
@@ -309,236 +651,351 @@ def create_manager():
     with manager_lock:
         if function_name in function_managers:
             return jsonify({"status": "exists", "message": f"Manager {function_name} already exists."}), 200
-
-        image_name = body.get("image_name", "video-proxy:latest") 
-        container_port = int(body.get("container_port", 5000))
-        host_storage_path = body.get("host_storage_path", None)
-        host_port_start = int(body.get("host_port_start", 8000))
-        idle_timeout = int(body.get("idle_timeout", 300))
-        min_idle = int(body.get("min_idle_containers", 0))
-
-        manager = FunctionManager(
-            function_name=function_name,
-            image_name=image_name,
-            container_port=container_port,
-            host_storage_path=host_storage_path,
-            host_port_start=host_port_start,
-            idle_timeout=idle_timeout,
-            min_idle_containers=min_idle
-        )
+        try:
+            manager = _build_manager(body)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
         function_managers[function_name] = manager
         return jsonify({"status": "created", "function": function_name}), 201
 
 
+# --- 接口: Container Ready (由容器内 proxy 启动后推送) ---
+async def container_ready(request):
+    token = request.match_info['token']
+    if readiness.notify(token):
+        return web.json_response({"status": "ok"}, status=200)
+    return web.json_response({"error": "unknown container"}, status=404)
+
+
 # --- 接口: Dispatch Single Request ---
-@app.route('/dispatch/<function_name>', methods=['POST'])
-def dispatch(function_name):
-    payload = request.get_json(silent=True) or {}
+# 修改点：由 aiohttp 在事件循环中直接处理，不再占用 Flask 工作线程
+async def _read_json_body(request):
     try:
-        result_data, container_id = dispatch_with_denoising(function_name, payload)
+        return await request.json()
+    except Exception:
+        return None
+
+
+async def dispatch(request):
+    function_name = request.match_info['function_name']
+    payload = await _read_json_body(request) or {}
+    trace = InvocationTrace(function_name)
+    try:
+        result_data, container_id = await dispatch_with_denoising(function_name, payload, trace)
+        trace.finish()
         
         response_data = {
             "status": "success", 
             "result": result_data, 
-            "container": container_id[:12]
+            "container": container_id[:12],
+            "timing": trace.to_dict()
         }
-        return jsonify(response_data), 200
+        return web.json_response(response_data, status=200)
+
+    except ManagerOverloaded as e:
+        print(f"[dispatch_route] 过载: {e}")
+        data = {"status": "overloaded", "message": str(e)}
+        return web.json_response(data, status=503)
 
     except Exception as e:
         print(f"[dispatch_route] 调度时出错: {e}")
         data = {"status": "error", "message": str(e)}
-        return jsonify(data), 502
+        return web.json_response(data, status=502)
 
 
-# --- Workflows: Video ---
-def _run_video_workflow(payload):
-    print("[video_workflow] 视频工作流已启动...")
-    try:
-        video_name = payload.get("video_name")
-        segment_time = payload.get("segment_time", 10)
-        target_type = payload.get("target_type", "avi")
-        output_prefix = payload.get("output_prefix", "final_video")
-
-        # 1. Split
-        print("[video_workflow] 正在调度 SPLIT...")
-        split_payload = {"video_name": video_name, "segment_time": segment_time}
-        split_result, _ = dispatch_with_denoising("video_split", split_payload)
-        split_keys = split_result['split_keys']
-        print(f"[video_workflow] SPLIT 完成。创建了 {len(split_keys)} 个分片。")
-
-        # 2. Transcode (Parallel)
-        print("[video_workflow] 正在调度 TRANSCODE (并行)...")
-        def _transcode_task(split_file):
-            task_payload = {'split_file': split_file, 'target_type': target_type}
-            result, _ = dispatch_with_denoising("video_transcode", task_payload)
-            return result['transcoded_file']
-
-        with ThreadPoolExecutor(max_workers=len(split_keys)) as executor:
-            transcoded_files = list(executor.map(_transcode_task, split_keys))
-        print("[video_workflow] TRANSCODE 完成。")
-
-        # 3. Merge
-        print("[video_workflow] 正在调度 MERGE...")
-        merge_payload = {
-            'transcoded_files': transcoded_files,
-            'target_type': target_type,
-            'output_prefix': output_prefix,
-            'video_name': video_name
+# --- 接口: 重复测量 (Profiling) ---
+async def profile(request):
+    """
+    POST /profile/<function_name>，同一个 action 重复测量直到置信区间足够窄：
+    {"payload": {...}, "start": "warm" | "cold", "min_runs": 5, "max_runs": 30, "warmup": 1,
+     "baseline": true, "confidence": 0.95, "rel_precision": 0.05, "outlier_threshold": 3.5,
+     "stop_metrics": ["cycles", "instructions", "IPC", "task-clock"]}
+    每次测量前插入一次 noop 基准 (baseline=false 时不插入)；start=cold 时每次测量前先移除所有空闲容器
+    """
+    function_name = request.match_info['function_name']
+    body = await _read_json_body(request) or {}
+    with manager_lock:
+        manager = function_managers.get(function_name)
+    if manager is None:
+        return web.json_response({"error": f"unknown function {function_name}"}, status=404)
+    start = body.get("start", "warm")
+    if start not in ("warm", "cold"):
+        return web.json_response({"error": "start must be 'warm' or 'cold'"}, status=400)
+    payload = body.get("payload", {})
+
+    async def measure_target():
+        trace = InvocationTrace(function_name)
+        _, container_id = await _dispatch_request(function_name, payload, trace=trace)
+        trace.finish()
+        return trace.counters, {
+            "start_type": trace.start_type,
+            "container": container_id[:12],
+            "timestamp": trace.end,
+            "duration": trace.duration,
+            "proxy_duration": trace.proxy_duration,
+            "event_group": trace.event_group["index"] if trace.event_group else None,
+            "cgroup_metrics": trace.cgroup_stats,
         }
-        merge_result, _ = dispatch_with_denoising("video_merge", merge_payload)
-        final_video = merge_result['final_video']
-        print(f"[video_workflow] 成功! 最终文件: {final_video}")
 
-    except Exception as e:
-        print(f"[video_workflow] 失败: {e}")
+    async def measure_baseline():
+        return await _measure_noop_baseline(manager.image_name, manager.resources, payload)
 
-# --- Workflows: Recognizer ---
-def _run_recognizer_workflow(payload):
-    print("[recognizer_workflow] 图像审查工作流已启动...")
-    try:
-        image_filename = payload.get("image_filename")
-        
-        # 1. Upload
-        upload_payload = {"image_filename": image_filename}
-        upload_result, _ = dispatch_with_denoising("recognizer_upload", upload_payload)
-        image_path = upload_result['image_path']
-
-        # 2. Parallel Analysis
-        print("[recognizer_workflow] 正在调度并行分析...")
-        analysis_results = {}
-        text_from_extract = ""
-
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            future_adult = executor.submit(dispatch_with_denoising, "recognizer_adult", {"image_path": image_path})
-            future_violence = executor.submit(dispatch_with_denoising, "recognizer_violence", {"image_path": image_path})
-            future_extract = executor.submit(dispatch_with_denoising, "recognizer_extract", {"image_path": image_path})
-
-            analysis_results["adult"] = future_adult.result()[0]
-            analysis_results["violence"] = future_violence.result()[0]
-            extract_result = future_extract.result()[0]
-            analysis_results["extract"] = extract_result
-            text_from_extract = extract_result.get("text", "")
-
-        # 3. Parallel Text Analysis
-        print("[recognizer_workflow] 正在调度并行文本分析...")
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_censor = executor.submit(dispatch_with_denoising, "recognizer_censor", {"text": text_from_extract})
-            future_translate = executor.submit(dispatch_with_denoising, "recognizer_translate", {"text": text_from_extract})
-
-            analysis_results["censor"] = future_censor.result()[0]
-            analysis_results["translate"] = future_translate.result()[0]
-
-        # 4. Decision
-        is_illegal_adult = analysis_results["adult"].get("illegal", False)
-        is_illegal_violence = analysis_results["violence"].get("illegal", False)
-        is_illegal_censor = analysis_results["censor"].get("illegal", False)
-        final_illegal_flag = is_illegal_adult or is_illegal_violence or is_illegal_censor
-        
-        final_image_path = image_path 
+    async def evict_idle():
+        await dispatcher.run_blocking(manager.evict_idle_containers)
 
-        # 5. Mosaic (if needed)
-        if final_illegal_flag:
-            print("[recognizer_workflow] 图像非法。调度 MOSAIC...")
-            mosaic_result, _ = dispatch_with_denoising("recognizer_mosaic", {"image_path": image_path})
-            final_image_path = mosaic_result.get("mosaic_image_path")
-        
-        print(f"[recognizer_workflow] 成功! 结果: {final_illegal_flag}, Path: {final_image_path}")
+    try:
+        session = ProfileSession(
+            measure_target,
+            measure_baseline if body.get("baseline", True) else None,
+            evict_idle if start == "cold" else None,
+            min_runs=int(body.get("min_runs", 5)),
+            max_runs=int(body.get("max_runs", 30)),
+            warmup=int(body.get("warmup", 1 if start == "warm" else 0)),
+            confidence=float(body.get("confidence", 0.95)),
+            rel_precision=float(body.get("rel_precision", 0.05)),
+            outlier_threshold=float(body.get("outlier_threshold", 3.5)),
+            stop_metrics=tuple(body.get("stop_metrics", STOP_METRICS)),
+        )
+    except (TypeError, ValueError) as e:
+        return web.json_response({"error": str(e)}, status=400)
 
+    print(f"\n>>> [Profile] '{function_name}' ({start}) min_runs={session.min_runs} max_runs={session.max_runs}")
+    try:
+        report = await session.run()
+    except ManagerOverloaded as e:
+        return web.json_response({"status": "overloaded", "message": str(e)}, status=503)
     except Exception as e:
-        print(f"[recognizer_workflow] 失败: {e}")
+        print(f"[Profile] 测量 {function_name} 时出错: {e}")
+        return web.json_response({"status": "error", "message": str(e), "runs": len(session.samples)}, status=502)
+    print(f">>> [Profile] '{function_name}' 完成: {report['runs']} 次, {report['stopped']}")
 
-# --- Workflows: SVD ---
-def _run_svd_workflow(payload):
-    print("[svd_workflow] SVD 工作流已启动...")
-    try:
-        row_num = payload.get("row_num", 2000)
-        col_num = payload.get("col_num", 100)
-        slice_num = payload.get("slice_num", 2)
-        
-        # 1. Start
-        start_payload = {"row_num": row_num, "col_num": col_num, "slice_num": slice_num}
-        start_result, _ = dispatch_with_denoising("svd_start", start_payload)
-        slice_paths = start_result['slice_paths'] 
-
-        # 2. Compute (Parallel)
-        def _compute_task(task_input):
-            mat_index, slice_path = task_input
-            task_payload = {'slice_path': slice_path, 'mat_index': mat_index}
-            result, _ = dispatch_with_denoising("svd_compute", task_payload)
-            return result 
-
-        compute_tasks = list(enumerate(slice_paths))
-        with ThreadPoolExecutor(max_workers=len(compute_tasks)) as executor:
-            compute_results = list(executor.map(_compute_task, compute_tasks))
-        
-        # 3. Merge
-        merge_payload = {'results': compute_results}
-        merge_result, _ = dispatch_with_denoising("svd_merge", merge_payload)
-        print(f"[svd_workflow] 成功! SVD 结果已保存。")
+    # 每次测量也写入指标库，source 为 profile
+    for sample in session.samples:
+        metrics_store.record({
+            "function": function_name,
+            "container": sample["info"].get("container"),
+            "timestamp": sample["info"].get("timestamp"),
+            "raw_metrics": sample["raw"],
+            "noise_baseline": sample["noise"],
+            "clean_metrics": sample["clean"],
+            "cgroup_metrics": sample["info"].get("cgroup_metrics"),
+            "timing": {"start_type": sample["info"].get("start_type"), "proxy_duration": sample["info"].get("proxy_duration")},
+        }, source="profile")
+    report.update({"function": function_name, "start": start})
+    return web.json_response(report, dumps=lambda d: json.dumps(d, default=str))
 
-    except Exception as e:
-        print(f"[svd_workflow] 失败: {e}")
 
-# --- Workflows: WordCount ---
-def _run_wordcount_workflow(payload):
-    print("[wordcount_workflow] WordCount 工作流已启动...")
-    try:
-        input_filename = payload.get("input_filename")
-        slice_num = payload.get("slice_num", 4)
-        
-        # 1. Start
-        start_payload = {"input_filename": input_filename, "slice_num": slice_num}
-        start_result, _ = dispatch_with_denoising("wordcount_start", start_payload)
-        chunk_paths = start_result['chunk_paths']
-
-        # 2. Count (Parallel)
-        def _count_task(chunk_path):
-            task_payload = {'chunk_path': chunk_path}
-            result, _ = dispatch_with_denoising("wordcount_count", task_payload)
-            return result['result_path']
-
-        with ThreadPoolExecutor(max_workers=len(chunk_paths)) as executor:
-            count_results_paths = list(executor.map(_count_task, chunk_paths))
-        
-        # 3. Merge
-        merge_payload = {'result_paths': count_results_paths}
-        merge_result, _ = dispatch_with_denoising("wordcount_merge", merge_payload)
-        final_word_count = merge_result['final_word_count']
-        
-        top_10 = sorted(final_word_count.items(), key=lambda item: item[1], reverse=True)[:10]
-        print(f"[wordcount_workflow] 成功! 单词总数: {len(final_word_count)}, Top10: {top_10}")
+# --- Workflows: 由 workflows/ 目录下的 DAG 定义驱动 ---
+WORKFLOW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workflows')
+
+
+async def _workflow_dispatch(function_name, payload, trace=None):
+    result, _ = await dispatch_with_denoising(function_name, payload, trace)
+    return result
+
+
+workflow_engine = WorkflowEngine(_workflow_dispatch)
+workflows = load_workflows(WORKFLOW_DIR)
+workflow_runs = WorkflowRunRegistry()
+print(f"[workflow] 已加载工作流: {sorted(workflows)}")
 
+
+async def _run_workflow(spec, payload, run):
+    try:
+        output = await workflow_engine.run(spec, payload, tracker=run)
+        summary = json.dumps(output, default=str)
+        if len(summary) > 500:
+            summary = summary[:500] + '...'
+        print(f"[workflow:{spec.name}] 成功! 结果: {summary}")
+        return output
     except Exception as e:
-        print(f"[wordcount_workflow] 失败: {e}")
+        print(f"[workflow:{spec.name}] 失败: {e}")
+        if run.status == "running":
+            run.finished(error=e)
 
 
 # --- 接口: Dispatch Workflow ---
-@app.route('/dispatch_workflow', methods=['POST'])
-def dispatch_workflow():
-    body = request.get_json(silent=True) or {}
+# 修改点：工作流作为协程在事件循环中后台运行，不再为每个工作流创建线程；定义从 workflows/ 目录加载
+async def dispatch_workflow(request):
+    body = await _read_json_body(request) or {}
     workflow_name = body.get("workflow_name")
     payload = body.get("payload", {})
 
     if not workflow_name:
-        return jsonify({"error": "workflow_name required"}), 400
-
-    target_func = None
-    if workflow_name == "video":
-        target_func = _run_video_workflow
-    elif workflow_name == "recognizer":
-        target_func = _run_recognizer_workflow
-    elif workflow_name == "svd":
-        target_func = _run_svd_workflow
-    elif workflow_name == "wordcount":
-        target_func = _run_wordcount_workflow
-    
-    if target_func:
-        thread = threading.Thread(target=target_func, args=(payload,))
-        thread.daemon = True
-        thread.start()
-        return jsonify({"status": "started", "workflow": workflow_name}), 202
+        return web.json_response({"error": "workflow_name required"}, status=400)
+
+    spec = workflows.get(workflow_name)
+    if spec:
+        run = workflow_runs.create(workflow_name, payload, spec.dependencies())
+        dispatcher.spawn(_run_workflow(spec, payload, run))
+        return web.json_response({"status": "started", "workflow": workflow_name, "run_id": run.run_id}, status=202)
     else:
-        return jsonify({"error": f"Unknown workflow: {workflow_name}"}), 404
+        return web.json_response({"error": f"Unknown workflow: {workflow_name}"}, status=404)
+
+
+# --- 接口: Workflow Runs (运行状态与阶段耗时) ---
+# 运行记录由事件循环中的工作流协程更新，查询接口也在事件循环中处理，读取时不会与更新交错
+async def list_workflow_runs(request):
+    workflow_name = request.query.get("workflow")
+    return web.json_response([r.summary() for r in workflow_runs.list(workflow_name)])
+
+
+async def get_workflow_run(request):
+    run = workflow_runs.get(request.match_info['run_id'])
+    if run is None:
+        return web.json_response({"error": "unknown run"}, status=404)
+    return web.json_response(run.to_dict(), dumps=lambda d: json.dumps(d, default=str))
+
+
+async def workflow_run_summary(request):
+    return web.json_response(workflow_runs.aggregate(request.match_info['workflow_name']))
+
+
+# --- 接口: 共置干扰矩阵 ---
+topology = CpuTopology()
+# 干扰测量用 perf stat -A -C 按 CPU 计数，可以换成 compete_ht.sh 中的型号相关事件
+INTERFERENCE_EVENTS = [e for e in os.environ.get('FAAS_INTERFERENCE_EVENTS', ','.join(INTERFERENCE_DEFAULT_EVENTS)).split(',') if e]
+interference_harness = InterferenceHarness(dispatcher, topology, INTERFERENCE_EVENTS)
+interference_runs = InterferenceRegistry()
+
+# 容器放置策略：none (默认，由 docker / 内核决定)、spread / pack / sibling-avoid (按拓扑分配 cpuset)
+# 或 interference (按函数画像和干扰矩阵选 cpuset)；/create_manager 可以用 "placement" 为单个函数覆盖。
+# 所有策略共用一个分配器，占用情况统一统计
+PLACEMENT = os.environ.get('FAAS_PLACEMENT', 'none')
+PLACEMENT_POLICIES = ("none",) + CPUSET_POLICIES + ("interference",)
+cpuset_allocator = CpusetAllocator(topology)
+interference_placement = InterferenceAwarePlacement(cpuset_allocator, metrics_store, interference_runs)
+
+
+def _make_placement(name):
+    if name not in PLACEMENT_POLICIES:
+        raise ValueError(f"Unknown placement: {name} (expected one of {list(PLACEMENT_POLICIES)})")
+    if name == "none":
+        return None
+    if name == "interference":
+        return interference_placement
+    return PolicyPlacement(cpuset_allocator, name)
+
+
+async def start_interference(request):
+    """
+    POST /interference，在后台测量一组 action 两两共置的干扰矩阵：
+    {"actions": ["matmul", "video_transcode"], "payloads": {"matmul": {"param": 4000}},
+     "placements": ["smt", "same_socket", "cross_socket"], "repeats": 3}
+    """
+    body = await _read_json_body(request) or {}
+    actions = body.get("actions") or []
+    placements = body.get("placements") or list(PLACEMENTS)
+    unknown = [p for p in placements if p not in PLACEMENTS]
+    if not actions or unknown:
+        return web.json_response({"error": f"actions required; placements must be in {list(PLACEMENTS)}"}, status=400)
+    with manager_lock:
+        managers = {a: function_managers.get(a) for a in actions}
+    missing = [a for a, m in managers.items() if m is None]
+    if missing:
+        return web.json_response({"error": f"unknown functions: {missing}"}, status=404)
+    try:
+        repeats = max(1, int(body.get("repeats", 3)))
+    except (TypeError, ValueError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+    run = interference_runs.create(actions, placements, body.get("payloads") or {}, repeats)
+    dispatcher.spawn(interference_harness.run(run, managers))
+    return web.json_response({"status": "started", "run_id": run.run_id}, status=202)
+
+
+async def list_interference_runs(request):
+    return web.json_response([r.summary() for r in interference_runs.list()])
+
+
+async def get_interference_run(request):
+    run = interference_runs.get(request.match_info['run_id'])
+    if run is None:
+        return web.json_response({"error": "unknown run"}, status=404)
+    return web.json_response(run.to_dict(), dumps=lambda d: json.dumps(d, default=str))
+
+
+@app.route('/topology', methods=['GET'])
+def host_topology():
+    return jsonify(topology.describe())
+
+
+# --- 接口: 干扰感知放置 ---
+@app.route('/placement', methods=['GET'])
+def placement_report():
+    """当前各容器的 CPU、邻居、预测与观测的 slowdown，以及各函数的画像和类别"""
+    with manager_lock:
+        limits = {name: m.resources.cpus for name, m in function_managers.items() if m.placement is interference_placement}
+    report = interference_placement.report()
+    report["functions"] = interference_placement.classify_functions(limits)
+    return jsonify(report)
+
+
+@app.route('/cpusets', methods=['GET'])
+def cpuset_occupancy():
+    """各物理核心 / NUMA 节点上分配的容器和负载"""
+    return jsonify(cpuset_allocator.occupancy())
+
+
+# --- 接口: Workflow 定义 ---
+@app.route('/workflows', methods=['GET'])
+def list_workflows():
+    return jsonify({name: spec.describe() for name, spec in workflows.items()})
+
+
+@app.route('/workflows/reload', methods=['POST'])
+def reload_workflows():
+    global workflows
+    try:
+        workflows = load_workflows(WORKFLOW_DIR)
+    except (WorkflowError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"status": "reloaded", "workflows": sorted(workflows)}), 200
+
+
+@app.route('/baselines', methods=['GET'])
+def list_baselines():
+    return jsonify(baseline_cache.describe())
+
+
+@app.route('/perf_collector', methods=['GET'])
+def perf_collector_status():
+    return jsonify({"mode": PERF_MODE, "using_collector": _use_perf_collector(), **perf_collector.describe()})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(prom.render(), content_type=CONTENT_TYPE)
+
+
+# --- 接口: 指标库查询 ---
+def _float_arg(name):
+    value = request.args.get(name)
+    return float(value) if value not in (None, '') else None
+
+
+@app.route('/invocations', methods=['GET'])
+def list_invocations():
+    """?function=&since=&until=&limit= (since/until 为 unix 时间戳)"""
+    try:
+        return jsonify(metrics_store.query(request.args.get('function'), _float_arg('since'), _float_arg('until'),
+                                           int(request.args.get('limit', 100))))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route('/invocations/functions', methods=['GET'])
+def list_invocation_functions():
+    return jsonify({"store": metrics_store.path, "writer": metrics_store.stats, "functions": metrics_store.functions()})
+
+
+@app.route('/invocations/aggregate/<function_name>/<metric>', methods=['GET'])
+def aggregate_invocations(function_name, metric):
+    """?kind=clean|raw|cgroup&since=&until= -> count / mean / min / max / p50 / p90 / p95 / p99"""
+    try:
+        return jsonify(metrics_store.aggregate(function_name, metric, request.args.get('kind', 'clean'),
+                                               _float_arg('since'), _float_arg('until')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 
 @app.route('/manager_status/<function_name>', methods=['GET'])
@@ -550,23 +1007,95 @@ def manager_status(function_name):
 
     with m.lock:
         total = len(m.containers)
-        idle = sum(1 for d in m.containers.values() if d["status"] == "idle")
-        busy = sum(1 for d in m.containers.values() if d["status"] == "busy")
+        idle = m.idle_count
+        busy = m.busy_count
         ports = [ {"id": cid[:12], "host_port": d.get("host_port")} for cid,d in m.containers.items() ]
-    return jsonify({"function": function_name, "total": total, "idle": idle, "busy": busy, "containers": ports})
+    return jsonify({"function": function_name, "total": total, "idle": idle, "busy": busy, "containers": ports,
+                    "queue": m.queue_status(), "prewarm": m.prewarm_status(), "keepalive": m.keepalive_status(),
+                    "resources": m.resources.to_dict(), "tiers": m.tier_status(),
+                    "runtime": m.backend.name})
+
+
+@app.route('/resources', methods=['GET'])
+def resource_status():
+    """各函数当前的资源配置和纵向伸缩记录"""
+    with manager_lock:
+        managers = dict(function_managers)
+    return jsonify({name: {"resources": m.resources.to_dict(),
+                           "autoscaler": m.autoscaler.describe() if m.autoscaler else None}
+                    for name, m in sorted(managers.items())})
+
+
+# --- 控制器重启后接管遗留的容器 ---
+# FAAS_KEEP_POOLS=1: 退出时保留所有容器池 (不删除容器)，重启后接管，重新部署控制器不会导致所有函数冷启动
+KEEP_POOLS = os.environ.get('FAAS_KEEP_POOLS', '0') == '1'
+# FAAS_ADOPT_CONTAINERS=0: 启动时删除遗留的容器而不是接管
+ADOPT_CONTAINERS = os.environ.get('FAAS_ADOPT_CONTAINERS', '1') != '0'
+# 接管前等待运行中容器的 proxy 空闲 (上一次运行的请求执行完) 的最长时间
+ADOPT_HEALTH_TIMEOUT = float(os.environ.get('FAAS_ADOPT_HEALTH_TIMEOUT', 5))
+reconcile_report = {}
+
+
+def reconcile_containers():
+    """启动时调用：用遗留容器上的配置重建 FunctionManager 并接管容器。阻塞调用"""
+    def build(config, adopted):
+        with manager_lock:
+            # 遗留的都是 docker 容器，即使现在默认的运行时是 process
+            manager = _build_manager(dict(config, runtime="docker"), adopted)
+            function_managers[manager.function_name] = manager
+        return manager
+
+    if RUNTIME != "docker":
+        print(f"[Reconcile] 运行时为 {RUNTIME}，跳过接管 docker 容器")
+        return reconcile_report
+    with manager_lock:
+        existing = set(function_managers)
+    reconcile_report.clear()
+    reconcile_report.update(reconcile.reconcile(build, existing, adopt=ADOPT_CONTAINERS,
+                                                health_timeout=ADOPT_HEALTH_TIMEOUT))
+    return reconcile_report
+
+
+@app.route('/reconcile', methods=['GET'])
+def reconcile_status():
+    """启动时接管 / 删除遗留容器的结果"""
+    return jsonify(reconcile_report)
 
 
 def clean_up_all_containers_on_exit():
-    print("Application exiting. Stopping all function containers...")
+    if KEEP_POOLS:
+        print("Application exiting. Keeping function containers for the next controller (FAAS_KEEP_POOLS=1)...")
+    else:
+        print("Application exiting. Stopping all function containers...")
     with manager_lock:
         for manager in function_managers.values():
             try:
-                manager.stop_all_containers()
+                # 进程沙箱是控制器的子进程，不能被下一个控制器接管
+                if KEEP_POOLS and manager.backend.name == "docker":
+                    manager.detach()
+                else:
+                    manager.stop_all_containers()
             except Exception as e:
                 print("Error cleaning manager:", e)
-    print("All containers stopped on exit.")
+    print("All containers kept on exit." if KEEP_POOLS else "All containers stopped on exit.")
+    metrics_store.close()
 
 atexit.register(clean_up_all_containers_on_exit)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
+    # 在开始接收请求之前接管上一次运行留下的容器
+    reconcile_containers()
+    # /dispatch 与 /dispatch_workflow 直接在事件循环中处理，其余管理接口回退到 Flask
+    web_app = dispatcher.build_web_app(app, [
+        ('POST', '/dispatch/{function_name}', dispatch),
+        ('POST', '/dispatch_workflow', dispatch_workflow),
+        ('POST', '/profile/{function_name}', profile),
+        ('POST', '/container_ready/{token}', container_ready),
+        ('GET', '/workflow_runs', list_workflow_runs),
+        ('GET', '/workflow_runs/summary/{workflow_name}', workflow_run_summary),
+        ('GET', '/workflow_runs/{run_id}', get_workflow_run),
+        ('POST', '/interference', start_interference),
+        ('GET', '/interference', list_interference_runs),
+        ('GET', '/interference/{run_id}', get_interference_run),
+    ])
+    dispatcher.serve_forever(web_app, host='0.0.0.0', port=5000)
\ No newline at end of file
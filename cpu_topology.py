@@ -0,0 +1,134 @@
+# cpu_topology.py
+"""
+从 sysfs 读取宿主机的 CPU 拓扑：每个逻辑 CPU 所在的物理核心、socket、NUMA 节点和共享的末级缓存 (LLC)。
+/sys/devices/system/cpu/cpuN/topology/{core_id,physical_package_id,thread_siblings_list}
+/sys/devices/system/cpu/cpuN/cache/indexM/{level,shared_cpu_list}
+/sys/devices/system/node/nodeK/cpulist
+"""
+import os
+
+from cgroups import online_cpus, parse_cpu_list
+
+SYS_CPU = "/sys/devices/system/cpu"
+SYS_NODE = "/sys/devices/system/node"
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class CpuInfo:
+    def __init__(self, cpu, package, core, siblings, node, llc):
+        self.cpu = cpu
+        self.package = package      # socket (physical_package_id)
+        self.core = core            # (package, core_id)，全局唯一的物理核心标识
+        self.siblings = siblings    # 同一物理核心上的超线程 (含自身)
+        self.node = node            # NUMA 节点
+        self.llc = llc              # 共享同一块末级缓存的 CPU 集合 (frozenset)
+
+    def to_dict(self):
+        return {"cpu": self.cpu, "package": self.package, "core": list(self.core), "siblings": self.siblings,
+                "node": self.node, "llc": sorted(self.llc)}
+
+
+class CpuTopology:
+    def __init__(self, root=SYS_CPU, node_root=SYS_NODE):
+        self.cpus = {}
+        node_of = {}
+        for entry in sorted(os.listdir(node_root)) if os.path.isdir(node_root) else []:
+            if entry.startswith("node") and entry[4:].isdigit():
+                for cpu in parse_cpu_list(_read(os.path.join(node_root, entry, "cpulist")) or ""):
+                    node_of[cpu] = int(entry[4:])
+        online = _read(os.path.join(root, "online"))
+        for cpu in parse_cpu_list(online) if online else online_cpus():
+            base = os.path.join(root, f"cpu{cpu}")
+            package = int(_read(os.path.join(base, "topology", "physical_package_id")) or 0)
+            core_id = int(_read(os.path.join(base, "topology", "core_id")) or cpu)
+            siblings = parse_cpu_list(_read(os.path.join(base, "topology", "thread_siblings_list")) or str(cpu))
+            self.cpus[cpu] = CpuInfo(cpu, package, (package, core_id), siblings, node_of.get(cpu, 0),
+                                     self._llc(base, cpu))
+
+    @staticmethod
+    def _llc(base, cpu):
+        """级别最高的缓存的 shared_cpu_list；读不到时视为每个 CPU 独占"""
+        best_level, shared = -1, None
+        cache_dir = os.path.join(base, "cache")
+        for entry in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+            if not entry.startswith("index"):
+                continue
+            level = _read(os.path.join(cache_dir, entry, "level"))
+            cpus = _read(os.path.join(cache_dir, entry, "shared_cpu_list"))
+            if level and level.isdigit() and cpus and int(level) > best_level:
+                best_level, shared = int(level), cpus
+        return frozenset(parse_cpu_list(shared)) if shared else frozenset([cpu])
+
+    # --- 查询 ---
+    def cores(self):
+        """物理核心 -> 其上的逻辑 CPU 列表"""
+        cores = {}
+        for info in self.cpus.values():
+            cores.setdefault(info.core, []).append(info.cpu)
+        return {core: sorted(cpus) for core, cpus in sorted(cores.items())}
+
+    def packages(self):
+        return sorted({info.package for info in self.cpus.values()})
+
+    def nodes(self):
+        return sorted({info.node for info in self.cpus.values()})
+
+    def relation(self, a, b):
+        """两个逻辑 CPU 的关系: same_cpu / smt (同一物理核心的超线程) / same_llc / same_socket / cross_socket"""
+        if a == b:
+            return "same_cpu"
+        ia, ib = self.cpus[a], self.cpus[b]
+        if ia.core == ib.core:
+            return "smt"
+        if b in ia.llc:
+            return "same_llc"
+        if ia.package == ib.package:
+            return "same_socket"
+        return "cross_socket"
+
+    def pick_pair(self, placement):
+        """
+        为 placement 选一对逻辑 CPU，没有满足条件的 CPU 时返回 None：
+        smt           同一物理核心的两个超线程
+        same_socket   同一 socket 的两个不同物理核心 (优先共享 LLC)
+        cross_socket  不同 socket
+        """
+        cores = self.cores()
+        if placement == "smt":
+            for cpus in cores.values():
+                if len(cpus) >= 2:
+                    return cpus[0], cpus[1]
+            return None
+        firsts = [cpus[0] for cpus in cores.values()]
+        if placement == "same_socket":
+            candidates = [(a, b) for i, a in enumerate(firsts) for b in firsts[i + 1:]
+                          if self.cpus[a].package == self.cpus[b].package]
+            candidates.sort(key=lambda p: self.relation(*p) != "same_llc")
+            return candidates[0] if candidates else None
+        if placement == "cross_socket":
+            for i, a in enumerate(firsts):
+                for b in firsts[i + 1:]:
+                    if self.cpus[a].package != self.cpus[b].package:
+                        return a, b
+            return None
+        raise ValueError(f"Unknown placement: {placement}")
+
+    def node_cpus(self, node):
+        return sorted(c for c, info in self.cpus.items() if info.node == node)
+
+    def describe(self):
+        return {
+            "cpus": len(self.cpus),
+            "cores": len(self.cores()),
+            "packages": self.packages(),
+            "nodes": {n: self.node_cpus(n) for n in self.nodes()},
+            "smt": any(len(c) > 1 for c in self.cores().values()),
+            "llc_groups": sorted({tuple(sorted(info.llc)) for info in self.cpus.values()}),
+        }
@@ -0,0 +1,221 @@
+# cpuset_allocator.py
+"""
+按宿主机拓扑 (cpu_topology.CpuTopology) 为容器分配 cpuset 的分配器，所有 FunctionManager 共享一个实例。
+每个逻辑 CPU 的容量为 1 个 CPU，容器按其 CPU 配额 (默认 0.2 个 CPU) 占用：配额为 c 个 CPU 的容器
+分到 ceil(c) 个逻辑 CPU，每个 CPU 上占用 c / ceil(c)，多个 CPU 按同一策略逐个选出 (优先留在已选的 NUMA 节点上)；
+容器移除时归还。策略：
+  spread         优先负载最轻的 NUMA 节点、物理核心和 CPU (默认)
+  pack           在还放得下的 CPU 中优先最满的节点、核心和 CPU，把容器集中到尽量少的核心和 NUMA 节点上
+  sibling-avoid  优先同一物理核心的其他超线程上没有容器的 CPU，其余同 spread
+所有 CPU 都放满时仍按同样的顺序选负载最轻的 (超额分配)，而不是拒绝创建容器。
+"""
+import itertools
+import math
+import threading
+import time
+
+POLICIES = ("spread", "pack", "sibling-avoid")
+
+
+class CpusetLease:
+    """一个容器占用的 CPU；由 FunctionManager 保存在容器记录中，容器移除时归还"""
+    _ids = itertools.count(1)
+
+    def __init__(self, function, cpu_limit=None):
+        self.lease_id = next(self._ids)
+        self.function = function
+        self.cpus = []    # 分到的逻辑 CPU，第一个为主 CPU
+        self.nodes = []
+        self.cpu = None   # 主 CPU 及其 NUMA 节点
+        self.node = None
+        self.policy = None
+        self.container_id = None
+        self.created_at = time.time()
+        self.size(cpu_limit)
+
+    def size(self, cpu_limit):
+        """按 CPU 配额确定需要的 CPU 数 (count) 和每个 CPU 上占用的容量 (weight)；没有配额时按独占一个 CPU 计"""
+        self.cpu_limit = cpu_limit or 1.0
+        self.count = max(1, math.ceil(self.cpu_limit - 1e-9))
+        self.weight = self.cpu_limit / self.count
+
+    def save(self):
+        """resize 之前的占用，docker update 失败时交给 CpusetAllocator.restore 恢复"""
+        return self.cpu_limit, list(self.cpus), list(self.nodes), self.cpu, self.node
+
+    def overrides(self):
+        """docker run 的参数"""
+        return {"cpuset_cpus": ",".join(map(str, sorted(self.cpus))), "cpuset_mems": ",".join(map(str, self.nodes))}
+
+
+class CpusetAllocator:
+    def __init__(self, topology, capacity=1.0):
+        self.topology = topology
+        self.capacity = capacity
+        self.leases = {}  # lease_id -> CpusetLease
+        self.lock = threading.Lock()
+
+    # --- 负载 ---
+    def loads_locked(self):
+        """(每个 CPU 的负载, 每个物理核心的负载, 每个 NUMA 节点的平均每 CPU 负载)"""
+        cpu_load = {cpu: 0.0 for cpu in self.topology.cpus}
+        for lease in self.leases.values():
+            for cpu in lease.cpus:
+                cpu_load[cpu] = cpu_load.get(cpu, 0.0) + lease.weight
+        core_load, node_load, node_size = {}, {}, {}
+        for cpu, info in self.topology.cpus.items():
+            core_load[info.core] = core_load.get(info.core, 0.0) + cpu_load[cpu]
+            node_load[info.node] = node_load.get(info.node, 0.0) + cpu_load[cpu]
+            node_size[info.node] = node_size.get(info.node, 0) + 1
+        return cpu_load, core_load, {n: load / node_size[n] for n, load in node_load.items()}
+
+    def policy_key(self, policy, cpu, weight, loads):
+        """按策略给候选 CPU 排序的 key，越小越优先"""
+        cpu_load, core_load, node_load = loads
+        info = self.topology.cpus[cpu]
+        full = cpu_load[cpu] + weight > self.capacity + 1e-9
+        if policy == "spread":
+            return (full, node_load[info.node], core_load[info.core], cpu_load[cpu], cpu)
+        if policy == "pack":
+            return (full, -node_load[info.node], -core_load[info.core], -cpu_load[cpu], cpu)
+        if policy == "sibling-avoid":
+            sibling_busy = any(cpu_load.get(s, 0.0) > 0 for s in info.siblings if s != cpu)
+            return (full, sibling_busy, node_load[info.node], cpu_load[cpu], cpu)
+        raise ValueError(f"Unknown cpuset policy: {policy} (expected one of {list(POLICIES)})")
+
+    # --- 分配与归还 ---
+    def place(self, lease, key):
+        """
+        key(lease, cpu, loads) 在持有锁时对每个候选 CPU 调用，选最小的；需要多个 CPU 时逐个选，
+        已选的 CPU 计入负载。返回 lease
+        """
+        with self.lock:
+            self._place_locked(lease, key)
+        return lease
+
+    def _place_locked(self, lease, key):
+        if lease.count > len(self.topology.cpus):
+            print(f"[Cpuset] 警告: {lease.function} 需要 {lease.count} 个 CPU，宿主机只有 {len(self.topology.cpus)} 个")
+        lease.cpus = []
+        self.leases[lease.lease_id] = lease
+        try:
+            self._fit_locked(lease, key)
+        except Exception:
+            self.leases.pop(lease.lease_id, None)
+            raise
+
+    def _fit_locked(self, lease, key):
+        """把 lease.cpus 增减到 lease.count 个：多余的去掉最后选的，不够的按 key 逐个补 (已选的 CPU 计入负载)"""
+        del lease.cpus[lease.count:]
+        while len(lease.cpus) < min(lease.count, len(self.topology.cpus)):
+            loads = self.loads_locked()
+            candidates = [c for c in self.topology.cpus if c not in lease.cpus]
+            # 同一个容器的 CPU 尽量留在已选的 NUMA 节点上 (访存局部性)，节点内再按策略排序
+            used = {self.topology.cpus[c].node for c in lease.cpus}
+            lease.cpus.append(min(candidates, key=lambda c: (bool(used) and self.topology.cpus[c].node not in used,
+                                                             key(lease, c, loads))))
+        lease.nodes = sorted({self.topology.cpus[cpu].node for cpu in lease.cpus})
+        lease.cpu = lease.cpus[0]
+        lease.node = self.topology.cpus[lease.cpu].node
+
+    def reserve(self, function, cpu_limit=None, policy="spread"):
+        lease = CpusetLease(function, cpu_limit)
+        lease.policy = policy
+        self.place(lease, lambda l, cpu, loads: self.policy_key(policy, cpu, l.weight, loads))
+        print(f"[Cpuset] {function} -> CPU {lease.overrides()['cpuset_cpus']} (node {lease.overrides()['cpuset_mems']}, policy {policy})")
+        return lease
+
+    def bind(self, lease, container_id):
+        lease.container_id = container_id
+
+    def release(self, lease):
+        with self.lock:
+            self.leases.pop(lease.lease_id, None)
+
+    def resize(self, lease, cpu_limit, key=None):
+        """
+        容器的 CPU 配额被原地修改时更新其占用：需要的 CPU 数 (ceil(配额)) 变化时保留已有的 CPU，
+        按 key (默认为 lease 的策略) 补充或去掉最后选的 CPU。返回 lease，调用方需要用 lease.overrides() 更新 cpuset
+        """
+        key = key or (lambda l, cpu, loads: self.policy_key(l.policy, cpu, l.weight, loads))
+        with self.lock:
+            lease.size(cpu_limit)
+            self._fit_locked(lease, key)
+        return lease
+
+    def restore(self, lease, saved):
+        """
+        把 lease 恢复到 save() 时的 CPU：缩小失败时去掉的 CPU 要原样放回 (按策略重新选的未必是容器实际的 cpuset)
+        """
+        cpu_limit, cpus, nodes, cpu, node = saved
+        with self.lock:
+            lease.size(cpu_limit)
+            lease.cpus, lease.nodes, lease.cpu, lease.node = list(cpus), list(nodes), cpu, node
+        return lease
+
+    # --- 报告 ---
+    def occupancy(self):
+        """每个物理核心 / NUMA 节点上的负载和容器"""
+        with self.lock:
+            cpu_load, core_load, node_load = self.loads_locked()
+            by_cpu = {}
+            leases = sorted(self.leases.values(), key=lambda l: l.lease_id)
+            for lease in leases:
+                for cpu in lease.cpus:
+                    by_cpu.setdefault(cpu, []).append({
+                        "function": lease.function,
+                        "container": lease.container_id[:12] if lease.container_id else None,
+                        "weight": lease.weight,
+                        "cpus": list(lease.cpus),
+                        "policy": lease.policy,
+                    })
+        cores = []
+        for core, cpus in self.topology.cores().items():
+            cores.append({
+                "package": core[0],
+                "core": core[1],
+                "load": round(core_load.get(core, 0.0), 3),
+                "cpus": {cpu: {"load": round(cpu_load.get(cpu, 0.0), 3), "containers": by_cpu.get(cpu, [])} for cpu in cpus},
+            })
+        nodes = {}
+        for node in self.topology.nodes():
+            cpus = self.topology.node_cpus(node)
+            nodes[node] = {
+                "cpus": cpus,
+                "load_per_cpu": round(node_load.get(node, 0.0), 3),
+                "containers": sum(1 for lease in leases if node in lease.nodes),
+            }
+        return {
+            "capacity_per_cpu": self.capacity,
+            "containers": len(leases),
+            "nodes": nodes,
+            "cores": cores,
+        }
+
+
+class PolicyPlacement:
+    """FunctionManager 使用的放置接口：按固定策略向共享的分配器申请 CPU"""
+    def __init__(self, allocator, policy):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cpuset policy: {policy} (expected one of {list(POLICIES)})")
+        self.allocator = allocator
+        self.policy = policy
+
+    def reserve(self, function, cpu_limit=None):
+        return self.allocator.reserve(function, cpu_limit, self.policy)
+
+    def bind(self, lease, container_id):
+        self.allocator.bind(lease, container_id)
+
+    def release(self, lease):
+        self.allocator.release(lease)
+
+    def resize(self, lease, cpu_limit):
+        return self.allocator.resize(lease, cpu_limit)
+
+    def restore(self, lease, saved):
+        return self.allocator.restore(lease, saved)
+
+    def observe(self, lease, duration):
+        """固定策略不使用调用结果"""
+        pass
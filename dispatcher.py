@@ -0,0 +1,141 @@
+# dispatcher.py
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+
+class AsyncDispatcher:
+    """
+    控制器的异步调度引擎：
+    - 在独立线程中运行一个 asyncio 事件循环，所有 /init、/run 请求都在这个循环里非阻塞地完成；
+    - 为每个容器宿主端口维护一个带 keep-alive 连接池的 aiohttp 客户端，避免每次请求重新建 TCP 连接；
+    - 阻塞操作（docker SDK、文件读写）统一丢到有界线程池里执行，不占用事件循环。
+    """
+    def __init__(self, pool_size=16, keepalive_timeout=75, blocking_workers=64):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.loop = asyncio.new_event_loop()
+        self.blocking_executor = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix="dispatch-blocking")
+        self.loop.set_default_executor(self.blocking_executor)
+        self.sessions = {}  # {host_port: aiohttp.ClientSession}，只在事件循环线程中访问
+        self._background_tasks = set()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # --- 线程 <-> 事件循环 的桥接 ---
+    def submit(self, coro):
+        """从任意线程向事件循环提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_sync(self, coro, timeout=None):
+        """从同步代码中运行协程并等待结果（不能在事件循环线程内调用）"""
+        return self.submit(coro).result(timeout)
+
+    def spawn(self, coro):
+        """在事件循环中启动后台任务（只能在事件循环线程内调用），并保留引用防止被 GC"""
+        task = self.loop.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """把阻塞调用放到线程池中执行"""
+        return await self.loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    # --- 容器 HTTP 客户端 ---
+    def _get_session(self, host_port):
+        session = self.sessions.get(host_port)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            session = aiohttp.ClientSession(base_url=f"http://127.0.0.1:{host_port}", connector=connector)
+            self.sessions[host_port] = session
+        return session
+
+    async def post_json(self, host_port, path, payload, timeout):
+        """
+        向容器发送 POST 请求，返回解析后的 JSON（非 JSON 响应返回 {"raw": text}）。
+        非 2xx 状态码抛出 aiohttp.ClientResponseError。
+        """
+        session = self._get_session(host_port)
+        async with session.post(path, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            text = await resp.text()
+            resp.raise_for_status()
+        try:
+            return json.loads(text)
+        except ValueError:
+            return {"raw": text}
+
+    def close_port(self, host_port):
+        """容器被移除时关闭对应端口的连接池（线程安全）"""
+        def _close():
+            session = self.sessions.pop(host_port, None)
+            if session is not None and not session.closed:
+                self.spawn(session.close())
+        try:
+            self.loop.call_soon_threadsafe(_close)
+        except RuntimeError:
+            # 事件循环已关闭（进程退出阶段），连接会随进程一起释放
+            pass
+
+    # --- HTTP 服务端 ---
+    def build_web_app(self, flask_app, routes):
+        """
+        构建控制器的 aiohttp 应用：
+        routes 中的 (method, path, handler) 直接在事件循环中处理；
+        其余路径回退到 Flask 应用，在线程池中以 WSGI 方式执行。
+        """
+        web_app = web.Application(client_max_size=64 * 1024 ** 2)
+        for method, path, handler in routes:
+            web_app.router.add_route(method, path, handler)
+        web_app.router.add_route("*", "/{tail:.*}", functools.partial(self._wsgi_fallback, flask_app))
+        return web_app
+
+    async def _wsgi_fallback(self, flask_app, request):
+        body = await request.read()
+        builder = EnvironBuilder(
+            path=request.path,
+            method=request.method,
+            query_string=request.query_string,
+            headers=list(request.headers.items()),
+            data=body,
+        )
+        environ = builder.get_environ()
+        environ["REMOTE_ADDR"] = request.remote or ""
+
+        def _call():
+            app_iter, status, headers = run_wsgi_app(flask_app, environ, buffered=True)
+            try:
+                return status, headers, b"".join(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+
+        status, headers, payload = await self.run_blocking(_call)
+        resp_headers = CIMultiDict(
+            (k, v) for k, v in headers.items() if k.lower() not in ("content-length", "transfer-encoding")
+        )
+        return web.Response(status=int(status.split()[0]), headers=resp_headers, body=payload)
+
+    def serve_forever(self, web_app, host, port):
+        """在事件循环中启动 HTTP 服务并阻塞当前线程"""
+        async def _start():
+            runner = web.AppRunner(web_app)
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            print(f"[Dispatcher] Serving on http://{host}:{port}")
+            return runner
+
+        self.run_sync(_start())
+        self._thread.join()
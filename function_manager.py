@@ -1,11 +1,76 @@
 import docker
+import json
 import time
 import threading
 import os
+import socket
 import requests
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from container_events import readiness, MANAGED_LABEL, FUNCTION_LABEL, IMAGE_LABEL, CONFIG_LABEL
+from keepalive_policy import FixedKeepAlivePolicy, PoolTiers
+from resources import ResourceProfile
+from runtime_backends import DockerBackend, PortConflict
+
+
+class ManagerOverloaded(Exception):
+    """函数已达到 max_containers 上限，且请求在等待队列中超时或队列已满"""
+    pass
+
+
+class HostPortAllocator:
+    """
+    所有 FunctionManager 共享的宿主端口分配器。
+    创建容器前预先分配端口并显式映射，不再需要 inspect 轮询 docker 分配的随机端口。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_use = set()
+
+    @staticmethod
+    def _is_free(port):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(("0.0.0.0", port))
+                return True
+            except OSError:
+                return False
+
+    def allocate(self, start):
+        with self.lock:
+            for port in range(start, 65536):
+                if port not in self.in_use and self._is_free(port):
+                    self.in_use.add(port)
+                    return port
+        raise RuntimeError(f"No free host port at or above {start}")
+
+    def reserve(self, port):
+        """接管已有容器时占用它原来映射的端口"""
+        with self.lock:
+            self.in_use.add(port)
+
+    def release(self, port):
+        with self.lock:
+            self.in_use.discard(port)
+
+
+port_allocator = HostPortAllocator()
+
+# 所有 FunctionManager 共享的有界容器创建线程池：预热和排队请求触发的创建都在这里并发执行，
+# 同时限制同一时刻 docker 上并发启动的容器数量
+CREATION_WORKERS = int(os.environ.get('FAAS_CREATION_WORKERS', 8))
+creation_pool = ThreadPoolExecutor(max_workers=CREATION_WORKERS, thread_name_prefix="container-create")
+
+# 分层容器池中运行中空闲容器之后的各层，按降级顺序
+TIERS = ("paused", "stopped")
+
 
 class FunctionManager:
-    def __init__(self, function_name, image_name, container_port, host_storage_path, host_port_start=8000, idle_timeout=300, min_idle_containers=1):
+    def __init__(self, function_name, image_name, container_port, host_storage_path, host_port_start=8000, idle_timeout=300, min_idle_containers=1, on_container_removed=None,
+                 max_containers=16, queue_timeout=60, max_queue_length=None, ready_url=None,
+                 keepalive_policy=None, container_memory_mb=256, placement=None,
+                 resources=None, autoscaler=None, tiers=None, config=None, adopted=None, backend=None,
+                 on_cpuset_changed=None):
         self.function_name = function_name
         self.image_name = image_name
         self.container_port = container_port
@@ -13,22 +78,103 @@ class FunctionManager:
         self.host_storage_path = host_storage_path
         self.idle_timeout = idle_timeout
         self.min_idle_containers = min_idle_containers
-        self.docker_client = docker.from_env()
+        # keep-alive / 预热策略：决定保留多少空闲容器、空闲多久回收；默认等价于固定 idle_timeout + min_idle_containers
+        self.keepalive_policy = keepalive_policy or FixedKeepAlivePolicy(idle_timeout, min_idle_containers)
+        self.container_memory_mb = container_memory_mb  # 估算 keep-alive 内存开销用
+        # 容器的 CPU 配额 / 内存上限 / CPU shares，默认 0.2 个 CPU；CPU 配额也是去噪基准缓存 key 的一部分
+        self.resources = resources or ResourceProfile()
+        # 纵向自动伸缩 (resources.VerticalAutoscaler)：None 表示不伸缩
+        self.autoscaler = autoscaler
+        # 放置策略 (placement.InterferenceAwarePlacement)：创建容器前选定 cpuset；None 表示由 docker / 内核决定
+        self.placement = placement
+        # 获取容器的方式：warm (运行中的空闲容器) / queued / cold，以及从暂停层、停止层恢复的 paused / stopped
+        self.start_stats = {"warm": 0, "cold": 0, "queued": 0, "paused": 0, "stopped": 0}
+        self.idle_container_seconds = 0.0
+        self._idle_accounting_ts = time.time()
+        self.on_container_removed = on_container_removed  # 回调 (container_id, host_port)，用于释放该容器的连接池和计数器
+        self.on_cpuset_changed = on_cpuset_changed  # 回调 (container_id)，纵向伸缩改变了容器的 cpuset (按 CPU 打开的计数器需要重新打开)
+        # 背压：容器数量上限 + FIFO 等待队列
+        self.max_containers = max_containers
+        self.queue_timeout = queue_timeout
+        self.max_queue_length = max_queue_length  # None 表示不限制队列长度
+        # 就绪通知：容器内 proxy 启动后 POST {ready_url}/{容器名}；None 表示只靠 /status 兜底探测
+        self.ready_url = ready_url
+        self.ready_probe_interval = 1.0
+        self.wait_queue = deque()  # [(Future, enqueue_time)]，Future 的结果为 (host_port, container_id)
+        self.pending_creations = 0  # 正在创建中的容器数，计入 max_containers
+        self.queue_stats = {"enqueued": 0, "served_from_queue": 0, "timeouts": 0, "rejected": 0, "total_wait": 0.0, "max_wait": 0.0}
+        self.recent_waits = deque(maxlen=1000)
+        # 预热进度
+        self.prewarm_in_flight = 0
+        self.prewarm_stats = {"created": 0, "failed": 0, "last_started": None, "last_completed": None}
+        self.creation_stats = {"created": 0, "failed": 0}  # 所有容器创建 (预热 + 为排队请求创建)
+        # 运行时后端 (runtime_backends)：docker 容器 (默认) 或本机 proxy.py 子进程
+        self.backend = backend or DockerBackend()
         self.containers = {}  # {container_id: {"container_obj": ..., "status": "idle/busy", "last_active": timestamp, "host_port": ...}}
+        # 空闲容器 free list：右端是最近释放的容器 (LIFO 复用缓存最热的容器)，左端是空闲最久的容器。
+        # 采用惰性删除：被移除/失效的容器 id 可能仍留在其中，弹出时跳过。
+        self.idle_stack = deque()
+        self.idle_count = 0  # 随状态变化增量维护，避免每次统计都扫描 self.containers
+        self.busy_count = 0
+        # 分层容器池：暂停层 / 停止层各自的 free list (同样是右端最新、惰性删除) 和计数
+        self.tiers = tiers or PoolTiers()
+        self.tier_stacks = {tier: deque() for tier in TIERS}
+        self.tier_counts = {tier: 0 for tier in TIERS}
+        self.demoting = {tier: 0 for tier in TIERS}  # 正在降级到该层的容器数，计入该层容量
+        self.pending_resumes = 0  # 正在为排队请求恢复的容器数
+        self.precreate_in_flight = 0  # 正在预先创建的停止层容器数
+        self.resume_stats = {tier: {"resumed": 0, "failed": 0, "total_latency": 0.0, "max_latency": 0.0} for tier in TIERS}
+        # /create_manager 的请求体，写入容器的 label，控制器重启后据此重建 FunctionManager；None 表示不可接管
+        self.config = config
+        self.adopted_count = 0
+        self.adopt_removed = {}  # 接管时删除的容器数，按原因
         self.lock = threading.Lock()
         self.next_host_port = host_port_start
         self._cleaner_stop_event = threading.Event()
 
+        # 控制器重启后接管的容器 (reconcile.py)，在预热之前加入池中，避免重复创建
+        if adopted:
+            self._adopt_containers(adopted)
+
+        # 订阅 docker 事件 (或进程后端的退出事件)：容器退出时立即感知，而不是等 cleaner 的 reload()
+        self.backend.subscribe(self._on_container_event)
+
         self.cleaner_thread = threading.Thread(target=self._run_cleaner, daemon=True)
         self.cleaner_thread.start()
         print(f"FunctionManager for {self.function_name} initialized.")
+        # 创建后立即开始预热，不等 cleaner 的第一次唤醒
+        self._schedule_prewarm()
 
     def _get_next_host_port(self):
         with self.lock:
-            port = self.next_host_port
-            self.next_host_port += 1
-            # TODO: Add logic to check if port is actually free
-            return port
+            start = self.next_host_port
+        port = port_allocator.allocate(start)
+        with self.lock:
+            self.next_host_port = port + 1 if port < 65535 else self.host_port_start
+        return port
+
+    def _on_container_event(self, action, container_id, attributes):
+        if action not in ("die", "oom"):
+            return
+        with self.lock:
+            data = self.containers.get(container_id)
+            if data is not None and data["status"] == "idle":
+                # 空闲容器已退出：标记后由 cleaner 移除，_pop_idle_locked 会跳过它
+                self._set_status_locked(data, "exited")
+                print(f"[Events] Idle container {container_id[:12]} for {self.function_name} exited ({action}).")
+
+    def _probe_container_service(self, host_port, timeout=0.5):
+        try:
+            response = requests.get(f"http://127.0.0.1:{host_port}/status", timeout=timeout)
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                except Exception:
+                    data = {}
+                return data.get("status") in ["new", "ok", "ready"]
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            pass
+        return False
 
     def _wait_for_container_service(self, host_port, timeout=30, check_interval=0.01):
         """
@@ -37,87 +183,88 @@ class FunctionManager:
         """
         start_time = time.time()
         while time.time() - start_time < timeout:
-            try:
-                response = requests.get(f"http://127.0.0.1:{host_port}/status", timeout=check_interval)
-                if response.status_code == 200:
-                    try:
-                        data = response.json()
-                    except Exception:
-                        data = {}
-                    if data.get("status") in ["new", "ok", "ready"]:
-                        print(f"Container service on port {host_port} is ready.")
-                        return True
-            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                # 只记录少量调试信息以免太噪
-                # print(f"status check: {e}")  # 可按需打开
-                pass
+            if self._probe_container_service(host_port, timeout=max(check_interval, 0.1)):
+                print(f"Container service on port {host_port} is ready.")
+                return True
             time.sleep(check_interval)
         print(f"Container service on port {host_port} did not become ready within {timeout} seconds.")
         return False
 
-    def _create_new_container(self):
-        # 使用 Docker 随机映射宿主端口，避免端口冲突
+    def _wait_until_ready(self, host_port, waiter, timeout=30):
+        """
+        等待 proxy 推送的 ready 信号（或 docker die 事件），冷启动延迟只取决于容器启动时间。
+        没有收到推送时（旧镜像 / 回调地址不可达）每 ready_probe_interval 秒探测一次 /status 兜底。
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"Container service on port {host_port} did not become ready within {timeout} seconds.")
+                return False
+            if waiter.wait(timeout=min(remaining, self.ready_probe_interval)):
+                if not waiter.ok:
+                    print(f"Container on port {host_port} failed before ready: {waiter.reason}")
+                return waiter.ok
+            if self._probe_container_service(host_port):
+                return True
+
+    def _container_labels(self, pooled=True):
+        labels = {MANAGED_LABEL: "true", FUNCTION_LABEL: self.function_name}
+        if pooled and self.config is not None:
+            labels[IMAGE_LABEL] = self.image_name
+            labels[CONFIG_LABEL] = json.dumps(self.config, sort_keys=True)
+        return labels
+
+    def _start_container(self, overrides=None, pooled=True):
+        """
+        启动一个容器并等待其中的 proxy 就绪，返回 (container, host_port)，失败返回 (None, None)。
+        overrides: 覆盖 docker run 的参数 (例如 cpuset_cpus、cpu_quota)
+        pooled: 是否为容器池中的容器；独立容器不带配置 label，控制器重启后不会被接管
+        """
+        # 预先分配宿主端口并显式映射，省去 inspect 轮询
         container_name = f"{self.function_name}-{os.urandom(4).hex()}"
+        waiter = readiness.expect(container_name)
+        container = None
+        host_port = None
         try:
             print(f"Creating new container '{container_name}' ...")
+            for attempt in range(3):
+                host_port = self._get_next_host_port()
 
-            # --- 准备 docker run 的参数 ---
-            run_kwargs = {
-                "detach": True,
-                "ports": {f"{self.container_port}/tcp": None}, #
-                "name": container_name,
-                "nano_cpus": 200000000
-            }
-
-            # --- 仅在 host_storage_path 存在时才添加 volumes ---
-            if self.host_storage_path:
-                print(f"  > Mounting volume: {self.host_storage_path} -> /storage")
-                run_kwargs["volumes"] = {self.host_storage_path: {'bind': '/storage', 'mode': 'rw'}}
-            else:
-                print("  > No host_storage_path provided. Running without volume.")
-            
-            # --- 使用 **kwargs 运行容器 ---
-            container = self.docker_client.containers.run( #
-                self.image_name,
-                **run_kwargs
-            )
+                # --- 通过运行时后端启动 (docker run 或 proxy.py 子进程)，overrides 覆盖资源参数 ---
+                environment = {"FAAS_READY_URL": f"{self.ready_url}/{container_name}"} if self.ready_url else None
+                resources = self.resources.docker_kwargs()
+                resources.update(overrides or {})
+                try:
+                    container = self.backend.run(container_name, self.image_name, host_port, self.container_port,
+                                                 self._container_labels(pooled), environment=environment,
+                                                 storage_path=self.host_storage_path, resources=resources)
+                    break
+                except PortConflict as e:
+                    # 端口在检查和绑定之间被其他进程占用：换一个端口重试
+                    port_allocator.release(host_port)
+                    host_port = None
+                    print(f"  > Host port conflict ({e}), retrying...")
+            if container is None:
+                raise RuntimeError("no usable host port after 3 attempts")
             print(f"Created container id={container.id[:12]}")
         except docker.errors.ImageNotFound:
             print(f"Error: Image '{self.image_name}' not found.")
-            return None
+            readiness.discard(container_name)
+            if host_port:
+                port_allocator.release(host_port)
+            return None, None
         except Exception as e:
             print(f"Error creating container '{container_name}': {e}")
-            return None
+            readiness.discard(container_name)
+            if host_port:
+                port_allocator.release(host_port)
+            return None, None
 
-        # 等待 Docker 完成端口映射
-        host_port = None
-        for _ in range(60):  # 最多等待约 30s（60*0.5）
-            try:
-                container.reload()
-                mapping = container.attrs.get("NetworkSettings", {}).get("Ports", {}).get(f"{self.container_port}/tcp")
-                if mapping and mapping[0].get("HostPort"):
-                    host_port = int(mapping[0]["HostPort"])
-                    break
-            except Exception as e:
-                print("container inspect exception:", e)
-            time.sleep(0.5)
-
-        if not host_port:
-            print(f"Service mapping not available for container {container.id[:12]}; attrs={container.attrs}")
-            try:
-                print("Container logs (tail 50):")
-                print(container.logs(tail=50).decode(errors='ignore'))
-            except Exception:
-                pass
-            try:
-                container.stop(timeout=1)
-                container.remove(force=True)
-            except Exception as e:
-                print("cleanup error:", e)
-            return None
-
-        # 健康检查
-        if not self._wait_for_container_service(host_port, timeout=30, check_interval=0.1):
+        # 健康检查：等待 proxy 的 ready 推送
+        ready = self._wait_until_ready(host_port, waiter, timeout=30)
+        readiness.discard(container_name)
+        if not ready:
             print(f"Service for newly created container {container.id[:12]} on port {host_port} not ready, removing it.")
             try:
                 print("Container logs (tail 80):")
@@ -129,75 +276,622 @@ class FunctionManager:
                 container.remove(force=True)
             except Exception as e:
                 print("Error cleaning up failed new container:", e)
+            port_allocator.release(host_port)
+            return None, None
+        # containers.run() 返回的是 create 时的对象，缓存的 status 仍为 "created"；
+        # 不刷新的话 _pop_idle_locked 会在 cleaner 下一次 reload 之前把这个健康的容器当作已退出丢弃
+        try:
+            container.reload()
+        except Exception as e:
+            print(f"Error reloading container {container.id[:12]}: {e}")
+        return container, host_port
+
+    def _create_new_container(self, tier=None):
+        """创建容器并加入池中；tier="stopped" 时在 proxy 就绪后立即停止，放入停止层 (预先创建)"""
+        lease = self.placement.reserve(self.function_name, self.resources.cpus) if self.placement else None
+        container, host_port = self._start_container(lease.overrides() if lease else None)
+        if container is None:
+            if lease:
+                self.placement.release(lease)
             return None
+        if lease:
+            self.placement.bind(lease, container.id)
+        if tier == "stopped":
+            try:
+                container.stop(timeout=5)
+            except Exception as e:
+                print(f"Error stopping pre-created container {container.id[:12]}: {e}. Keeping it running.")
+                tier = None
+        self._register_container(container, host_port, lease, tier)
+        print(f"Container '{container.name}' created id={container.id[:12]} host_port={host_port}. Service ready.")
+        return container.id
+
+    # --- 不进入容器池的独立容器 (干扰矩阵等实验使用，由调用方负责移除) ---
+    def start_standalone_container(self, **overrides):
+        """返回 (container, host_port)，失败返回 (None, None)。阻塞调用"""
+        return self._start_container(overrides, pooled=False)
+
+    def remove_standalone_container(self, container, host_port):
+        try:
+            container.stop(timeout=1)
+            container.remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            print(f"Error removing standalone container {container.id[:12]}: {e}")
+        port_allocator.release(host_port)
 
+    # --- 纵向伸缩：docker update 原地修改运行中的容器，不需要重新冷启动 ---
+    def resize(self, cpus=None, memory_mb=None):
+        """修改函数的 CPU 配额 / 内存上限并应用到所有容器 (包括之后新建的)。阻塞调用，返回更新失败的容器数"""
         with self.lock:
-            self.containers[container.id] = {
+            if cpus is not None:
+                self.resources.cpus = float(cpus)
+            if memory_mb is not None:
+                self.resources.memory_mb = int(memory_mb)
+            kwargs = self.resources.docker_kwargs()
+            snapshot = [(cid, data["container_obj"], data.get("placement")) for cid, data in self.containers.items()]
+        failed = 0
+        for container_id, container_obj, lease in snapshot:
+            update = dict(kwargs)
+            saved = None
+            if lease and self.placement and cpus is not None:
+                # 配额超过已分到的 CPU 数时只改 cpu_quota 没有效果：同时扩大 (或缩小) cpuset
+                saved = lease.save()
+                self.placement.resize(lease, self.resources.cpus)
+                update.update(lease.overrides())
+            try:
+                container_obj.update(**update)
+            except Exception as e:
+                failed += 1
+                if saved is not None:
+                    self.placement.restore(lease, saved)  # 恢复为容器实际的 cpuset
+                print(f"[Resize] Failed to update container {container_id[:12]} for {self.function_name}: {e}")
+                continue
+            if saved is not None and sorted(saved[1]) != sorted(lease.cpus) and self.on_cpuset_changed:
+                try:
+                    self.on_cpuset_changed(container_id)
+                except Exception as e:
+                    print(f"on_cpuset_changed callback error: {e}")
+        print(f"[Resize] {self.function_name} -> {self.resources.to_dict()} ({len(snapshot) - failed}/{len(snapshot)} containers updated)")
+        return failed
+
+    def _register_container(self, container, host_port, lease=None, tier=None, initialized_action=None):
+        """新容器加入池中；如果有请求在排队，直接交给队首的请求。tier 不为 None 时放入对应的层"""
+        with self.lock:
+            data = {
                 "container_obj": container,
-                "status": "idle",
+                "status": None,
                 "last_active": time.time(),
-                "host_port": host_port
+                "host_port": host_port,
+                "initialized_action": initialized_action,  # 容器内 proxy 已经 /init 过的 action，None 表示尚未初始化
+                "placement": lease  # 放置策略分配的 CPU，容器移除时归还
             }
-        print(f"Container '{container_name}' created id={container.id[:12]} host_port={host_port}. Service ready.")
-        return container.id
-
+            self.containers[container.id] = data
+            if tier is not None:
+                self._set_status_locked(data, tier)
+                self.tier_stacks[tier].append(container.id)
+                return
+            self._make_idle_locked(container.id, data, source="cold")
 
-    def get_container_for_request(self):
-        with self.lock:
-            # 寻找空闲容器
-            for container_id, data in self.containers.items():
-                if data["status"] == "idle" and data["container_obj"].status == 'running':
-                    data["status"] = "busy"
-                    data["last_active"] = time.time()
-                    print(f"Assigned existing idle container {container_id[:12]} for {self.function_name}.")
-                    return data["host_port"], container_id
-
-        # 如果没有空闲容器，则创建一个新容器
-        new_container_id = self._create_new_container()
-        if new_container_id:
+    # --- 控制器重启后接管已有的容器 ---
+    def _adopt_containers(self, adopted):
+        """
+        adopted: [(container, host_port, tier, initialized_action)]，tier 为 None (运行中，已通过健康检查)、
+        "paused" 或 "stopped"。按当前的资源配置和放置策略 docker update 后加入池中；
+        超出 max_containers 或该层容量、update 失败、以及无法改成当前内存配置的容器直接删除
+        """
+        for container, host_port, tier, initialized_action in adopted:
             with self.lock:
-                # 确保新创建的容器也设置为busy并返回其端口
-                container_data = self.containers[new_container_id]
-                container_data["status"] = "busy" # 新创建的容器直接用于请求，所以是busy
-                container_data["last_active"] = time.time()
-                print(f"Assigned newly created container {new_container_id[:12]} for {self.function_name}.")
-                return container_data["host_port"], new_container_id
+                keep = self.max_containers is None or len(self.containers) < self.max_containers
+                if tier is not None:
+                    keep = keep and self.tier_counts[tier] < self.tiers.capacity(tier)
+            reason = "surplus"
+            if keep and not self.resources.memory_mb and (container.attrs.get("HostConfig") or {}).get("Memory"):
+                # docker update 不能去掉内存上限 (Memory=0 表示不修改)：上一次的配置限制了内存而当前配置不限制时不接管
+                keep, reason = False, "stale memory limit"
+            lease = None
+            if keep:
+                lease = self.placement.reserve(self.function_name, self.resources.cpus) if self.placement else None
+                kwargs = self.resources.docker_kwargs()
+                kwargs.update(lease.overrides() if lease else {})
+                try:
+                    container.update(**kwargs)
+                except Exception as e:
+                    print(f"[Adopt] Failed to update container {container.id[:12]} for {self.function_name}: {e}")
+                    keep, reason = False, "update failed"
+            if not keep:
+                if lease:
+                    self.placement.release(lease)
+                print(f"[Adopt] Removing container {container.id[:12]} for {self.function_name} ({reason}).")
+                self.adopt_removed[reason] = self.adopt_removed.get(reason, 0) + 1
+                try:
+                    container.remove(force=True)
+                except Exception as e:
+                    print(f"[Adopt] Error removing container {container.id[:12]}: {e}")
+                continue
+            port_allocator.reserve(host_port)
+            if lease:
+                self.placement.bind(lease, container.id)
+            self._register_container(container, host_port, lease, tier, initialized_action)
+            self.adopted_count += 1
+            print(f"[Adopt] Container {container.id[:12]} for {self.function_name} adopted as {tier or 'idle'} (host_port={host_port}).")
+
+    # --- 状态与计数：所有状态变化都经过这里，保证 idle_count / busy_count 与 self.containers 一致 ---
+    def _account_idle_locked(self):
+        # 对空闲容器数随时间积分，得到 keep-alive 的容器·秒
+        now = time.time()
+        self.idle_container_seconds += self.idle_count * (now - self._idle_accounting_ts)
+        self._idle_accounting_ts = now
+
+    def _set_status_locked(self, data, status):
+        old = data["status"]
+        if old == "idle" or status == "idle":
+            self._account_idle_locked()
+        if old == "idle":
+            self.idle_count -= 1
+        elif old == "busy":
+            self.busy_count -= 1
+        elif old in self.tier_counts:
+            self.tier_counts[old] -= 1
+        if status == "idle":
+            self.idle_count += 1
+        elif status == "busy":
+            self.busy_count += 1
+        elif status in self.tier_counts:
+            self.tier_counts[status] += 1
+        data["status"] = status
+
+    def _make_idle_locked(self, container_id, data, source="queued"):
+        """容器变为空闲：优先交给排队的请求，否则压入 free list。调用方需持有 self.lock"""
+        data["last_active"] = time.time()
+        if self._hand_off_locked(container_id, source):
+            return False
+        self._set_status_locked(data, "idle")
+        self.idle_stack.append(container_id)
+        return True
+
+    def _pop_idle_locked(self):
+        """从 free list 右端弹出最近释放的空闲容器，摊还 O(1)。调用方需持有 self.lock"""
+        while self.idle_stack:
+            container_id = self.idle_stack.pop()
+            data = self.containers.get(container_id)
+            if data is None or data["status"] != "idle":
+                continue  # 惰性删除留下的失效条目
+            if data["container_obj"].status != 'running':
+                # 容器已经退出，交给 cleaner 移除
+                self._set_status_locked(data, "exited")
+                continue
+            return container_id, data
         return None, None
 
-    def release_container(self, container_id):
+    def _pop_tier_locked(self):
+        """依次从暂停层、停止层弹出最近降级的容器并标记为 resuming，返回 (container_id, data, tier)。调用方需持有 self.lock"""
+        for tier in TIERS:
+            stack = self.tier_stacks[tier]
+            while stack:
+                container_id = stack.pop()
+                data = self.containers.get(container_id)
+                if data is None or data["status"] != tier:
+                    continue
+                self._set_status_locked(data, "resuming")
+                return container_id, data, tier
+        return None, None, None
+
+    # --- 容器获取：空闲容器 -> 排队 (必要时恢复暂停/停止的容器，或在后台创建新容器) ---
+    def request_container(self):
+        """
+        非阻塞地申请一个容器，返回 concurrent.futures.Future，结果为 (host_port, container_id)；
+        完成时 fut.start_type 为 "warm" / "queued" / "cold" / "paused" / "stopped"，fut.queue_wait 为排队时间。
+        - 有空闲容器时立即完成；
+        - 否则进入 FIFO 等待队列，在后台恢复一个暂停层 / 停止层的容器，
+          都没有且容器总数未达 max_containers 时创建一个新容器；
+        - 队列已满时 Future 直接以 ManagerOverloaded 失败。
+        超时后必须调用 cancel_request(fut) 退出队列。
+        """
+        fut = Future()
+        with self.lock:
+            self.keepalive_policy.record_arrival(time.time())
+            # 从 free list 取空闲容器
+            container_id, data = self._pop_idle_locked()
+            if container_id:
+                self.start_stats["warm"] += 1
+                fut.start_type = "warm"
+                fut.queue_wait = 0.0
+                self._set_status_locked(data, "busy")
+                data["last_active"] = time.time()
+                print(f"Assigned existing idle container {container_id[:12]} for {self.function_name}.")
+                fut.set_result((data["host_port"], container_id))
+                return fut
+
+            if self.max_queue_length is not None and len(self.wait_queue) >= self.max_queue_length:
+                self.queue_stats["rejected"] += 1
+                fut.set_exception(ManagerOverloaded(
+                    f"{self.function_name}: wait queue full ({len(self.wait_queue)}/{self.max_queue_length})"))
+                return fut
+
+            self.wait_queue.append((fut, time.time()))
+            self.queue_stats["enqueued"] += 1
+            job = self._reserve_supply_locked()
+
+        if job:
+            creation_pool.submit(*job)
+        return fut
+
+    def cancel_request(self, fut):
+        """请求放弃等待。返回 True 表示已成功退出队列；False 表示在此之前已经拿到了容器 (fut.result() 可用)"""
+        with self.lock:
+            if not fut.cancel():
+                return False
+            for i, (queued_fut, _) in enumerate(self.wait_queue):
+                if queued_fut is fut:
+                    del self.wait_queue[i]
+                    break
+            self.queue_stats["timeouts"] += 1
+            return True
+
+    def get_container_for_request(self, timeout=None):
+        """同步版本：阻塞直到拿到容器，排队超时抛出 ManagerOverloaded；创建失败返回 (None, None)"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        fut = self.request_container()
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeoutError:
+            if self.cancel_request(fut):
+                raise ManagerOverloaded(f"{self.function_name}: no container available within {timeout}s")
+            return fut.result()
+
+    def _reserve_creation_locked(self):
+        """队列中还有请求且未达到上限时，预占一个创建名额。调用方需持有 self.lock"""
+        if not self.wait_queue:
+            return False
+        if self.max_containers is not None and len(self.containers) + self.pending_creations >= self.max_containers:
+            return False
+        # 已经在创建 / 恢复中的容器足够覆盖排队的请求，不再多建
+        if self.pending_creations + self.pending_resumes >= len(self.wait_queue):
+            return False
+        self.pending_creations += 1
+        return True
+
+    def _reserve_supply_locked(self):
+        """
+        为排队的请求准备一个容器：优先恢复暂停层、停止层的容器，否则预占一个创建名额。
+        返回要提交到 creation_pool 的 (函数, 参数...)，不需要时返回 None。调用方需持有 self.lock
+        """
+        if not self.wait_queue or self.pending_creations + self.pending_resumes >= len(self.wait_queue):
+            return None
+        container_id, data, tier = self._pop_tier_locked()
+        if container_id:
+            self.pending_resumes += 1
+            return (self._resume_for_queue, container_id, tier)
+        if self._reserve_creation_locked():
+            return (self._create_for_queue,)
+        return None
+
+    def _create_for_queue(self):
+        try:
+            new_id = self._create_new_container()
+        except Exception as e:
+            print(f"Error creating container for queued request: {e}")
+            new_id = None
+        with self.lock:
+            self.pending_creations -= 1
+            self.creation_stats["created" if new_id else "failed"] += 1
+            if not new_id:
+                # 创建失败：让队首请求失败返回，避免它一直等到超时
+                while self.wait_queue:
+                    fut, enqueued_at = self.wait_queue.popleft()
+                    if fut.set_running_or_notify_cancel():
+                        fut.set_result((None, None))
+                        break
+            job = self._reserve_supply_locked()
+        if job:
+            creation_pool.submit(*job)
+
+    # --- 分层容器池：恢复与降级 ---
+    def _resume_container(self, container_obj, host_port, tier):
+        """暂停层: docker unpause；停止层: docker start 并等待 proxy 重新就绪。阻塞调用，返回是否成功"""
+        try:
+            if tier == "paused":
+                container_obj.unpause()
+            else:
+                waiter = readiness.expect(container_obj.name)
+                try:
+                    container_obj.start()
+                    if not self._wait_until_ready(host_port, waiter, timeout=30):
+                        return False
+                finally:
+                    readiness.discard(container_obj.name)
+            # 刷新缓存的 status，否则 _pop_idle_locked 会把它当作已退出的容器
+            container_obj.reload()
+            return True
+        except Exception as e:
+            print(f"[Tiers] Failed to resume {tier} container {container_obj.id[:12]} for {self.function_name}: {e}")
+            return False
+
+    def _resume_for_queue(self, container_id, tier):
+        with self.lock:
+            data = self.containers.get(container_id)
+        start = time.time()
+        ok = data is not None and self._resume_container(data["container_obj"], data["host_port"], tier)
+        latency = time.time() - start
+        remove = False
+        with self.lock:
+            self.pending_resumes -= 1
+            stats = self.resume_stats[tier]
+            current = data is not None and self.containers.get(container_id) is data
+            if ok and current:
+                stats["resumed"] += 1
+                stats["total_latency"] += latency
+                stats["max_latency"] = max(stats["max_latency"], latency)
+                # 交给队首的请求 (start_type 为 tier)；请求已超时离开时成为普通的空闲容器
+                self._make_idle_locked(container_id, data, source=tier)
+            elif current:
+                stats["failed"] += 1
+                self._set_status_locked(data, "removing")
+                remove = True
+            job = self._reserve_supply_locked()
+        if ok:
+            print(f"[Tiers] Resumed {tier} container {container_id[:12]} for {self.function_name} in {latency * 1000:.1f}ms.")
+        if remove:
+            self._remove_container(container_id, data["container_obj"])
+        if job:
+            creation_pool.submit(*job)
+
+    def _schedule_demotion_locked(self, container_id, data, from_tier, demotions, removals):
+        """
+        把超过保留时间的容器降到下一层 (from_tier 为 None 表示运行中的空闲容器)；
+        下一层已满时继续往下，都满了直接删除。调用方需持有 self.lock，实际的 docker 操作由调用方在锁外执行
+        """
+        order = (None,) + TIERS
+        for tier in order[order.index(from_tier) + 1:]:
+            if self.tier_counts[tier] + self.demoting[tier] < self.tiers.capacity(tier):
+                self._set_status_locked(data, "demoting")
+                self.demoting[tier] += 1
+                demotions.append((container_id, data, from_tier, tier))
+                return
+        self._set_status_locked(data, "removing")
+        removals.append((container_id, data["container_obj"]))
+
+    def _demote_container(self, container_id, data, from_tier, tier):
+        container_obj = data["container_obj"]
+        try:
+            if tier == "paused":
+                container_obj.pause()
+            else:
+                if from_tier == "paused":
+                    container_obj.unpause()  # 部分 docker 版本不能直接 stop 暂停中的容器
+                container_obj.stop(timeout=5)
+            # 刷新缓存的 status：删除时据此判断是否为暂停中的容器
+            container_obj.reload()
+            ok = True
+        except Exception as e:
+            print(f"[Tiers] Failed to move container {container_id[:12]} for {self.function_name} to {tier}: {e}")
+            ok = False
+        with self.lock:
+            self.demoting[tier] -= 1
+            current = self.containers.get(container_id) is data
+            if ok and current:
+                if tier == "stopped":
+                    data["initialized_action"] = None  # 重新启动后 proxy 需要重新 /init
+                    data.pop("pid", None)  # 重新启动后 init 进程的 pid 会变
+                data["last_active"] = time.time()  # 进入该层的时间
+                self._set_status_locked(data, tier)
+                self.tier_stacks[tier].append(container_id)
+            elif current:
+                self._set_status_locked(data, "removing")
+        if ok and current:
+            print(f"[Tiers] Container {container_id[:12]} for {self.function_name} moved to {tier}.")
+            if tier == "stopped" and self.on_container_removed:
+                # 停止后容器的 cgroup 和进程都不在了：释放连接池和计数器，重新启动后再按需挂接
+                try:
+                    self.on_container_removed(container_id, data.get("host_port"))
+                except Exception as e:
+                    print(f"on_container_removed callback error: {e}")
+        elif current:
+            self._remove_container(container_id, container_obj)
+
+    def tier_status(self):
+        with self.lock:
+            starts = dict(self.start_stats)
+            tiers = {tier: {"containers": self.tier_counts[tier], "demoting": self.demoting[tier],
+                            "capacity": self.tiers.capacity(tier), "resume": dict(self.resume_stats[tier])}
+                     for tier in TIERS}
+            config = self.tiers.describe()
+        total = sum(starts.values())
+        for tier, status in tiers.items():
+            resume = status["resume"]
+            resume["mean_latency"] = resume["total_latency"] / resume["resumed"] if resume["resumed"] else None
+            status["hits"] = starts[tier]
+            status["hit_rate"] = starts[tier] / total if total else 0.0
+        return {"config": config, "tiers": tiers, "warm_hit_rate": starts["warm"] / total if total else 0.0,
+                "cold_start_ratio": starts["cold"] / total if total else 0.0}
+
+    # --- 预热：在共享线程池中并发创建，补足策略要求的空闲容器数 ---
+    def _schedule_prewarm(self):
+        """计算空闲容器缺口并立即提交并发创建任务。可在任意线程调用，不阻塞"""
+        if self._cleaner_stop_event.is_set():
+            return 0
+        with self.lock:
+            target_idle, _ = self.keepalive_policy.targets(time.time())
+            deficit = target_idle - self.idle_count - self.prewarm_in_flight
+            # 停止层的预先创建排在空闲容器之后
+            stopped = self.tiers.min_stopped - self.tier_counts["stopped"] - self.demoting["stopped"] - self.precreate_in_flight
+            if self.max_containers is not None:
+                room = self.max_containers - len(self.containers) - self.pending_creations
+                deficit = min(deficit, room)
+                stopped = min(stopped, room - max(0, deficit))
+            deficit, stopped = max(0, deficit), max(0, stopped)
+            if deficit == 0 and stopped == 0:
+                return 0
+            self.pending_creations += deficit + stopped
+            self.prewarm_in_flight += deficit
+            self.precreate_in_flight += stopped
+            self.prewarm_stats["last_started"] = time.time()
+        if deficit:
+            print(f"[Prewarm] Scheduling {deficit} pre-warm containers for {self.function_name}.")
+        if stopped:
+            print(f"[Prewarm] Scheduling {stopped} pre-created stopped containers for {self.function_name}.")
+        for _ in range(deficit):
+            creation_pool.submit(self._prewarm_one)
+        for _ in range(stopped):
+            creation_pool.submit(self._prewarm_one, "stopped")
+        return deficit
+
+    def _prewarm_one(self, tier=None):
+        new_id = None
+        try:
+            new_id = self._create_new_container(tier)
+        except Exception as e:
+            print(f"[Prewarm] Exception while creating pre-warm container: {e}")
+        with self.lock:
+            self.pending_creations -= 1
+            if tier == "stopped":
+                self.precreate_in_flight -= 1
+            else:
+                self.prewarm_in_flight -= 1
+            self.prewarm_stats["created" if new_id else "failed"] += 1
+            self.creation_stats["created" if new_id else "failed"] += 1
+            self.prewarm_stats["last_completed"] = time.time()
+        if new_id:
+            print(f"[Prewarm] Pre-warmed container {new_id[:12]} created for {self.function_name}.")
+        else:
+            print(f"[Prewarm] Failed to create pre-warm container for {self.function_name} (check logs).")
+
+    def prewarm_status(self):
+        with self.lock:
+            status = dict(self.prewarm_stats)
+            status["target_idle"], _ = self.keepalive_policy.targets(time.time())
+            status["idle"] = self.idle_count
+            status["in_flight"] = self.prewarm_in_flight
+        status["satisfied"] = status["idle"] >= status["target_idle"]
+        return status
+
+    def keepalive_status(self):
+        with self.lock:
+            self._account_idle_locked()
+            stats = dict(self.start_stats)
+            stats["idle_container_seconds"] = self.idle_container_seconds
+            policy = self.keepalive_policy.describe()
+            stats["target_idle"], stats["keep_alive"] = self.keepalive_policy.targets(time.time())
+        total = sum(stats[start_type] for start_type in self.start_stats)
+        stats["cold_start_ratio"] = stats["cold"] / total if total else 0.0
+        stats["keepalive_memory_mb_seconds"] = stats["idle_container_seconds"] * self.container_memory_mb
+        stats["policy"] = policy
+        return stats
+
+    def _hand_off_locked(self, container_id, source):
+        """
+        把一个空闲容器交给等待队列中最早的请求。调用方需持有 self.lock。返回是否交接成功。
+        source: "cold" 表示新建的容器 (冷启动)，"queued" 表示其他请求刚释放的温容器
+        """
+        data = self.containers[container_id]
+        while self.wait_queue:
+            fut, enqueued_at = self.wait_queue.popleft()
+            if not fut.set_running_or_notify_cancel():
+                continue  # 请求已超时取消
+            now = time.time()
+            self._set_status_locked(data, "busy")
+            data["last_active"] = now
+            wait = now - enqueued_at
+            self.queue_stats["served_from_queue"] += 1
+            self.start_stats[source] += 1
+            fut.start_type = source  # 调用方据此区分冷启动 / 排队等到的温容器
+            fut.queue_wait = wait
+            self.queue_stats["total_wait"] += wait
+            self.queue_stats["max_wait"] = max(self.queue_stats["max_wait"], wait)
+            self.recent_waits.append(wait)
+            print(f"Handed container {container_id[:12]} to queued request for {self.function_name} (waited {wait:.3f}s).")
+            fut.set_result((data["host_port"], container_id))
+            return True
+        return False
+
+    def queue_status(self):
+        with self.lock:
+            stats = dict(self.queue_stats)
+            waits = sorted(self.recent_waits)
+            stats["queue_depth"] = len(self.wait_queue)
+            stats["pending_creations"] = self.pending_creations
+            stats["max_containers"] = self.max_containers
+        served = stats["served_from_queue"]
+        stats["avg_wait"] = stats["total_wait"] / served if served else 0.0
+        stats["p95_wait"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return stats
+
+    def get_initialized_action(self, container_id):
+        with self.lock:
+            data = self.containers.get(container_id)
+            return data.get("initialized_action") if data else None
+
+    def get_placement(self, container_id):
+        with self.lock:
+            data = self.containers.get(container_id)
+            return data.get("placement") if data else None
+
+    def mark_initialized(self, container_id, action):
         with self.lock:
             if container_id in self.containers:
-                self.containers[container_id]["status"] = "idle"
-                self.containers[container_id]["last_active"] = time.time()
-                print(f"Container {container_id[:12]} for {self.function_name} released and set to idle.")
+                self.containers[container_id]["initialized_action"] = action
+
+    def release_container(self, container_id):
+        with self.lock:
+            data = self.containers.get(container_id)
+            if data is not None and data["status"] == "busy":
+                if self._make_idle_locked(container_id, data):
+                    print(f"Container {container_id[:12]} for {self.function_name} released and set to idle.")
+
+    def _forget_container(self, container_id):
+        with self.lock:
+            data = self.containers.pop(container_id, None)
+            if data is not None:
+                self._set_status_locked(data, None)
+                port_allocator.release(data.get("host_port"))
+                if data.get("placement") and self.placement:
+                    self.placement.release(data["placement"])
+            # 腾出了名额：如果还有请求在排队，补建一个容器
+            job = self._reserve_supply_locked()
+        if job:
+            creation_pool.submit(*job)
+        # 容器被移除后立即检查是否需要补充预热容器
+        self._schedule_prewarm()
+        if data:
+            self._notify_removed(container_id, data)
+
+    def _notify_removed(self, container_id, data):
+        """释放控制器为该容器持有的资源 (连接池、常驻计数器、cgroup 文件)"""
+        if self.on_container_removed:
+            try:
+                self.on_container_removed(container_id, data.get("host_port"))
+            except Exception as e:
+                print(f"on_container_removed callback error: {e}")
 
     def _remove_container(self, container_id, container_obj):
         try:
             print(f"Stopping and removing container {container_id[:12]} (name: {container_obj.name}) for {self.function_name}...")
-            # 尝试停止容器，给定一个短的超时
-            container_obj.stop(timeout=5)
+            # 尝试停止容器，给定一个短的超时；暂停中的容器在部分 docker 版本上不能 stop，直接强制删除
+            if getattr(container_obj, "status", None) != "paused":
+                try:
+                    container_obj.stop(timeout=5)
+                except docker.errors.NotFound:
+                    raise
+                except Exception as e:
+                    print(f"Error stopping container {container_id[:12]}: {e}")
             # 强制删除容器，即使它仍在运行或停止失败
             container_obj.remove(force=True)
-            with self.lock:
-                if container_id in self.containers:
-                    del self.containers[container_id]
+            self._forget_container(container_id)
             print(f"Container {container_id[:12]} removed.")
         except docker.errors.NotFound:
             print(f"Container {container_id[:12]} not found, likely already removed.")
-            with self.lock:
-                if container_id in self.containers:
-                    del self.containers[container_id]
+            self._forget_container(container_id)
         except Exception as e:
             print(f"Error removing container {container_id[:12]}: {e}. Forcing internal cleanup.")
             # 即使移除失败，也要尝试从 internal 列表中删除，避免重复尝试
-            with self.lock:
-                if container_id in self.containers:
-                    del self.containers[container_id]
+            self._forget_container(container_id)
 
     def _run_cleaner(self):
         while not self._cleaner_stop_event.is_set():
             # 使用 wait，使线程可被快速唤醒停止
-            self._cleaner_stop_event.wait(timeout=30)
+            self._cleaner_stop_event.wait(timeout=self.keepalive_policy.check_interval())
             if self._cleaner_stop_event.is_set():
                 break
 
@@ -205,30 +899,56 @@ class FunctionManager:
             containers_to_remove = []
             current_time = time.time()
 
-            # 1) 计算哪些容器需要被移除（只在锁内做轻量操作）
+            # 1) 在锁外逐个刷新容器状态，docker API 调用不阻塞请求路径；已退出的空闲容器直接标记移除
+            with self.lock:
+                snapshot = [(cid, data["container_obj"]) for cid, data in self.containers.items()]
+            for cid, container_obj in snapshot:
+                try:
+                    container_obj.reload()
+                except Exception:
+                    pass
+                with self.lock:
+                    data = self.containers.get(cid)
+                    if data is None:
+                        continue
+                    if data["status"] == "idle" and container_obj.status != 'running':
+                        self._set_status_locked(data, "exited")
+                    if data["status"] == "exited":
+                        self._set_status_locked(data, "removing")
+                        containers_to_remove.append((cid, container_obj))
+
+            # 2) 从 free list 左端（空闲最久）挑选超过 keep-alive 窗口的容器，保留策略要求的最近的 idle 容器；
+            #    有暂停层 / 停止层时降级而不是删除，各层中超过保留时间的容器继续降级
+            demotions = []
             with self.lock:
-                idle_running = []
-                for cid, data in list(self.containers.items()):
-                    # 刷新 container 状态 (非阻塞式)
-                    try:
-                        data["container_obj"].reload()
-                    except Exception:
-                        pass
-                    if data["status"] == "idle" and data["container_obj"].status == 'running':
-                        idle_running.append((cid, data))
-                idle_running.sort(key=lambda item: item[1]["last_active"])
-
-                # 标记那些需要移除的容器（不在这里做实际删除）
-                for i, (container_id, data) in enumerate(idle_running):
-                    # 保留 min_idle_containers 个最近的 idle 容器
-                    num_idle_after = len(idle_running) - i
-                    if num_idle_after > self.min_idle_containers and (current_time - data["last_active"]) > self.idle_timeout:
-                        containers_to_remove.append((container_id, data["container_obj"]))
-                    else:
-                        # 剩下的都比较新或属于 min_reserved，跳出以避免多删
-                        pass
-
-            # 2) 在锁外实际删除容器（避免长时间持锁）
+                target_idle, keep_alive = self.keepalive_policy.targets(current_time)
+                while self.idle_count > target_idle and self.idle_stack:
+                    container_id = self.idle_stack[0]
+                    data = self.containers.get(container_id)
+                    if data is None or data["status"] != "idle":
+                        self.idle_stack.popleft()  # 惰性删除留下的失效条目
+                        continue
+                    if (current_time - data["last_active"]) <= keep_alive:
+                        # free list 按释放时间有序，剩下的都比较新
+                        break
+                    self.idle_stack.popleft()
+                    self._schedule_demotion_locked(container_id, data, None, demotions, containers_to_remove)
+                for tier in TIERS:
+                    stack = self.tier_stacks[tier]
+                    while stack:
+                        container_id = stack[0]
+                        data = self.containers.get(container_id)
+                        if data is None or data["status"] != tier:
+                            stack.popleft()
+                            continue
+                        if (current_time - data["last_active"]) <= self.tiers.timeout(tier):
+                            break
+                        stack.popleft()
+                        self._schedule_demotion_locked(container_id, data, tier, demotions, containers_to_remove)
+
+            # 3) 在锁外执行降级 (docker pause / stop) 和删除（避免长时间持锁）
+            for container_id, data, from_tier, tier in demotions:
+                self._demote_container(container_id, data, from_tier, tier)
             for container_id, container_obj in containers_to_remove:
                 # Before removing, try to fetch logs/attrs for debugging (optional)
                 try:
@@ -238,41 +958,40 @@ class FunctionManager:
                 except Exception as e:
                     print(f"[Cleaner] Error removing {container_id[:12]}: {e}")
 
-            # 3) 检查是否需要预热新容器；计算需要创建的数量（在锁内做最小工作）
-            to_create = 0
-            with self.lock:
-                current_idle_count = sum(
-                    1 for data in self.containers.values()
-                    if data["status"] == "idle" and data["container_obj"].status == 'running'
-                )
-                if current_idle_count < self.min_idle_containers:
-                    to_create = self.min_idle_containers - current_idle_count
-                    print(f"Need to create {to_create} new idle containers for pre-warming.")
-
-            # 4) 在锁外循环创建新的预热容器（避免死锁），每次创建后依赖 _create_new_container 自己把容器加入 self.containers
-            created = 0
-            for _ in range(to_create):
-                try:
-                    new_id = self._create_new_container()
-                    if new_id:
-                        created += 1
-                        print(f"[Cleaner] Pre-warmed container {new_id[:12]} created.")
-                    else:
-                        print("[Cleaner] Failed to create pre-warm container (check logs).")
-                    # 小睡以防速率过高并给 docker 一点缓冲
-                    time.sleep(0.5)
-                except Exception as e:
-                    print(f"[Cleaner] Exception while creating pre-warm container: {e}")
-                    # 如果创建失败，继续尝试下一个（或根据策略 break）
-                    continue
+            # 4) 补足预热容器：提交到共享创建线程池并发执行，不在 cleaner 线程里逐个串行创建
+            self._schedule_prewarm()
+
+    def evict_idle_containers(self):
+        """移除所有空闲容器 (包括暂停层、停止层)，使下一次请求冷启动 (重复测量的冷启动模式)。阻塞调用，返回移除的数量"""
+        to_remove = []
+        with self.lock:
+            for status, stack in [("idle", self.idle_stack)] + [(tier, self.tier_stacks[tier]) for tier in TIERS]:
+                while stack:
+                    container_id = stack.pop()
+                    data = self.containers.get(container_id)
+                    if data is None or data["status"] != status:
+                        continue
+                    self._set_status_locked(data, "removing")
+                    to_remove.append((container_id, data["container_obj"]))
+        for container_id, container_obj in to_remove:
+            self._remove_container(container_id, container_obj)
+        return len(to_remove)
 
-            # （可选）再次检查、限制创建数量或记录指标
-            if created:
-                print(f"[Cleaner] Created {created} pre-warm containers for {self.function_name}.")
+    def detach(self):
+        """控制器退出但保留容器池 (FAAS_KEEP_POOLS=1)：停止后台线程，不删除容器，重启后由 reconcile.py 接管"""
+        self._cleaner_stop_event.set()
+        self.backend.unsubscribe(self._on_container_event)
+        with self.lock:
+            kept = list(self.containers.items())
+        # 容器保留，但控制器这边的连接和计数器 fd 随本进程一起释放
+        for container_id, data in kept:
+            self._notify_removed(container_id, data)
+        print(f"Detached from {len(kept)} containers for {self.function_name}; they will be adopted on restart.")
 
     def stop_all_containers(self):
         # 立即设置停止事件，并尝试等待 cleaner 线程短时间，但不要无限等待
         self._cleaner_stop_event.set()
+        self.backend.unsubscribe(self._on_container_event)
         # self.cleaner_thread.join(timeout=5) # 尝试等待 cleaner 退出，但不是强制要求
         
         print(f"Stopping all containers for {self.function_name}...")
@@ -281,7 +1000,18 @@ class FunctionManager:
             # 复制一份，因为在迭代时可能会修改 self.containers
             containers_to_stop = list(self.containers.items()) 
             self.containers.clear() # 清空内部记录，避免再次操作
+            self.idle_stack.clear()
+            self.idle_count = 0
+            self.busy_count = 0
+            for tier in TIERS:
+                self.tier_stacks[tier].clear()
+                self.tier_counts[tier] = 0
 
         for container_id, data in containers_to_stop:
             self._remove_container(container_id, data["container_obj"])
+            port_allocator.release(data.get("host_port"))
+            if data.get("placement") and self.placement:
+                self.placement.release(data["placement"])
+            # 记录已经提前清空，_forget_container 找不到它，在这里触发移除回调
+            self._notify_removed(container_id, data)
         print(f"All containers for {self.function_name} stopped and removed.")
\ No newline at end of file
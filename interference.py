@@ -0,0 +1,262 @@
+# interference.py
+"""
+共置干扰矩阵 (compete_ht.sh / compete_iso.sh 的通用版本)：
+对一组已注册的 action 两两组合 (含与自身组合)，分别绑定到
+  smt           同一物理核心的两个超线程
+  same_socket   同一 socket 的不同物理核心 (共享 LLC)
+  cross_socket  不同 socket
+上同时运行，与各自单独运行 (同一个 CPU、没有共置) 的延迟相比得到 slowdown，
+并用 perf stat -A -C 按 CPU 记录每一侧的计数和 top-down 比例。
+结果矩阵 matrix[受害者][共置者] = 受害者的 slowdown。
+"""
+import asyncio
+import os
+import signal
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from perf_output import parse_perf_csv_per_cpu, topdown_metrics
+
+PLACEMENTS = ("smt", "same_socket", "cross_socket")
+# 默认只用通用事件；可以换成 compete_ht.sh 中的型号相关事件 (FAAS_INTERFERENCE_EVENTS)
+DEFAULT_EVENTS = ["cycles", "instructions", "cache-misses", "LLC-load-misses", "cpu-clock"]
+
+
+class InterferenceRun:
+    def __init__(self, actions, placements, payloads, repeats):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.actions = list(actions)
+        self.placements = list(placements)
+        self.payloads = payloads
+        self.repeats = repeats
+        self.status = "running"
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.progress = {"done": 0, "total": 0}
+        self.solo = {}       # action -> {cpu: 单独运行的结果}
+        self.results = {}    # placement -> {"cpus": [a, b], "relation": ..., "matrix": {...}, "pairs": [...]}
+        self.skipped = {}    # placement -> 原因
+
+    def finished(self, error=None):
+        self.finished_at = time.time()
+        self.status = "failed" if error is not None else "succeeded"
+        if error is not None:
+            self.error = str(error)
+
+    def summary(self):
+        return {"run_id": self.run_id, "status": self.status, "actions": self.actions, "placements": self.placements,
+                "created_at": self.created_at, "finished_at": self.finished_at, "progress": self.progress,
+                "error": self.error}
+
+    def to_dict(self):
+        data = self.summary()
+        data.update({"repeats": self.repeats, "solo": self.solo, "results": self.results, "skipped": self.skipped})
+        return data
+
+
+class InterferenceRegistry:
+    """保留最近 max_runs 次干扰矩阵测量"""
+    def __init__(self, max_runs=50):
+        self.max_runs = max_runs
+        self.runs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, actions, placements, payloads, repeats):
+        run = InterferenceRun(actions, placements, payloads, repeats)
+        with self.lock:
+            self.runs[run.run_id] = run
+            while len(self.runs) > self.max_runs:
+                self.runs.popitem(last=False)
+        return run
+
+    def get(self, run_id):
+        with self.lock:
+            return self.runs.get(run_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.runs.values())
+
+    def latest_matrix(self, placement):
+        """最近一次成功测量中该 placement 的矩阵，没有时返回 None"""
+        for run in reversed(self.list()):
+            if run.status == "succeeded" and placement in run.results:
+                return run.results[placement]["matrix"]
+        return None
+
+
+class InterferenceHarness:
+    """
+    dispatcher: AsyncDispatcher，用于 /init、/run 与线程池中的 docker 调用
+    topology: CpuTopology
+    每个 action 启动两个不进入容器池、不限 CPU 配额的独立容器 (同一 action 自身组合时两侧各用一个)，
+    每次测量前用 docker update 修改 cpuset 绑定到目标 CPU。
+    """
+    def __init__(self, dispatcher, topology, events=None):
+        self.dispatcher = dispatcher
+        self.topology = topology
+        self.events = list(events or DEFAULT_EVENTS)
+
+    async def run(self, run, managers):
+        """managers: action -> FunctionManager"""
+        containers = {}
+        try:
+            for action in run.actions:
+                containers[action] = []
+                for _ in range(2):
+                    container, host_port = await self.dispatcher.run_blocking(
+                        managers[action].start_standalone_container, cpu_period=None, cpu_quota=None)
+                    if container is None:
+                        raise RuntimeError(f"无法为 {action} 启动独立容器")
+                    containers[action].append((container, host_port))
+                    await self.dispatcher.post_json(host_port, "/init", {"action": action}, timeout=10)
+
+            plan = []
+            for placement in run.placements:
+                cpus = self.topology.pick_pair(placement)
+                if cpus is None:
+                    run.skipped[placement] = "no CPU pair with this relation on this host"
+                    continue
+                plan.append((placement, cpus))
+            pairs = [(a, b) for i, a in enumerate(run.actions) for b in run.actions[i:]]
+            run.progress["total"] = len(plan) * len(pairs)
+
+            for placement, (cpu_a, cpu_b) in plan:
+                result = run.results[placement] = {
+                    "cpus": [cpu_a, cpu_b],
+                    "relation": self.topology.relation(cpu_a, cpu_b),
+                    "matrix": {a: {} for a in run.actions},
+                    "pairs": [],
+                }
+                cells = {}  # (受害者, 共置者) -> [slowdown]，与自身组合时两侧落在同一格
+                for a, b in pairs:
+                    sides = [(a, containers[a][0], cpu_a), (b, containers[b][1 if a == b else 0], cpu_b)]
+                    for action, (container, host_port), cpu in sides:
+                        await self._solo(run, action, container, host_port, cpu)
+                    pair = await self._co_run(run, sides)
+                    result["pairs"].append(pair)
+                    side_a, side_b = pair["sides"]
+                    cells.setdefault((a, b), []).append(side_a["slowdown"])
+                    cells.setdefault((b, a), []).append(side_b["slowdown"])
+                    run.progress["done"] += 1
+                for (victim, aggressor), values in cells.items():
+                    values = [v for v in values if v is not None]
+                    result["matrix"][victim][aggressor] = sum(values) / len(values) if values else None
+            run.finished()
+        except Exception as e:
+            print(f"[Interference] 测量失败: {e}")
+            run.finished(error=e)
+        finally:
+            for action, items in containers.items():
+                for container, host_port in items:
+                    self.dispatcher.close_port(host_port)
+                    await self.dispatcher.run_blocking(managers[action].remove_standalone_container, container, host_port)
+
+    async def _pin(self, container, cpu):
+        node = self.topology.cpus[cpu].node
+        await self.dispatcher.run_blocking(container.update, cpuset_cpus=str(cpu), cpuset_mems=str(node))
+
+    async def _solo(self, run, action, container, host_port, cpu):
+        """单独运行的基准，按 (action, cpu) 缓存"""
+        solo = run.solo.setdefault(action, {})
+        if cpu in solo:
+            return solo[cpu]
+        await self._pin(container, cpu)
+        latencies, per_cpu = await self._measure(run, [(action, host_port)], [cpu])
+        solo[cpu] = self._side(action, cpu, latencies[0], per_cpu.get(cpu, {}))
+        return solo[cpu]
+
+    async def _co_run(self, run, sides):
+        for _, (container, _), cpu in sides:
+            await self._pin(container, cpu)
+        cpus = [cpu for _, _, cpu in sides]
+        latencies, per_cpu = await self._measure(run, [(action, host_port) for action, (_, host_port), _ in sides], cpus)
+        result = {"sides": []}
+        for (action, _, cpu), samples in zip(sides, latencies):
+            side = self._side(action, cpu, samples, per_cpu.get(cpu, {}))
+            solo = run.solo[action][cpu]
+            side["solo_latency"] = solo["latency"]
+            side["slowdown"] = side["latency"] / solo["latency"] if solo["latency"] else None
+            if side.get("proxy_duration") and solo.get("proxy_duration"):
+                side["proxy_slowdown"] = side["proxy_duration"] / solo["proxy_duration"]
+            result["sides"].append(side)
+        return result
+
+    @staticmethod
+    def _side(action, cpu, samples, counters):
+        latencies = [s[0] for s in samples]
+        durations = [s[1] for s in samples if s[1] is not None]
+        return {
+            "action": action,
+            "cpu": cpu,
+            "latency": statistics.median(latencies),
+            "latencies": latencies,
+            "proxy_duration": statistics.median(durations) if durations else None,
+            "counters": counters,
+            "topdown": topdown_metrics(counters),
+        }
+
+    async def _measure(self, run, targets, cpus):
+        """
+        targets: [(action, host_port)]，同时运行 run.repeats 次。
+        返回 ([每个 target 的 [(延迟, proxy 报告的执行时间)]], {cpu: 每次平均的计数})
+        """
+        samples = [[] for _ in targets]
+        totals = {}
+        for _ in range(run.repeats):
+            perf_process, output = await self._start_perf(cpus)
+            try:
+                results = await asyncio.gather(*[self._timed_run(host_port, run.payloads.get(action, {}))
+                                                 for action, host_port in targets])
+            finally:
+                per_cpu = await self._stop_perf(perf_process, output)
+            for i, result in enumerate(results):
+                samples[i].append(result)
+            for cpu, metrics in per_cpu.items():
+                for event, value in metrics.items():
+                    totals.setdefault(cpu, {})[event] = totals.get(cpu, {}).get(event, 0.0) + value / run.repeats
+        return samples, totals
+
+    async def _timed_run(self, host_port, payload):
+        start = time.time()
+        data = await self.dispatcher.post_json(host_port, "/run", payload, timeout=600)
+        return time.time() - start, data.get("duration")
+
+    async def _start_perf(self, cpus):
+        fd, output = tempfile.mkstemp(prefix="interference_", suffix=".csv")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'sudo', 'perf', 'stat', '-x', ',', '-A', '-C', ','.join(map(str, cpus)),
+                '-e', ','.join(self.events), 'sleep', '3000',
+                stdout=asyncio.subprocess.DEVNULL, stderr=fd, start_new_session=True)
+            await asyncio.sleep(0.1)
+        except Exception as e:
+            print(f"[Interference] 警告: 启动 perf 失败 (只记录延迟): {e}")
+            process = None
+        finally:
+            os.close(fd)
+        return process, output
+
+    async def _stop_perf(self, process, output):
+        try:
+            if process is not None:
+                try:
+                    os.killpg(os.getpgid(process.pid), signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    process.kill()
+                return parse_perf_csv_per_cpu(output)
+            return {}
+        finally:
+            try:
+                os.remove(output)
+            except OSError:
+                pass
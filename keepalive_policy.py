@@ -0,0 +1,173 @@
+# keepalive_policy.py
+import math
+
+
+class FixedKeepAlivePolicy:
+    """
+    原有的静态策略：始终保留 min_idle_containers 个空闲容器，
+    空闲超过 idle_timeout 秒的容器被回收。
+    """
+    name = "fixed"
+
+    def __init__(self, idle_timeout=300, min_idle_containers=0):
+        self.idle_timeout = idle_timeout
+        self.min_idle_containers = min_idle_containers
+        self.last_arrival = None
+
+    def record_arrival(self, ts):
+        self.last_arrival = ts
+
+    def targets(self, now):
+        """返回 (需要保持的空闲容器数, 空闲容器的 keep-alive 秒数)"""
+        return self.min_idle_containers, self.idle_timeout
+
+    def check_interval(self):
+        return 30
+
+    def describe(self):
+        return {"policy": self.name, "idle_timeout": self.idle_timeout, "min_idle_containers": self.min_idle_containers}
+
+
+class HybridHistogramPolicy:
+    """
+    "Serverless in the Wild" (Shahrad et al., ATC'20) 的混合直方图策略：
+    - 用固定宽度的直方图记录函数调用的到达间隔 (inter-arrival time)；
+    - prewarm 窗口 = head 百分位 * (1 - margin)：上次调用后这段时间内不保留空闲容器；
+    - keep-alive 窗口 = tail 百分位 * (1 + margin) - prewarm 窗口：prewarm 窗口结束后保持一个温容器的时长；
+    - 样本太少、超出直方图范围的间隔太多、或者直方图没有代表性 (CV 太低) 时，退回固定 keep-alive。
+    """
+    name = "hybrid"
+
+    def __init__(self, idle_timeout=300, min_idle_containers=0, bin_width=60, range_seconds=4 * 3600,
+                 head_percentile=5, tail_percentile=99, margin=0.1, min_samples=10,
+                 max_out_of_bound_ratio=0.5, min_cv=2.0):
+        self.fallback = FixedKeepAlivePolicy(idle_timeout, min_idle_containers)
+        self.bin_width = bin_width
+        self.num_bins = int(math.ceil(range_seconds / bin_width))
+        self.head_percentile = head_percentile
+        self.tail_percentile = tail_percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.max_out_of_bound_ratio = max_out_of_bound_ratio
+        self.min_cv = min_cv
+        self.bins = [0] * self.num_bins
+        self.in_bound = 0
+        self.out_of_bound = 0
+        self.last_arrival = None
+        # 缓存计算结果，直方图变化后才重新计算
+        self._windows = None
+
+    def record_arrival(self, ts):
+        if self.last_arrival is not None:
+            gap = max(0.0, ts - self.last_arrival)
+            idx = int(gap // self.bin_width)
+            if idx < self.num_bins:
+                self.bins[idx] += 1
+                self.in_bound += 1
+            else:
+                self.out_of_bound += 1
+            self._windows = None
+        self.last_arrival = ts
+        self.fallback.record_arrival(ts)
+
+    def _percentile_bin(self, pct):
+        target = self.in_bound * pct / 100.0
+        acc = 0
+        for idx, count in enumerate(self.bins):
+            acc += count
+            if acc >= target and count:
+                return idx
+        return self.num_bins - 1
+
+    def _cv(self):
+        n = self.num_bins
+        mean = self.in_bound / n
+        if mean == 0:
+            return 0.0
+        var = sum((c - mean) ** 2 for c in self.bins) / n
+        return math.sqrt(var) / mean
+
+    def windows(self):
+        """返回 (prewarm 窗口, keep-alive 窗口, 是否使用直方图)；数据不足时返回 (None, None, False)"""
+        if self._windows is None:
+            total = self.in_bound + self.out_of_bound
+            if (self.in_bound < self.min_samples
+                    or (total and self.out_of_bound / total > self.max_out_of_bound_ratio)
+                    or self._cv() < self.min_cv):
+                self._windows = (None, None, False)
+            else:
+                head = self._percentile_bin(self.head_percentile) * self.bin_width  # head 所在 bin 的下沿
+                tail = (self._percentile_bin(self.tail_percentile) + 1) * self.bin_width  # tail 所在 bin 的上沿
+                prewarm = head * (1 - self.margin)
+                keep_alive = tail * (1 + self.margin) - prewarm
+                self._windows = (prewarm, keep_alive, True)
+        return self._windows
+
+    def targets(self, now):
+        prewarm, keep_alive, active = self.windows()
+        if not active or self.last_arrival is None:
+            return self.fallback.targets(now)
+        since = now - self.last_arrival
+        if since < prewarm:
+            # 预计下一次调用还早：不保留空闲容器
+            return 0, 0.0
+        if since < prewarm + keep_alive:
+            # 进入预测的到达区间：保持一个温容器，空闲超过 keep-alive 窗口才回收
+            return 1, keep_alive
+        return 0, 0.0
+
+    def check_interval(self):
+        # 决策粒度与直方图 bin 宽度匹配
+        return max(1.0, min(30.0, self.bin_width / 2.0))
+
+    def describe(self):
+        prewarm, keep_alive, active = self.windows()
+        return {
+            "policy": self.name,
+            "active": active,
+            "prewarm_window": prewarm,
+            "keep_alive_window": keep_alive,
+            "samples": self.in_bound,
+            "out_of_bound": self.out_of_bound,
+            "bin_width": self.bin_width,
+            "fallback": self.fallback.describe(),
+        }
+
+
+class PoolTiers:
+    """
+    分层容器池的配置。超过 keep-alive 窗口的空闲容器不直接删除，而是逐层降级：
+      paused   docker pause，冻结 cgroup，不占 CPU，恢复 (unpause) 只需几毫秒
+      stopped  docker stop，释放内存，恢复需要重新启动容器和 proxy (仍比新建容器快)
+    在暂停层停留 paused_timeout 秒后降到停止层，在停止层停留 stopped_timeout 秒后删除；
+    max_paused / max_stopped 为各层容量 (0 表示不使用该层，下一层也满时直接删除)。
+    min_stopped: 预先创建并停止的容器数。默认不使用任何层，与原来的行为相同。
+    """
+    def __init__(self, max_paused=0, paused_timeout=600, max_stopped=0, stopped_timeout=1800, min_stopped=0):
+        self.max_paused = int(max_paused)
+        self.paused_timeout = float(paused_timeout)
+        self.max_stopped = int(max_stopped)
+        self.stopped_timeout = float(stopped_timeout)
+        self.min_stopped = min(int(min_stopped), self.max_stopped)
+
+    def capacity(self, tier):
+        return self.max_paused if tier == "paused" else self.max_stopped
+
+    def timeout(self, tier):
+        return self.paused_timeout if tier == "paused" else self.stopped_timeout
+
+    def describe(self):
+        return {"max_paused": self.max_paused, "paused_timeout": self.paused_timeout, "max_stopped": self.max_stopped,
+                "stopped_timeout": self.stopped_timeout, "min_stopped": self.min_stopped}
+
+
+POLICIES = {
+    FixedKeepAlivePolicy.name: FixedKeepAlivePolicy,
+    HybridHistogramPolicy.name: HybridHistogramPolicy,
+}
+
+
+def make_policy(name, idle_timeout, min_idle_containers, **params):
+    if name not in POLICIES:
+        raise ValueError(f"Unknown keep-alive policy: {name}")
+    return POLICIES[name](idle_timeout=idle_timeout, min_idle_containers=min_idle_containers, **params)
@@ -0,0 +1,287 @@
+# metrics_store.py
+"""
+调用指标的追加写存储 (SQLite, WAL 模式)，代替 perf_logs/<function>/ 下每次调用一个的 clean_*.json 和 perf 输出文件：
+- record() 只把记录放进内存队列，后台线程攒批后在一个事务里写入，不在调度路径上做 fsync；
+- invocations 表每次调用一行 (各类指标以 JSON 保存)，metrics 表把数值指标展开成 (调用, 类别, 名字, 值)，便于按指标查询；
+- query() / aggregate() 按函数、时间范围查询并计算分位数；
+- import_perf_logs() 一次性导入已有的 perf_logs 目录。
+
+命令行：
+    python3 metrics_store.py import <perf_logs 目录> [数据库路径]
+    python3 metrics_store.py aggregate <数据库路径> <function> <metric> [clean|raw|cgroup]
+"""
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invocations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    function TEXT NOT NULL,
+    container TEXT,
+    source TEXT,
+    raw_metrics TEXT,
+    clean_metrics TEXT,
+    metric_quality TEXT,
+    cgroup_metrics TEXT,
+    noise_baseline TEXT,
+    baseline TEXT,
+    event_group TEXT,
+    timing TEXT,
+    timeseries TEXT,
+    result_payload TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_invocations_function_ts ON invocations (function, ts);
+CREATE TABLE IF NOT EXISTS metrics (
+    invocation_id INTEGER NOT NULL,
+    function TEXT NOT NULL,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_lookup ON metrics (function, kind, name, ts);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    imported_at REAL
+);
+"""
+
+# invocations 表中以 JSON 保存的列 (与 clean_*.json 的字段同名)
+JSON_COLUMNS = ("raw_metrics", "clean_metrics", "metric_quality", "cgroup_metrics", "noise_baseline",
+                "baseline", "event_group", "timing", "timeseries", "result_payload")
+# 展开到 metrics 表的数值指标：类别 -> invocations 中的字段
+METRIC_KINDS = {"raw": "raw_metrics", "clean": "clean_metrics", "cgroup": "cgroup_metrics"}
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class MetricsStore:
+    def __init__(self, path, batch_size=500, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = _connect(path)
+        conn.executescript(SCHEMA)
+        # 旧版本创建的数据库缺少后来增加的列
+        existing = {r[1] for r in conn.execute("PRAGMA table_info(invocations)")}
+        for column in JSON_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE invocations ADD COLUMN {column} TEXT")
+        conn.commit()
+        conn.close()
+        self.queue = queue.Queue()
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "errors": 0}
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    # --- 写入 ---
+    def record(self, record, source="controller"):
+        """非阻塞：record 的格式与 clean_*.json 相同 (function / timestamp / raw_metrics / clean_metrics ...)"""
+        self.stats["recorded"] += 1
+        self.queue.put((record, source))
+
+    def _writer(self):
+        conn = _connect(self.path)
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(conn, batch)
+            if stop:
+                break
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        try:
+            with conn:
+                for record, source in batch:
+                    self._insert(conn, record, source)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[MetricsStore] 写入 {len(batch)} 条记录失败: {e}")
+
+    @staticmethod
+    def _insert(conn, record, source):
+        ts = record.get("timestamp") or time.time()
+        function = record.get("function")
+        values = [json.dumps(record.get(c), default=str) if record.get(c) is not None else None for c in JSON_COLUMNS]
+        cur = conn.execute(
+            f"INSERT INTO invocations (ts, function, container, source, {', '.join(JSON_COLUMNS)}) "
+            f"VALUES (?, ?, ?, ?, {', '.join('?' * len(JSON_COLUMNS))})",
+            [ts, function, record.get("container"), source] + values)
+        invocation_id = cur.lastrowid
+        rows = []
+        for kind, field in METRIC_KINDS.items():
+            for name, value in (record.get(field) or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    rows.append((invocation_id, function, ts, kind, name, float(value)))
+        conn.executemany("INSERT INTO metrics (invocation_id, function, ts, kind, name, value) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return invocation_id
+
+    def close(self):
+        """把队列中剩余的记录写完"""
+        if not self._closed:
+            self._closed = True
+            self.queue.put(None)
+            self._thread.join(timeout=30)
+
+    # --- 查询 (每次调用使用独立的只读连接，WAL 模式下不阻塞写线程) ---
+    def query(self, function=None, since=None, until=None, limit=100):
+        sql = f"SELECT id, ts, function, container, source, {', '.join(JSON_COLUMNS)} FROM invocations"
+        where, params = self._where(function, since, until)
+        sql += where + " ORDER BY ts DESC LIMIT ?"
+        conn = _connect(self.path)
+        try:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        finally:
+            conn.close()
+        results = []
+        for row in rows:
+            item = {"id": row[0], "timestamp": row[1], "function": row[2], "container": row[3], "source": row[4]}
+            for column, value in zip(JSON_COLUMNS, row[5:]):
+                item[column] = json.loads(value) if value is not None else None
+            results.append(item)
+        return results
+
+    def aggregate(self, function, metric, kind="clean", since=None, until=None, percentiles=(50, 90, 95, 99)):
+        where, params = self._where(function, since, until)
+        where += (" AND" if where else " WHERE") + " kind = ? AND name = ? AND value IS NOT NULL"
+        conn = _connect(self.path)
+        try:
+            values = [r[0] for r in conn.execute(f"SELECT value FROM metrics{where} ORDER BY value",
+                                                 params + [kind, metric])]
+        finally:
+            conn.close()
+        result = {"function": function, "metric": metric, "kind": kind, "count": len(values)}
+        if values:
+            result.update({
+                "mean": sum(values) / len(values),
+                "min": values[0],
+                "max": values[-1],
+                "percentiles": {f"p{p}": _percentile(values, p) for p in percentiles},
+            })
+        return result
+
+    def functions(self):
+        conn = _connect(self.path)
+        try:
+            return {r[0]: {"invocations": r[1], "first": r[2], "last": r[3]} for r in conn.execute(
+                "SELECT function, COUNT(*), MIN(ts), MAX(ts) FROM invocations GROUP BY function ORDER BY function")}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _where(function, since, until):
+        clauses, params = [], []
+        if function:
+            clauses.append("function = ?")
+            params.append(function)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(float(since))
+        if until is not None:
+            clauses.append("ts <= ?")
+            params.append(float(until))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # --- 导入旧数据 ---
+    def import_perf_logs(self, root):
+        """
+        导入 perf_logs/<function>/ 下的 clean_*.json (完整记录)，以及没有对应 clean 文件的
+        perf 输出 (<function>_<cid>.txt / .csv，只有 raw_metrics)。已导入过的文件会被跳过。
+        """
+        from perf_output import parse_perf_log, parse_perf_csv
+
+        conn = _connect(self.path)
+        imported = {r[0] for r in conn.execute("SELECT path FROM imported_files")}
+        counts = {"clean": 0, "raw": 0, "skipped": 0}
+        try:
+            for dirpath, _, filenames in os.walk(root):
+                cleaned = {f[len("clean_"):-len(".json")] for f in filenames if f.startswith("clean_") and f.endswith(".json")}
+                for filename in sorted(filenames):
+                    path = os.path.abspath(os.path.join(dirpath, filename))
+                    stem, ext = os.path.splitext(filename)
+                    if path in imported:
+                        counts["skipped"] += 1
+                        continue
+                    if filename.startswith("clean_") and ext == ".json":
+                        with open(path, "r") as f:
+                            record = json.load(f)
+                        record.setdefault("container", stem.rsplit("_", 1)[-1])
+                        kind = "clean"
+                    elif ext in (".txt", ".csv") and stem not in cleaned and "_" in stem:
+                        function, container = stem.rsplit("_", 1)
+                        if ext == ".csv":
+                            raw, quality = parse_perf_csv(path)
+                        else:
+                            raw, quality = parse_perf_log(path), None
+                        if not raw:
+                            continue
+                        record = {"function": function, "container": container, "timestamp": os.path.getmtime(path),
+                                  "raw_metrics": raw, "metric_quality": quality}
+                        kind = "raw"
+                    else:
+                        continue
+                    with conn:
+                        self._insert(conn, record, "import")
+                        conn.execute("INSERT INTO imported_files (path, imported_at) VALUES (?, ?)", (path, time.time()))
+                    counts[kind] += 1
+        finally:
+            conn.close()
+        return counts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "import":
+        root = sys.argv[2]
+        db_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(root, "metrics.db")
+        store = MetricsStore(db_path)
+        print(f"导入 {root} -> {db_path}: {store.import_perf_logs(root)}")
+        store.close()
+    elif len(sys.argv) >= 5 and sys.argv[1] == "aggregate":
+        store = MetricsStore(sys.argv[2])
+        kind = sys.argv[5] if len(sys.argv) > 5 else "clean"
+        print(json.dumps(store.aggregate(sys.argv[3], sys.argv[4], kind), indent=2))
+        store.close()
+    else:
+        print("用法: python3 metrics_store.py import <perf_logs 目录> [数据库路径]")
+        print("      python3 metrics_store.py aggregate <数据库路径> <function> <metric> [clean|raw|cgroup]")
+        sys.exit(1)
@@ -0,0 +1,454 @@
+# perf_collector.py
+"""
+常驻的容器级硬件/软件计数器：
+容器第一次被调度时，通过 perf_event_open 打开一组计数器，一直保持到容器被移除：
+- scope="cgroup" (默认)：在容器允许运行的每个 CPU 上打开以容器 cgroup 为目标的计数器，
+  统计 cgroup 内所有进程 (包括 ffmpeg、python3 word_count.py 这类子进程) 的全部开销；
+- scope="process"：为容器 init 进程的每个线程打开计数器 (inherit=1，之后 fork 的子进程/线程也计入)，
+  与原来的 perf stat -p 相同，attach 之前已经存在的子进程不计入。
+事件分组轮换时 (见 perf_output.EventSchedule)，不在每组中的事件以 disabled 状态打开，
+只在轮到它所在的组的那次调用期间通过 ioctl 打开。
+每次 /run 前后各读一次快照，差值就是本次调用的计数，
+调度路径上的开销只有几次 read()，不再每个请求启动一次 sudo perf 进程。
+需要 root (或 perf_event_paranoid 允许)；不可用时控制器退回每次请求启动 perf stat 的旧方式；
+available() 只在控制器自身上探测，某个容器 attach 失败时 (例如非 root 运行) 记录下来，该容器之后也改用 perf stat。
+IntervalSampler 在 /run 期间按固定间隔读取同一组计数器，得到分区间的时间序列 (相当于 perf stat -I)。
+"""
+import asyncio
+import ctypes
+import fcntl
+import os
+import platform
+import resource
+import struct
+import threading
+import time
+
+from cgroups import allowed_cpus, cgroup_dir
+
+# perf_event_attr.type
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+PERF_TYPE_HW_CACHE = 3
+
+# read_format
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+
+# perf_event_attr 的位域标志
+ATTR_FLAG_DISABLED = 1 << 0
+ATTR_FLAG_INHERIT = 1 << 1
+
+# ioctl
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+
+# perf_event_open flags：pid 参数是 cgroup 目录的 fd
+PERF_FLAG_PID_CGROUP = 1 << 2
+
+SCOPES = ("cgroup", "process")
+
+SYSCALL_NUMBERS = {"x86_64": 298, "aarch64": 241, "i386": 336, "i686": 336, "armv7l": 364}
+
+
+def _hw_cache(cache, op, result):
+    return cache | (op << 8) | (result << 16)
+
+
+# perf 事件名 -> (type, config)，名字与 perf stat 的输出一致，parse_perf_log / calculate_clean_metrics 可以直接使用
+EVENTS = {
+    "cycles": (PERF_TYPE_HARDWARE, 0),
+    "instructions": (PERF_TYPE_HARDWARE, 1),
+    "cache-references": (PERF_TYPE_HARDWARE, 2),
+    "cache-misses": (PERF_TYPE_HARDWARE, 3),
+    "branches": (PERF_TYPE_HARDWARE, 4),
+    "branch-misses": (PERF_TYPE_HARDWARE, 5),
+    "task-clock": (PERF_TYPE_SOFTWARE, 1),
+    "page-faults": (PERF_TYPE_SOFTWARE, 2),
+    "context-switches": (PERF_TYPE_SOFTWARE, 3),
+    "cpu-migrations": (PERF_TYPE_SOFTWARE, 4),
+    "minor-faults": (PERF_TYPE_SOFTWARE, 5),
+    "major-faults": (PERF_TYPE_SOFTWARE, 6),
+    "L1-dcache-load-misses": (PERF_TYPE_HW_CACHE, _hw_cache(0, 0, 1)),
+    "LLC-load-misses": (PERF_TYPE_HW_CACHE, _hw_cache(2, 0, 1)),
+}
+
+DEFAULT_EVENTS = [
+    "cycles", "instructions", "task-clock", "context-switches",
+    "cache-misses", "L1-dcache-load-misses", "LLC-load-misses",
+    "page-faults", "major-faults", "minor-faults",
+]
+
+
+class PerfEventAttr(ctypes.Structure):
+    # PERF_ATTR_SIZE_VER5 (112 字节)，内核接受比自己版本小的 attr
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+        ("branch_sample_type", ctypes.c_uint64),
+        ("sample_regs_user", ctypes.c_uint64),
+        ("sample_stack_user", ctypes.c_uint32),
+        ("clockid", ctypes.c_int32),
+        ("sample_regs_intr", ctypes.c_uint64),
+        ("aux_watermark", ctypes.c_uint32),
+        ("sample_max_stack", ctypes.c_uint16),
+        ("reserved_2", ctypes.c_uint16),
+    ]
+
+
+_libc = None
+
+
+def perf_event_open(event_type, config, pid, cpu=-1, group_fd=-1, flags=0, inherit=True, disabled=False):
+    """打开一个计数器，返回 fd；失败时抛出 OSError"""
+    global _libc
+    nr = SYSCALL_NUMBERS.get(platform.machine())
+    if nr is None:
+        raise OSError(f"perf_event_open is not supported on {platform.machine()}")
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    attr = PerfEventAttr()
+    attr.type = event_type
+    attr.size = ctypes.sizeof(PerfEventAttr)
+    attr.config = config
+    attr.read_format = PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING
+    attr.flags = (ATTR_FLAG_INHERIT if inherit else 0) | (ATTR_FLAG_DISABLED if disabled else 0)
+    fd = _libc.syscall(nr, ctypes.byref(attr), pid, cpu, group_fd, flags)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+def read_counter(fd):
+    """返回 (value, time_enabled, time_running)"""
+    return struct.unpack("QQQ", os.read(fd, 24))
+
+
+def _raise_nofile_limit():
+    """cgroup 模式下每个容器需要 事件数 x CPU 数 个 fd，把软限制提到硬限制"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def scaled_delta(before, after):
+    """
+    两次 CounterSet.read() 之间的差值 -> (metrics, quality)。
+    被复用 (multiplexing) 的事件按 enabled/running 比例放大，quality 中记录运行时间占比；
+    task-clock 换算为 msec，与 perf stat 的输出单位一致。
+    """
+    metrics = {}
+    quality = {}
+    for name, (value, time_enabled, time_running) in after.items():
+        if name not in before:
+            continue
+        v0, e0, r0 = before[name]
+        d_value, d_enabled, d_running = value - v0, time_enabled - e0, time_running - r0
+        if d_enabled <= 0:
+            continue  # 这段时间没有测量该事件 (轮换到了其他组)
+        if d_running <= 0:
+            quality[name] = {"status": "not counted", "scaling_ratio": 0.0}
+            continue  # 这段时间内计数器没有被调度上 PMU
+        if d_running < d_enabled:
+            d_value = d_value * d_enabled / d_running
+        metrics[name] = float(d_value)
+        quality[name] = {"status": "counted", "scaling_ratio": min(1.0, d_running / d_enabled)}
+    if "task-clock" in metrics:
+        metrics["task-clock"] /= 1e6  # ns -> msec
+    return metrics, quality
+
+
+class CounterSet:
+    """
+    一个容器的一组计数器，读取时对同一事件的所有 fd 求和：
+    cgroup 模式下每个事件在每个允许的 CPU 上一个 fd；process 模式下每个线程一个 fd。
+    """
+    def __init__(self, pid, events, scope="cgroup", rotating=()):
+        self.pid = pid
+        self.rotating = set(rotating)  # 以 disabled 状态打开、按需 enable 的事件
+        self.scope = scope
+        self.cgroup = None
+        self.fds = {}  # event -> [fd]
+        self.unsupported = {}  # event -> 错误信息
+        if scope == "cgroup":
+            path, self.cgroup = cgroup_dir(pid, "perf_event")
+            if path is None:
+                raise OSError(f"cgroup of pid {pid} not found")
+            cgroup_fd = os.open(path, os.O_RDONLY)
+            try:
+                # 内核持有 cgroup 的引用，打开计数器之后目录 fd 即可关闭
+                targets = [(cgroup_fd, cpu, PERF_FLAG_PID_CGROUP, False) for cpu in allowed_cpus(pid)]
+                self._open_all(events, targets)
+            finally:
+                os.close(cgroup_fd)
+        else:
+            try:
+                tids = [int(t) for t in os.listdir(f"/proc/{pid}/task")]
+            except OSError:
+                tids = [pid]
+            self._open_all(events, [(tid, -1, 0, True) for tid in tids])
+
+    def _open_all(self, events, targets):
+        """targets: [(pid 或 cgroup fd, cpu, flags, inherit)]"""
+        for name in events:
+            event_type, config = EVENTS[name]
+            fds = []
+            try:
+                for pid, cpu, flags, inherit in targets:
+                    try:
+                        fds.append(perf_event_open(event_type, config, pid, cpu=cpu, flags=flags, inherit=inherit,
+                                                   disabled=name in self.rotating))
+                    except ProcessLookupError:
+                        continue  # 线程在枚举之后退出了
+            except OSError as e:
+                for fd in fds:
+                    os.close(fd)
+                self.unsupported[name] = e.strerror or str(e)
+                continue
+            if fds:
+                self.fds[name] = fds
+
+    def _ioctl(self, names, request):
+        for name in names:
+            for fd in self.fds.get(name, ()):
+                fcntl.ioctl(fd, request, 0)
+
+    def enable(self, names):
+        self._ioctl(names, PERF_EVENT_IOC_ENABLE)
+
+    def disable(self, names):
+        self._ioctl(names, PERF_EVENT_IOC_DISABLE)
+
+    def read(self):
+        readings = {}
+        for name, fds in self.fds.items():
+            value = enabled = running = 0
+            for fd in fds:
+                v, e, r = read_counter(fd)
+                value += v
+                enabled += e
+                running += r
+            readings[name] = (value, enabled, running)
+        return readings
+
+    def close(self):
+        for fds in self.fds.values():
+            for fd in fds:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.fds = {}
+
+
+class PerfCollector:
+    """
+    container_id -> CounterSet。
+    snapshot() 在 /run 之前调用，delta() 在 /run 之后调用，返回与 parse_perf_log 相同格式的指标 dict。
+    """
+    def __init__(self, events=None, scope="cgroup", rotating=()):
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown perf scope: {scope}")
+        self.events = list(events or DEFAULT_EVENTS)
+        self.scope = scope
+        self.rotating = set(rotating)
+        self.counters = {}
+        self.failed = {}  # container_id -> attach 失败的原因，这些容器不再重试
+        self.stale = set()  # cpuset 改变后需要重新 attach 的容器
+        self.lock = threading.Lock()
+        self._available = None
+        self.unavailable_reason = None
+
+    def available(self):
+        """第一次调用时尝试在本进程上打开一个软件计数器，判断 perf_event_open 是否可用"""
+        if self._available is None:
+            try:
+                os.close(perf_event_open(*EVENTS["task-clock"], pid=0, inherit=False))
+                self._available = True
+                if self.scope == "cgroup":
+                    _raise_nofile_limit()
+            except OSError as e:
+                self._available = False
+                self.unavailable_reason = str(e)
+                print(f"[Perf] perf_event_open 不可用 ({e})，退回每次请求启动 perf stat")
+        return self._available
+
+    def supports(self, events):
+        """事件是否都能用 perf_event_open 直接打开 (型号相关的 PMU 事件只能交给 perf stat 解析)"""
+        return all(e in EVENTS for e in events)
+
+    def is_attached(self, container_id):
+        with self.lock:
+            return container_id in self.counters and container_id not in self.stale
+
+    def invalidate(self, container_id):
+        """
+        容器的 cpuset 改变后调用：cgroup 模式的计数器只开在 attach 时允许的 CPU 上，新增 CPU 上的开销不会被统计，
+        下一次调用前重新 attach。可能有调用正在读这组计数器 (伸缩在调用结束时触发)，旧的计数器在重新 attach 时才关闭
+        """
+        with self.lock:
+            counter_set = self.counters.get(container_id)
+            if counter_set is not None and counter_set.scope == "cgroup":
+                self.stale.add(container_id)
+
+    def attach_failed(self, container_id):
+        with self.lock:
+            return container_id in self.failed
+
+    def attach(self, container_id, pid, scope=None):
+        """
+        为容器打开计数器 (阻塞操作，放在线程池里调用)；重复 attach 无副作用。失败时记录原因并抛出 OSError。
+        scope 覆盖默认的统计范围 (没有独立 cgroup 的沙箱只能按进程统计)
+        """
+        with self.lock:
+            if container_id in self.counters and container_id not in self.stale:
+                return self.counters[container_id]
+        try:
+            return self._attach(container_id, pid, scope or self.scope)
+        except OSError as e:
+            with self.lock:
+                self.failed[container_id] = str(e)
+            print(f"[Perf] 容器 {container_id[:12]} 无法打开计数器 ({e})，之后改用 perf stat")
+            raise
+
+    def _attach(self, container_id, pid, scope):
+        try:
+            counter_set = CounterSet(pid, self.events, scope, self.rotating)
+            if scope == "cgroup" and not counter_set.fds:
+                raise OSError(f"no cgroup counters could be opened: {counter_set.unsupported}")
+        except OSError as e:
+            if scope != "cgroup":
+                raise
+            print(f"[Perf] 容器 {container_id[:12]} 无法按 cgroup 统计 ({e})，改为只统计 init 进程")
+            counter_set = CounterSet(pid, self.events, "process", self.rotating)
+        if not counter_set.fds:
+            raise OSError(f"no perf counters could be opened for pid {pid}: {counter_set.unsupported}")
+        with self.lock:
+            existing = self.counters.get(container_id)
+            if existing is not None and container_id not in self.stale:
+                counter_set.close()
+                return existing
+            self.stale.discard(container_id)
+            self.counters[container_id] = counter_set
+        if existing is not None:
+            existing.close()
+        if counter_set.unsupported:
+            print(f"[Perf] 容器 {container_id[:12]} 不支持的事件: {sorted(counter_set.unsupported)}")
+        return counter_set
+
+    def detach(self, container_id):
+        with self.lock:
+            self.failed.pop(container_id, None)
+            self.stale.discard(container_id)
+            counter_set = self.counters.pop(container_id, None)
+        if counter_set is not None:
+            counter_set.close()
+
+    def snapshot(self, container_id, events=None):
+        """
+        /run 之前调用。events 为本次要测量的事件组 (None 表示全部)，其中的轮换事件在读取之前被 enable。
+        返回的快照交给 delta()。
+        """
+        with self.lock:
+            counter_set = self.counters[container_id]
+        enabled = [e for e in (events if events is not None else self.events) if e in self.rotating]
+        counter_set.enable(enabled)
+        return time.time(), counter_set.read(), enabled
+
+    def delta(self, container_id, before):
+        """
+        /run 之后调用：读取当前计数并 disable 本次打开的轮换事件，返回 (metrics, quality)。
+        被复用 (multiplexing) 的事件按 enabled/running 比例放大，quality 中记录运行时间占比。
+        """
+        with self.lock:
+            counter_set = self.counters[container_id]
+        start, readings, enabled = before
+        after = counter_set.read()
+        now = time.time()
+        counter_set.disable(enabled)
+        metrics, quality = scaled_delta(readings, after)
+        for name, reason in counter_set.unsupported.items():
+            quality[name] = {"status": "not supported", "scaling_ratio": 0.0, "error": reason}
+        metrics["seconds"] = now - start
+        return metrics, quality
+
+    def start_sampling(self, container_id, interval):
+        """在 snapshot() 之后调用，返回已经开始采样的 IntervalSampler (需在事件循环中调用)"""
+        with self.lock:
+            counter_set = self.counters[container_id]
+        sampler = IntervalSampler(counter_set, interval)
+        sampler.start()
+        return sampler
+
+    def close_all(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            self.failed.clear()
+            self.stale.clear()
+        for counter_set in counters.values():
+            counter_set.close()
+
+    def describe(self):
+        with self.lock:
+            attached = {cid[:12]: {"pid": c.pid, "scope": c.scope, "cgroup": c.cgroup, "events": sorted(c.fds),
+                                   "unsupported": c.unsupported}
+                        for cid, c in self.counters.items()}
+            failed = {cid[:12]: reason for cid, reason in self.failed.items()}
+        return {"available": self._available, "reason": self.unavailable_reason, "scope": self.scope,
+                "events": self.events, "containers": attached, "failed": failed}
+
+
+class IntervalSampler:
+    """
+    /run 期间每隔 interval 秒读取一次计数器，记录每个区间的计数 (相当于 perf stat -I)。
+    在 dispatcher 的事件循环中运行：每次采样只是几次 read()，不单独占用线程。
+    """
+    def __init__(self, counter_set, interval):
+        self.counter_set = counter_set
+        self.interval = interval
+        self.samples = []  # [(区间结束时相对开始的秒数, {事件名: 该区间内的值})]
+        self._task = None
+        self._start = None
+        self._prev = None
+
+    def start(self):
+        self._start = time.time()
+        self._prev = self.counter_set.read()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        next_at = self._start
+        while True:
+            next_at += self.interval
+            await asyncio.sleep(max(0.0, next_at - time.time()))
+            self._sample()
+
+    def _sample(self):
+        readings = self.counter_set.read()
+        metrics, _ = scaled_delta(self._prev, readings)
+        self._prev = readings
+        self.samples.append((time.time() - self._start, metrics))
+
+    def stop(self):
+        """停止采样并补上最后一个 (不满 interval 的) 区间，返回 samples"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            try:
+                self._sample()
+            except OSError:
+                pass  # 计数器已经被关闭 (容器被移除)
+        return self.samples
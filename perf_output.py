@@ -0,0 +1,345 @@
+# perf_output.py
+"""
+perf 计数结果的解析与整理：
+- parse_perf_log: 解析 perf stat 的默认 (人类可读) 输出，用于旧日志；
+- parse_perf_csv: 解析 perf stat -x, 的输出，保留每个事件的运行时间比例 (multiplexing)；
+- parse_perf_interval_csv: 解析 perf stat -I 的分区间输出；
+- parse_perf_csv_per_cpu / topdown_metrics: 按 CPU 的计数 (perf stat -A) 与 top-down 比例；
+- EventSchedule: 事件数超过硬件计数器数量时把事件拆成多组，在重复调用之间轮换；
+- calculate_clean_metrics / metric_quality: 去噪后的指标及其可信度标注。
+"""
+import os
+
+# 不占用 PMU 通用计数器的软件事件，每组都带上
+SOFTWARE_EVENTS = {
+    "task-clock", "cpu-clock", "context-switches", "cs", "cpu-migrations", "migrations",
+    "page-faults", "faults", "minor-faults", "major-faults", "alignment-faults", "emulation-faults",
+}
+# IPC 需要 cycles 与 instructions 在同一组内同时计数，每组都带上
+ANCHOR_EVENTS = ("cycles", "instructions")
+
+# calculate_clean_metrics 总是输出的核心指标
+KEYS_OF_INTEREST = [
+    'cycles', 'instructions', 'task-clock', 'context-switches',
+    'cache-misses', 'L1-dcache-load-misses', 'LLC-load-misses',
+    'page-faults'
+]
+
+
+# --- Perf 日志解析工具 ---
+def parse_perf_log(log_path):
+    """
+    读取 perf 输出文件，返回一个包含关键指标的字典。
+    增强版：能够正确处理带单位的指标（如 task-clock）和总结行（time elapsed）。
+    """
+    metrics = {}
+    if not os.path.exists(log_path):
+        print(f"[Parse] Warning: Log file not found: {log_path}")
+        return metrics
+
+    try:
+        with open(log_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                
+                # 移除逗号以便转换数字
+                parts = line.replace(',', '').split()
+                
+                if len(parts) < 2:
+                    continue
+
+                # 提取数值
+                try:
+                    val = float(parts[0])
+                except ValueError:
+                    continue 
+
+                # 提取键名 (Key)
+                second_part = parts[1]
+                
+                if second_part in ['msec', 'ms', 'sec', 'seconds']:
+                    # 情况 A: 带单位的指标 (e.g., "20537.19 msec task-clock")
+                    if len(parts) >= 3:
+                        key = parts[2]
+                        # 特殊情况: "100.89 seconds time elapsed"
+                        if key == 'time' and len(parts) >= 4 and parts[3] == 'elapsed':
+                            metrics['seconds'] = val 
+                        else:
+                            metrics[key] = val
+                else:
+                    # 情况 B: 标准指标 (e.g., "16950758454 cycles")
+                    key = parts[1]
+                    metrics[key] = val
+                    
+    except Exception as e:
+        print(f"[Parse] Error parsing {log_path}: {e}")
+    
+    return metrics
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _parse_csv_fields(parts):
+    """
+    perf stat -x, 的一行 (已去掉 -I 模式下开头的时间戳) -> (事件名, 值, 状态, 运行时间占比)；
+    <not counted>/<not supported> 的值为 None，无法识别的行返回 None
+    """
+    if len(parts) < 3:
+        return None
+    value, unit, event = parts[0], parts[1], parts[2]
+    rest = parts[3:]
+    if rest and rest[0] and not _is_number(rest[0]):
+        rest = rest[1:]  # -G 模式下事件名之后是 cgroup 名
+    pct = float(rest[1]) if len(rest) > 1 and _is_number(rest[1]) else None
+
+    if value.startswith('<'):
+        return event, None, value.strip('<>'), 0.0
+    if not _is_number(value):
+        return None
+    return event, float(value), "counted", (pct / 100.0) if pct is not None else 1.0
+
+
+def parse_perf_csv(log_path):
+    """
+    解析 perf stat -x, 的输出。每行: 值,单位,事件名,[cgroup,]运行时间(ns),运行时间百分比,[指标值,指标单位]
+    返回 (metrics, quality)：
+    metrics  {事件名: 值}，<not counted>/<not supported> 的事件不在其中；perf 已对被复用的事件按比例放大
+    quality  {事件名: {"status": counted/not counted/not supported, "scaling_ratio": 运行时间占比}}
+    """
+    metrics = {}
+    quality = {}
+    if not os.path.exists(log_path):
+        print(f"[Parse] Warning: Log file not found: {log_path}")
+        return metrics, quality
+
+    try:
+        with open(log_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = _parse_csv_fields(line.split(','))
+                if fields is None:
+                    continue
+                event, value, status, ratio = fields
+                quality[event] = {"status": status, "scaling_ratio": ratio}
+                if value is not None:
+                    metrics[event] = value
+    except Exception as e:
+        print(f"[Parse] Error parsing {log_path}: {e}")
+
+    return metrics, quality
+
+
+def parse_perf_interval_csv(log_path):
+    """
+    解析 perf stat -I <ms> -x, 的输出 (每行开头多一个时间戳，单位秒)。
+    返回 (samples, quality)：
+    samples  [(时间戳, {事件名: 该区间内的值})]，按时间排序
+    quality  与 parse_perf_csv 相同；scaling_ratio 为各区间运行时间占比的平均值
+    """
+    by_time = {}
+    ratios = {}
+    statuses = {}
+    if not os.path.exists(log_path):
+        print(f"[Parse] Warning: Log file not found: {log_path}")
+        return [], {}
+
+    try:
+        with open(log_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(',')
+                if len(parts) < 4 or not _is_number(parts[0]):
+                    continue
+                fields = _parse_csv_fields(parts[1:])
+                if fields is None:
+                    continue
+                event, value, status, ratio = fields
+                if value is None:
+                    statuses.setdefault(event, status)
+                    continue
+                statuses[event] = "counted"
+                ratios.setdefault(event, []).append(ratio)
+                by_time.setdefault(float(parts[0]), {})[event] = value
+    except Exception as e:
+        print(f"[Parse] Error parsing {log_path}: {e}")
+
+    quality = {}
+    for event, status in statuses.items():
+        r = ratios.get(event)
+        quality[event] = {"status": status, "scaling_ratio": sum(r) / len(r) if r else 0.0}
+    return sorted(by_time.items()), quality
+
+
+def parse_perf_csv_per_cpu(log_path):
+    """
+    解析 perf stat -A -x, 的输出 (不按 CPU 汇总，每行开头多一列 CPU<n>)。
+    返回 {cpu: {事件名: 值}}，<not counted>/<not supported> 的事件不在其中
+    """
+    per_cpu = {}
+    if not os.path.exists(log_path):
+        print(f"[Parse] Warning: Log file not found: {log_path}")
+        return per_cpu
+
+    try:
+        with open(log_path, 'r') as f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) < 4 or not parts[0].startswith('CPU') or not parts[0][3:].isdigit():
+                    continue
+                fields = _parse_csv_fields(parts[1:])
+                if fields is None or fields[1] is None:
+                    continue
+                per_cpu.setdefault(int(parts[0][3:]), {})[fields[0]] = fields[1]
+    except Exception as e:
+        print(f"[Parse] Error parsing {log_path}: {e}")
+    return per_cpu
+
+
+# Top-down 第一层：perf 直接支持 topdown-* 事件时按 slots 归一化；
+# 否则用 compete_ht.sh 中的型号相关事件近似 (每周期 4 个发射槽)
+TOPDOWN_EVENTS = {
+    "retiring": "topdown-retiring",
+    "bad_speculation": "topdown-bad-spec",
+    "frontend_bound": "topdown-fe-bound",
+    "backend_bound": "topdown-be-bound",
+}
+
+
+def topdown_metrics(metrics):
+    """从一组计数中推导 IPC、MPKI 和 top-down 比例，缺少所需事件的指标不输出"""
+    result = {}
+    cycles = metrics.get("cycles")
+    instructions = metrics.get("instructions")
+    if cycles and instructions is not None:
+        result["IPC"] = instructions / cycles
+    if instructions and metrics.get("cache-misses") is not None:
+        result["cache_mpki"] = metrics["cache-misses"] * 1000.0 / instructions
+    slots = metrics.get("slots")
+    if slots:
+        for name, event in TOPDOWN_EVENTS.items():
+            if metrics.get(event) is not None:
+                result[name] = metrics[event] / slots
+    elif cycles:
+        if metrics.get("idq_uops_not_delivered.core") is not None:
+            result["frontend_bound"] = metrics["idq_uops_not_delivered.core"] / (4.0 * cycles)
+        if metrics.get("cycle_activity.stalls_total") is not None:
+            result["backend_stall_ratio"] = metrics["cycle_activity.stalls_total"] / cycles
+        if metrics.get("cycle_activity.stalls_l3_miss") is not None:
+            result["l3_miss_stall_ratio"] = metrics["cycle_activity.stalls_l3_miss"] / cycles
+        if metrics.get("memory_activity.stalls_l2_miss") is not None:
+            result["l2_miss_stall_ratio"] = metrics["memory_activity.stalls_l2_miss"] / cycles
+    return result
+
+
+def interval_totals(samples):
+    """各区间的值相加，得到整次调用的总计数"""
+    totals = {}
+    for _, values in samples:
+        for event, value in values.items():
+            totals[event] = totals.get(event, 0.0) + value
+    return totals
+
+
+def confidence(ratio):
+    """
+    计数器运行时间占比 -> 可信度：
+    exact   全程计数，没有被复用
+    high    >= 75% 时间在计数，放大误差很小
+    medium  >= 25%
+    low     > 0，数值主要来自外推
+    none    没有计数 (not counted / not supported / 本轮没有测该事件)
+    """
+    if ratio is None or ratio <= 0:
+        return "none"
+    if ratio >= 0.999:
+        return "exact"
+    if ratio >= 0.75:
+        return "high"
+    if ratio >= 0.25:
+        return "medium"
+    return "low"
+
+
+def calculate_clean_metrics(real_metrics, noise_metrics):
+    """
+    计算差值：Real - Noise，确保不为负数。
+    本次调用没有测量的事件 (例如轮换到其他事件组) 值为 None，而不是 0。
+    """
+    clean = {}
+    keys = KEYS_OF_INTEREST + [k for k in real_metrics if k not in KEYS_OF_INTEREST and k != 'seconds']
+
+    for k in keys:
+        if k not in real_metrics:
+            clean[k] = None
+            continue
+        r_val = real_metrics[k]
+        n_val = noise_metrics.get(k, 0.0)
+        clean[k] = max(0.0, r_val - n_val)
+
+    # 计算 IPC (Instructions Per Cycle)
+    if clean.get('cycles') and clean.get('instructions') is not None:
+        clean['IPC'] = clean['instructions'] / clean['cycles']
+    elif clean.get('cycles') is None or clean.get('instructions') is None:
+        clean['IPC'] = None
+    else:
+        clean['IPC'] = 0.0
+
+    return clean
+
+
+def metric_quality(clean_metrics, quality):
+    """为 clean 指标逐个标注 scaling_ratio 与 confidence；IPC 取 cycles 与 instructions 中较差的一个"""
+    annotated = {}
+    for k in clean_metrics:
+        if k == 'IPC':
+            ratios = [quality.get(e, {}).get("scaling_ratio") for e in ANCHOR_EVENTS]
+            ratio = None if None in ratios else min(ratios)
+            status = "derived"
+        else:
+            q = quality.get(k)
+            ratio = q.get("scaling_ratio") if q else None
+            status = q.get("status") if q else "not measured"
+        annotated[k] = {"status": status, "scaling_ratio": ratio, "confidence": confidence(ratio)}
+    return annotated
+
+
+class EventSchedule:
+    """
+    把事件列表拆成若干组，每组的硬件事件不超过 group_size 个 (软件事件和 cycles/instructions 每组都带上)，
+    同一个函数的连续调用依次轮换使用各组：每次调用内的计数都不需要复用，多次调用合起来覆盖全部事件。
+    事件数不超过 group_size 时只有一组，行为与不分组相同。
+    """
+    def __init__(self, events, group_size=6):
+        self.events = list(events)
+        self.group_size = max(1, group_size)
+        software = [e for e in self.events if e in SOFTWARE_EVENTS]
+        anchors = [e for e in self.events if e in ANCHOR_EVENTS]
+        hardware = [e for e in self.events if e not in SOFTWARE_EVENTS and e not in ANCHOR_EVENTS]
+        if len(anchors) + len(hardware) <= self.group_size:
+            self.groups = [list(self.events)]
+        else:
+            per_group = max(1, self.group_size - len(anchors))
+            self.groups = [anchors + hardware[i:i + per_group] + software
+                           for i in range(0, len(hardware), per_group)]
+        self.cursor = {}
+
+    def next_group(self, key):
+        """返回 (组下标, 事件列表)；key 通常是函数名"""
+        index = self.cursor.get(key, 0) % len(self.groups)
+        self.cursor[key] = index + 1
+        return index, self.groups[index]
+
+    def describe(self):
+        return {"group_size": self.group_size, "groups": self.groups}
@@ -0,0 +1,262 @@
+# placement.py
+"""
+按函数画像的干扰感知放置：
+- FunctionProfiles 从指标库中该函数的 clean 指标 (IPC、每千条指令的缓存缺失数 MPKI) 和 cgroup CPU 利用率
+  把函数分为 compute / memory / io 三类，测不到时为 unknown；
+- InterferenceAwarePlacement 在创建容器前通过共享的 CpusetAllocator 为其选一个逻辑 CPU：
+  访存密集的函数尽量不和另一个访存密集的函数放在同一 CPU、同一物理核心的超线程或共享 LLC 的 CPU 上，
+  其余按预测的 slowdown 最小选择，预测相同时按分配器的 spread 策略排序。
+预测值优先用 /interference 测得的矩阵 (matrix[受害者][共置者])，没有时用按类别的经验表；
+每次调用完成后记录实际执行时间，与该函数没有干扰邻居时的执行时间相比得到观测的 slowdown。
+"""
+import statistics
+import threading
+import time
+from collections import deque
+
+from cpuset_allocator import CpusetLease
+from timeseries import MEMORY_MPKI, MEMORY_IPC, MISS_EVENTS
+
+CLASSES = ("compute", "memory", "io", "unknown")
+# CPU 利用率低于 CPU 配额的该比例视为 I/O 密集 (大部分时间在等待网络、磁盘)
+IO_SHARE = 0.5
+# 判断类别至少需要的调用记录数
+MIN_SAMPLES = 3
+
+# 没有测量矩阵时按类别估计的 slowdown: relation -> {(受害者类别, 共置者类别): slowdown}，未列出的组合为 1.0
+CLASS_SLOWDOWN = {
+    "smt": {
+        ("compute", "compute"): 1.5, ("compute", "memory"): 1.3, ("compute", "unknown"): 1.2,
+        ("memory", "compute"): 1.2, ("memory", "memory"): 1.6, ("memory", "unknown"): 1.3,
+        ("unknown", "compute"): 1.2, ("unknown", "memory"): 1.3, ("unknown", "unknown"): 1.2,
+        ("io", "compute"): 1.05, ("io", "memory"): 1.05,
+    },
+    "same_llc": {
+        ("compute", "memory"): 1.1, ("memory", "compute"): 1.05, ("memory", "memory"): 1.3,
+        ("memory", "unknown"): 1.1, ("unknown", "memory"): 1.1,
+    },
+}
+# CPU 之间的关系 -> 查找 CLASS_SLOWDOWN 和干扰矩阵时使用的 placement；
+# 同一个逻辑 CPU 上的多个容器分时复用，私有缓存的竞争按超线程估计
+RELATION_PLACEMENT = {"same_cpu": "smt", "smt": "smt", "same_llc": "same_socket"}
+TABLE_RELATION = {"same_cpu": "smt", "smt": "smt", "same_llc": "same_llc"}
+# 访存密集的函数之间要避开的关系
+MEMORY_AVOID = ("same_cpu", "smt", "same_llc")
+# 关系从近到远；多 CPU 的容器之间取最近的关系
+RELATION_ORDER = ("same_cpu", "smt", "same_llc", "same_socket", "cross_socket")
+
+
+def classify(profile, cpu_limit=None):
+    """profile: FunctionProfiles.profile() 的结果"""
+    if profile.get("samples", 0) < MIN_SAMPLES:
+        return "unknown"
+    utilization = profile.get("cpu_utilization")
+    if utilization is not None and cpu_limit and utilization / cpu_limit < IO_SHARE:
+        return "io"
+    mpki = profile.get("mpki")
+    ipc = profile.get("ipc")
+    if mpki is not None:
+        if mpki >= MEMORY_MPKI:
+            return "memory"
+    elif ipc is not None and ipc < MEMORY_IPC:
+        return "memory"  # 没有缓存缺失数据时只能按 IPC 判断
+    if ipc is not None:
+        return "compute"
+    return "unknown"
+
+
+class FunctionProfiles:
+    """从指标库读取并缓存每个函数的画像 (各指标的中位数)，ttl 秒后重新读取"""
+    def __init__(self, store, ttl=60.0):
+        self.store = store
+        self.ttl = ttl
+        self.cache = {}  # function -> (读取时间, profile)
+        self.lock = threading.Lock()
+
+    def profile(self, function):
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(function)
+        if cached and now - cached[0] < self.ttl:
+            return cached[1]
+        profile = self._load(function)
+        with self.lock:
+            self.cache[function] = (now, profile)
+        return profile
+
+    def _median(self, function, metric, kind="clean"):
+        result = self.store.aggregate(function, metric, kind, percentiles=(50,))
+        return result.get("count", 0), (result.get("percentiles") or {}).get("p50")
+
+    def _load(self, function):
+        try:
+            samples, instructions = self._median(function, "instructions")
+            _, ipc = self._median(function, "IPC")
+            misses = None
+            for event in MISS_EVENTS:
+                count, misses = self._median(function, event)
+                if count:
+                    break
+            _, utilization = self._median(function, "cpu_utilization", kind="cgroup")
+        except Exception as e:
+            print(f"[Placement] 读取 {function} 的画像失败: {e}")
+            return {"samples": 0}
+        return {
+            "samples": samples,
+            "ipc": ipc,
+            "mpki": misses * 1000.0 / instructions if misses is not None and instructions else None,
+            "cpu_utilization": utilization,
+        }
+
+
+class PlacementLease(CpusetLease):
+    """CpusetLease 加上函数类别和每次调用的执行时间"""
+    def __init__(self, function, cls, cpu_limit=None):
+        super().__init__(function, cpu_limit)
+        self.cls = cls
+        self.policy = "interference"
+        self.predicted_at_start = None
+        self.observations = deque(maxlen=200)  # [(执行时间, 当时预测的 slowdown)]
+
+
+def _cls(lease):
+    # 其他策略分配的容器没有类别
+    return getattr(lease, "cls", "unknown")
+
+
+class InterferenceAwarePlacement:
+    """
+    allocator: 共享的 CpusetAllocator (占用情况与其他策略分配的容器一起统计)
+    store: MetricsStore (函数画像)
+    matrices: InterferenceRegistry，None 表示只用 CLASS_SLOWDOWN
+    fallback: 预测相同时按 allocator 的哪个策略排序
+    """
+    def __init__(self, allocator, store, matrices=None, profile_ttl=60.0, fallback="spread"):
+        self.allocator = allocator
+        self.profiles = FunctionProfiles(store, ttl=profile_ttl)
+        self.matrices = matrices
+        self.fallback = fallback
+        self.reference = {}  # function -> deque([没有干扰邻居时的执行时间])，由 allocator.lock 保护
+
+    @property
+    def topology(self):
+        return self.allocator.topology
+
+    # --- 预测 (调用方持有 allocator.lock) ---
+    def _pair_slowdown(self, victim, aggressor, relation):
+        placement = RELATION_PLACEMENT.get(relation)
+        if placement is None:
+            return 1.0
+        if self.matrices is not None:
+            matrix = self.matrices.latest_matrix(placement)
+            measured = (matrix or {}).get(victim.function, {}).get(aggressor.function)
+            if measured is not None:
+                return max(1.0, measured)
+        return CLASS_SLOWDOWN[TABLE_RELATION[relation]].get((_cls(victim), _cls(aggressor)), 1.0)
+
+    def _neighbors_locked(self, lease, cpus):
+        """cpus: 要评估的 CPU 列表；每个邻居容器取它的所有 CPU 与 cpus 之间最近的关系"""
+        result = []
+        for other in self.allocator.leases.values():
+            if other is lease or not other.cpus:
+                continue
+            relation = min((self.topology.relation(cpu, other_cpu) for cpu in cpus for other_cpu in other.cpus),
+                           key=RELATION_ORDER.index)
+            if relation in RELATION_PLACEMENT:
+                result.append((other, relation))
+        return result
+
+    def _predict_locked(self, lease, cpus):
+        """各邻居造成的额外开销相加"""
+        return 1.0 + sum(self._pair_slowdown(lease, other, relation) - 1.0
+                         for other, relation in self._neighbors_locked(lease, cpus))
+
+    def _key(self, lease, cpu, loads):
+        # 多 CPU 的容器逐个选 CPU 时，已选的 CPU 与候选 CPU 一起评估
+        cpus = lease.cpus + [cpu]
+        neighbors = self._neighbors_locked(lease, cpus)
+        conflicts = sum(1 for other, relation in neighbors
+                        if lease.cls == "memory" and _cls(other) == "memory" and relation in MEMORY_AVOID)
+        return (conflicts, self._predict_locked(lease, cpus)) + self.allocator.policy_key(self.fallback, cpu, lease.weight, loads)
+
+    # --- 分配与归还 ---
+    def reserve(self, function, cpu_limit=None):
+        """为一个新容器选 CPU，返回 PlacementLease；阻塞调用 (可能读指标库)"""
+        lease = PlacementLease(function, classify(self.profiles.profile(function), cpu_limit), cpu_limit)
+        self.allocator.place(lease, self._key)
+        with self.allocator.lock:
+            lease.predicted_at_start = self._predict_locked(lease, lease.cpus)
+        print(f"[Placement] {function} ({lease.cls}) -> CPU {lease.overrides()['cpuset_cpus']} (node {lease.overrides()['cpuset_mems']}), "
+              f"predicted slowdown {lease.predicted_at_start:.2f}")
+        return lease
+
+    def bind(self, lease, container_id):
+        self.allocator.bind(lease, container_id)
+
+    def release(self, lease):
+        self.allocator.release(lease)
+
+    def resize(self, lease, cpu_limit):
+        return self.allocator.resize(lease, cpu_limit, self._key)
+
+    def restore(self, lease, saved):
+        return self.allocator.restore(lease, saved)
+
+    # --- 观测 ---
+    def observe(self, lease, duration):
+        """一次调用完成后记录 proxy 报告的执行时间"""
+        if lease is None or not duration:
+            return
+        with self.allocator.lock:
+            predicted = self._predict_locked(lease, lease.cpus)
+            lease.observations.append((duration, predicted))
+            if predicted <= 1.0:
+                self.reference.setdefault(lease.function, deque(maxlen=200)).append(duration)
+
+    def _observed_locked(self, lease):
+        reference = self.reference.get(lease.function)
+        if not lease.observations or not reference:
+            return None
+        return statistics.median(d for d, _ in lease.observations) / statistics.median(reference)
+
+    def report(self):
+        with self.allocator.lock:
+            placements = []
+            errors = []
+            leases = [l for l in self.allocator.leases.values() if isinstance(l, PlacementLease)]
+            for lease in sorted(leases, key=lambda l: (l.cpu, l.lease_id)):
+                observed = self._observed_locked(lease)
+                predicted_mean = (statistics.fmean(p for _, p in lease.observations)
+                                  if lease.observations else None)
+                if observed is not None and predicted_mean is not None:
+                    errors.append(abs(observed - predicted_mean))
+                placements.append({
+                    "function": lease.function,
+                    "class": lease.cls,
+                    "container": lease.container_id[:12] if lease.container_id else None,
+                    "cpu": lease.cpu,
+                    "cpus": list(lease.cpus),
+                    "node": lease.node,
+                    "neighbors": [{"function": other.function, "class": _cls(other), "cpus": list(other.cpus), "relation": relation}
+                                  for other, relation in self._neighbors_locked(lease, lease.cpus)],
+                    "predicted_at_start": lease.predicted_at_start,
+                    "predicted": self._predict_locked(lease, lease.cpus),
+                    "predicted_mean": predicted_mean,
+                    "observed": observed,
+                    "invocations": len(lease.observations),
+                })
+            references = {f: {"median": statistics.median(v), "samples": len(v)} for f, v in self.reference.items() if v}
+        return {
+            "placements": placements,
+            "reference_durations": references,
+            "mean_abs_error": statistics.fmean(errors) if errors else None,
+        }
+
+    def classify_functions(self, limits):
+        """limits: function -> CPU 配额 (核数)；返回每个函数的画像和类别"""
+        result = {}
+        for function, cpu_limit in limits.items():
+            profile = dict(self.profiles.profile(function))
+            profile["class"] = classify(profile, cpu_limit)
+            result[function] = profile
+        return result
@@ -0,0 +1,171 @@
+# profiling.py
+"""
+重复测量模式：同一个 action 连续跑多次，每次之前插入一次 noop 基准，
+逐次计算 raw - noise (不截断到 0，截断会让均值偏大)，剔除离群值后给出
+均值 / 中位数 / 标准差 / 置信区间；关键指标的置信区间足够窄时提前停止。
+"""
+import math
+import statistics
+
+# 双侧 t 分布临界值，自由度 1..9；更大的自由度用 Cornish-Fisher 展开近似
+T_TABLE = {
+    0.90: (6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833),
+    0.95: (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262),
+    0.99: (63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250),
+}
+# 默认用来判断是否可以停止的指标 (只检查本次实际测到的)
+STOP_METRICS = ("cycles", "instructions", "IPC", "task-clock")
+
+
+def t_critical(df, confidence=0.95):
+    if df <= 0:
+        return math.inf
+    table = T_TABLE.get(round(confidence, 2))
+    if table and df <= len(table):
+        return table[df - 1]
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+def reject_outliers(values, threshold=3.5):
+    """
+    修正 z 分数 (基于中位数绝对偏差 MAD) 超过 threshold 的样本视为离群值。
+    返回 (保留的样本, 剔除的样本)；样本少于 4 个或 MAD 为 0 时不剔除
+    """
+    if len(values) < 4:
+        return list(values), []
+    median = statistics.median(values)
+    mad = statistics.median(abs(v - median) for v in values)
+    if mad == 0:
+        return list(values), []
+    kept, rejected = [], []
+    for v in values:
+        (rejected if 0.6745 * abs(v - median) / mad > threshold else kept).append(v)
+    return kept, rejected
+
+
+def summarize(values, confidence=0.95):
+    n = len(values)
+    if n == 0:
+        return {"n": 0}
+    mean = statistics.fmean(values)
+    result = {"n": n, "mean": mean, "median": statistics.median(values), "min": min(values), "max": max(values)}
+    if n >= 2:
+        stdev = statistics.stdev(values)
+        half = t_critical(n - 1, confidence) * stdev / math.sqrt(n)
+        result.update({
+            "stdev": stdev,
+            "ci_low": mean - half,
+            "ci_high": mean + half,
+            "ci_half_width": half,
+            # 置信区间半宽相对均值的比例，用于判断是否已经测得足够准
+            "rel_half_width": half / abs(mean) if mean else None,
+        })
+    return result
+
+
+def _ipc(metrics):
+    cycles = metrics.get("cycles")
+    instructions = metrics.get("instructions")
+    if cycles and instructions is not None and cycles > 0:
+        return instructions / cycles
+    return None
+
+
+class ProfileSession:
+    """
+    measure_target: 协程 measure_target() -> (perf 指标 dict, 调用信息 dict)，运行一次目标 action
+    measure_baseline: 协程 measure_baseline() -> perf 指标 dict，运行一次 noop；None 表示不插入基准
+    prepare: 可选协程，每次测量目标之前调用 (例如冷启动模式下先移除空闲容器)
+    """
+    def __init__(self, measure_target, measure_baseline=None, prepare=None, min_runs=5, max_runs=30,
+                 warmup=0, confidence=0.95, rel_precision=0.05, outlier_threshold=3.5, stop_metrics=STOP_METRICS):
+        self.measure_target = measure_target
+        self.measure_baseline = measure_baseline
+        self.prepare = prepare
+        self.min_runs = max(2, min_runs)
+        self.max_runs = max(self.min_runs, max_runs)
+        self.warmup = warmup
+        self.confidence = confidence
+        self.rel_precision = rel_precision
+        self.outlier_threshold = outlier_threshold
+        self.stop_metrics = stop_metrics
+        self.samples = []  # [{"raw": ..., "noise": ..., "clean": ..., "info": ...}]
+        self.stopped = None
+
+    def add_sample(self, raw, noise, info=None):
+        noise = noise or {}
+        clean = {k: v - (noise.get(k) or 0) for k, v in raw.items() if isinstance(v, (int, float))}
+        for metrics in (raw, clean):
+            ipc = _ipc(metrics)
+            if ipc is not None:
+                metrics["IPC"] = ipc
+        self.samples.append({"raw": raw, "noise": noise, "clean": clean, "info": info or {}})
+
+    def _values(self, kind):
+        values = {}
+        for sample in self.samples:
+            for k, v in sample[kind].items():
+                if isinstance(v, (int, float)):
+                    values.setdefault(k, []).append(v)
+        return values
+
+    def stats(self, kind="clean"):
+        result = {}
+        for metric, values in sorted(self._values(kind).items()):
+            kept, rejected = reject_outliers(values, self.outlier_threshold)
+            summary = summarize(kept, self.confidence)
+            summary["rejected"] = rejected
+            result[metric] = summary
+        return result
+
+    def converged(self):
+        if len(self.samples) < self.min_runs:
+            return False
+        stats = self.stats("clean")
+        checked = [m for m in self.stop_metrics if m in stats]
+        if not checked:
+            return False
+        for metric in checked:
+            rel = stats[metric].get("rel_half_width")
+            if rel is None or rel > self.rel_precision:
+                return False
+        return True
+
+    async def run(self):
+        for _ in range(self.warmup):
+            await self.measure_target()
+        while len(self.samples) < self.max_runs:
+            noise = await self.measure_baseline() if self.measure_baseline else {}
+            if self.prepare:
+                await self.prepare()
+            raw, info = await self.measure_target()
+            if not raw:
+                print(f"[Profile] 第 {len(self.samples) + 1} 次测量没有得到计数，停止")
+                self.stopped = "no_counters"
+                break
+            self.add_sample(dict(raw), noise, info)
+            if self.converged():
+                self.stopped = "converged"
+                break
+        else:
+            self.stopped = "max_runs"
+        return self.report()
+
+    def report(self):
+        start_types = {}
+        for sample in self.samples:
+            t = sample["info"].get("start_type")
+            start_types[t] = start_types.get(t, 0) + 1
+        return {
+            "runs": len(self.samples),
+            "stopped": self.stopped,
+            "confidence": self.confidence,
+            "rel_precision": self.rel_precision,
+            "start_types": start_types,
+            "clean": self.stats("clean"),
+            "raw": self.stats("raw"),
+            "noise": self.stats("noise"),
+            "samples": [{"clean": s["clean"], "info": s["info"]} for s in self.samples],
+        }
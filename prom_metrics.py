@@ -0,0 +1,127 @@
+# prom_metrics.py
+"""
+Prometheus 文本格式 (0.0.4) 的指标导出，不依赖 prometheus_client：
+- Histogram 按线程分片：每个线程第一次 observe 时分到自己的分片，之后只写自己的分片，不加锁；
+  抓取时把所有分片相加 (抓取与写入并发时同一次抓取内的 bucket/count 可能相差一次观测，下次抓取即一致)；
+- 计数、队列长度这类本来就在别处维护的值，通过 collector 回调在抓取时读取，调度路径上没有额外开销。
+"""
+import bisect
+import math
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 延迟类指标的默认分桶 (秒)：覆盖温调用的毫秒级到长任务的分钟级
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()  # 只在新线程第一次写入时使用
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, value, *labelvalues):
+        """labelvalues 与 labelnames 一一对应。每个分片只有一个写入线程，不需要加锁"""
+        if value is None:
+            return
+        shard = self._shard()
+        entry = shard.get(labelvalues)
+        if entry is None:
+            # [每个分桶的计数 (最后一个是 +Inf), 总和, 次数]
+            entry = shard[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def merged(self):
+        """labelvalues -> (各分桶计数, 总和, 次数)，所有分片相加"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for labelvalues, (counts, total, count) in list(shard.items()):
+                m = merged.get(labelvalues)
+                if m is None:
+                    m = merged[labelvalues] = [[0] * len(counts), 0.0, 0]
+                for i, c in enumerate(list(counts)):
+                    m[0][i] += c
+                m[1] += total
+                m[2] += count
+        return merged
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total, count) in sorted(self.merged().items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        h = Histogram(name, help, labelnames, buckets)
+        self.histograms.append(h)
+        return h
+
+    def register_collector(self, collect):
+        """
+        collect() -> [(name, type, help, [(labels dict, value)])]，type 为 counter / gauge，
+        在每次抓取时调用
+        """
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for h in self.histograms:
+            lines.extend(h.render())
+        for collect in self.collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"[Metrics] collector 出错: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
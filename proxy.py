@@ -3,10 +3,26 @@ import time #计时工具
 from flask import Flask, request #flask是python的一个web框架；request用来获取用户请求中发来的数据
 from gevent.pywsgi import WSGIServer #高性能web服务器，让flask应用可以同时处理很多请求
 from multiprocessing import Process
+import urllib.request
 
-exec_path = '/proxy/exec/actions' #告诉程序用户的Action代码在哪里
+exec_path = os.environ.get('FAAS_EXEC_PATH', '/proxy/exec/actions') #告诉程序用户的Action代码在哪里（进程后端直接用仓库里的 actions 目录）
 default_file = 'main.py' #规定每个Action文件夹内的入口文件名必须是main.py
 
+#进程后端没有 /storage 卷：FAAS_STORAGE_ROOT 为宿主机上的存储目录，输入中的 /storage 路径改写为它，输出中的再改写回 /storage
+CONTAINER_STORAGE = '/storage'
+storage_root = os.environ.get('FAAS_STORAGE_ROOT')
+
+def rewrite_paths(value, src, dst): #递归改写 dict / list 中以 src 开头的路径字符串
+    if isinstance(value, str):
+        if value == src or value.startswith(src + '/'):
+            return dst + value[len(src):]
+        return value
+    if isinstance(value, dict):
+        return {k: rewrite_paths(v, src, dst) for k, v in value.items()}
+    if isinstance(value, list):
+        return [rewrite_paths(v, src, dst) for v in value]
+    return value
+
 class ActionRunner: #一个蓝图，一个工厂，用于创建执行器对象
     def __init__(self): #创建runner对象时自动执行的一个构造函数
         self.code = None
@@ -16,24 +32,41 @@ class ActionRunner: #一个蓝图，一个工厂，用于创建执行器对象
     def init(self, inp): #代码加载方法（与前者不是一个东西），对应init接口，负责将main.py读入内存并编译，参数inp存储用户发来的输入字典
         action = inp['action']
 
-        # update action status
-        self.action = action
+        # 同一个 action 已经初始化过：重复的 init 视为 no-op，保留模块全局状态（例如已加载的 TensorFlow 模型）
+        if self.action == action and self.action_context is not None:
+            return False
 
         # compile the python file first
         filename = os.path.join(exec_path, action + '/' + default_file)
         with open(filename, 'r') as f:#with 语句的作用是确保文件在代码块执行完毕后，无论是否发生错误，都会被自动关闭
             code = compile(f.read(), filename, mode='exec')
 
-        self.action_context = {} #清空上下文，创建一个干净的字典，用于存储 matmul Action 的所有代码元素？？？
-        self.action_context['__file__'] = filename # 手动注入 __file__ 变量
-        exec(code, self.action_context) #核心： 运行 matmul/main.py 中的所有顶级代码（import numpy、def main 等）。运行结束后，self.action_context 字典中就有了 main 函数和 np
+        #先在局部变量中构建上下文，main.py 导入成功后才替换：导入失败 (缺依赖、模型路径错误) 时不会被上面的 no-op 判断当成已初始化
+        action_context = {} #创建一个干净的字典，用于存储 matmul Action 的所有代码元素
+        action_context['__file__'] = filename # 手动注入 __file__ 变量
+        try:
+            exec(code, action_context) #核心： 运行 matmul/main.py 中的所有顶级代码（import numpy、def main 等）。运行结束后，action_context 字典中就有了 main 函数和 np
+        except Exception:
+            self.action = None
+            self.action_context = None
+            raise
+        if storage_root and action_context.get('STORAGE_DIR') == CONTAINER_STORAGE:
+            action_context['STORAGE_DIR'] = storage_root #action 用 STORAGE_DIR 拼接路径
+
+        # update action status
+        self.action = action
+        self.action_context = action_context
 
         return True
 
     def run(self, inp): #代码运行方法，对应run接口
+        if storage_root:
+            inp = rewrite_paths(inp, CONTAINER_STORAGE, storage_root)
         self.action_context['data'] = inp #将输入数据 inp 存储到上下文字典中，并命名为 data。这样 main 函数就可以通过 data 访问输入？？？
 
         out = eval('main(data)', self.action_context) #核心中的核心： 运行代码 main(data)。Python 在 self.action_context 中找到 main 函数和 data 变量，并调用 main({"param": 1000})。这行代码开始执行您的矩阵乘法。 矩阵乘法的结果（{"latency": 0.xxx}）被存储到 out 变量中。
+        if storage_root:
+            out = rewrite_paths(out, storage_root, CONTAINER_STORAGE) #返回给控制器 / 下一个函数的仍然是 /storage 路径
         return out
 
 #Flask应用配置
@@ -60,7 +93,11 @@ def init():
     proxy.status = 'init' #临时更新服务状态为 'init'（正在初始化）。
 
     inp = request.get_json(force=True, silent=True) #获取用户通过 POST 请求发送过来的 JSON 数据（如{"action": "matmul"}）
-    runner.init(inp) #调用上面解释的 ActionRunner.init 方法，执行文件加载和编译
+    try:
+        runner.init(inp) #调用上面解释的 ActionRunner.init 方法，执行文件加载和编译
+    except Exception:
+        proxy.status = 'new' #加载失败：回到未初始化状态，下一次 /init 会重新加载，错误以 500 返回给控制器
+        raise
 
     proxy.status = 'ok' #初始化完成后，将服务状态设置为 'ok'（准备就绪）。
     return ('OK', 200) #返回 OK 文本和标准的成功状态码。
@@ -96,6 +133,20 @@ def run():
     proxy.status = 'ok'
     return data
 
+#就绪通知：控制器通过环境变量 FAAS_READY_URL 告诉我们回调地址，端口绑定完成后立即推送 ready，控制器无需轮询 /status
+def notify_ready():
+    ready_url = os.environ.get('FAAS_READY_URL')
+    if not ready_url:
+        return
+    try:
+        req = urllib.request.Request(ready_url, data=b'{}', method='POST', headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req, timeout=2).close()
+    except Exception as e:
+        print('ready notify failed:', e) #推送失败不影响服务，控制器会退回到低频 /status 探测
+
 if __name__ == '__main__': #这是一个通用的 Python 约定。它确保只有当您直接执行 python3 proxy.py 时，它里面的代码才会运行。如果文件是被其他程序导入的，这段代码就不会运行。这避免了当其他程序仅仅是想导入 proxy.py 中的某些函数时，服务器却意外启动的情况。
-    server = WSGIServer(('0.0.0.0', 5000), proxy) #1. WSGIServer 是一个高性能的服务器（来自 gevent 库）。2. ('0.0.0.0', 5000) 指定了服务器监听的网络地址和端口。0.0.0.0 表示监听所有网络接口（即允许外部访问），5000 是端口号？？？。3. proxy 是我们之前定义的 Flask 应用程序实例。这一行就是告诉服务器：“请使用这个 Flask 应用来处理所有传入到 5000 端口的请求。”
+    #进程后端通过 FAAS_PROXY_HOST / FAAS_PROXY_PORT 让每个沙箱直接监听宿主机上分配的端口
+    server = WSGIServer((os.environ.get('FAAS_PROXY_HOST', '0.0.0.0'), int(os.environ.get('FAAS_PROXY_PORT', 5000))), proxy) #1. WSGIServer 是一个高性能的服务器（来自 gevent 库）。2. ('0.0.0.0', 5000) 指定了服务器监听的网络地址和端口。0.0.0.0 表示监听所有网络接口（即允许外部访问），5000 是端口号？？？。3. proxy 是我们之前定义的 Flask 应用程序实例。这一行就是告诉服务器：“请使用这个 Flask 应用来处理所有传入到 5000 端口的请求。”
+    server.start() #先绑定端口开始监听，再通知控制器，保证控制器收到 ready 时服务已经可以接收请求
+    notify_ready()
     server.serve_forever() #这是一个阻塞（Blocking）函数。一旦运行，程序就会一直保持活动状态，不断地等待、接收和响应来自网络（例如您的 curl 命令）的 HTTP 请求，直到您手动停止容器（docker stop）。
@@ -0,0 +1,151 @@
+# reconcile.py
+"""
+控制器启动时接管上一次运行留下的容器 (FAAS_KEEP_POOLS=1 时正常退出保留的容器池，或崩溃后遗留的容器)：
+1. 通过 docker API 找出所有带 faas.managed label 的容器，按 faas.function 分组；
+2. 并行做健康检查：运行中的容器轮询 proxy 的 /status，暂停 / 已停止的容器放入暂停层 / 停止层；
+3. 用每个函数最新的容器上的 faas.config (创建 FunctionManager 时的 /create_manager 请求体) 重建 FunctionManager，
+   把健康的容器交给它接管。
+没有配置 label (旧版本或干扰实验的独立容器)、镜像与配置不一致、健康检查失败的容器直接删除。
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+import requests
+
+from container_events import MANAGED_LABEL, FUNCTION_LABEL, IMAGE_LABEL, CONFIG_LABEL
+
+# docker 状态 -> 接管后所在的层 (None 为运行中的空闲容器)
+STATE_TIERS = {"running": None, "paused": "paused", "exited": "stopped"}
+
+
+def _host_port(container, container_port):
+    # 停止的容器没有 NetworkSettings.Ports，按创建时的端口映射读取
+    bindings = (container.attrs.get("HostConfig", {}).get("PortBindings") or {}).get(f"{container_port}/tcp")
+    return int(bindings[0]["HostPort"]) if bindings and bindings[0].get("HostPort") else None
+
+
+def _probe(host_port, timeout):
+    """轮询 /status 直到 proxy 空闲 (new / ok)，返回其状态；超时返回 None"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            status = requests.get(f"http://127.0.0.1:{host_port}/status", timeout=1).json().get("status")
+            if status in ("new", "ok"):
+                return status
+        except Exception:
+            pass
+        # init / run: 上一次运行的请求还没执行完
+        if time.time() >= deadline:
+            return None
+        time.sleep(0.2)
+
+
+def _check(container, config, health_timeout):
+    """返回 (host_port, tier, initialized_action)，不能接管时返回原因字符串"""
+    if CONFIG_LABEL not in container.labels:
+        return "no configuration label"
+    if container.labels.get(IMAGE_LABEL) != config.get("image_name", "video-proxy:latest"):
+        return "image differs from the current configuration"
+    state = container.status
+    if state not in STATE_TIERS:
+        return f"state {state}"
+    host_port = _host_port(container, int(config.get("container_port", 5000)))
+    if host_port is None:
+        return "no host port mapping"
+    tier = STATE_TIERS[state]
+    if tier is not None:
+        return host_port, tier, None
+    status = _probe(host_port, health_timeout)
+    if status is None:
+        return "health check failed"
+    # 已经 /init 过的 proxy 不需要再次初始化 (一个容器池只运行配置中的 action，默认与函数同名)
+    action = config.get("action") or container.labels.get(FUNCTION_LABEL)
+    return host_port, None, action if status == "ok" else None
+
+
+def _remove(container, reason):
+    print(f"[Reconcile] Removing container {container.id[:12]} ({container.name}): {reason}")
+    try:
+        container.remove(force=True)
+    except Exception as e:
+        print(f"[Reconcile] Error removing container {container.id[:12]}: {e}")
+
+
+def _load_config(containers):
+    """同一函数的容器中最新创建的那个的配置"""
+    for container in sorted(containers, key=lambda c: c.attrs.get("Created", ""), reverse=True):
+        try:
+            config = json.loads(container.labels.get(CONFIG_LABEL) or "null")
+        except ValueError:
+            continue
+        if isinstance(config, dict):
+            return config
+    return None
+
+
+def reconcile(build_manager, existing=(), adopt=True, health_timeout=5.0, workers=16):
+    """
+    build_manager(config, adopted) -> FunctionManager，adopted 为 [(container, host_port, tier, initialized_action)]；
+    existing: 已经有 FunctionManager 的函数，它们的遗留容器直接删除；adopt=False 时删除所有遗留容器。
+    阻塞调用，返回 {function: 结果} 的报告。
+    """
+    start = time.time()
+    try:
+        client = docker.from_env()
+        found = client.containers.list(all=True, filters={"label": f"{MANAGED_LABEL}=true"})
+    except Exception as e:
+        print(f"[Reconcile] 列出容器失败: {e}")
+        return {"error": str(e), "functions": {}}
+    groups = {}
+    for container in found:
+        groups.setdefault(container.labels.get(FUNCTION_LABEL, ""), []).append(container)
+
+    report = {}
+    checks = []  # [(function, config, container)]
+    for function, containers in groups.items():
+        config = _load_config(containers) if adopt and function and function not in existing else None
+        report[function] = {"found": len(containers), "adopted": 0, "removed": {}}
+        if config is None:
+            reason = "adoption disabled" if not adopt else "manager already exists" if function in existing else "no configuration label"
+            for container in containers:
+                _remove(container, reason)
+            report[function]["removed"][reason] = len(containers)
+            continue
+        checks.extend((function, config, container) for container in containers)
+
+    # 健康检查可能要等上一次运行的请求执行完，所有容器并行检查
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda item: _check(item[2], item[1], health_timeout), checks))
+
+    adopted = {}
+    for (function, config, container), result in zip(checks, results):
+        if isinstance(result, str):
+            _remove(container, result)
+            removed = report[function]["removed"]
+            removed[result] = removed.get(result, 0) + 1
+            continue
+        host_port, tier, initialized_action = result
+        adopted.setdefault(function, (config, []))[1].append((container, host_port, tier, initialized_action))
+
+    for function, (config, items) in adopted.items():
+        # 运行中的容器优先，超出 max_containers / 层容量的由 FunctionManager 删除
+        items.sort(key=lambda item: (item[2] is not None, item[2] == "stopped"))
+        try:
+            manager = build_manager(config, items)
+        except Exception as e:
+            print(f"[Reconcile] 无法重建 {function} 的 FunctionManager: {e}")
+            for container, _, _, _ in items:
+                _remove(container, "invalid configuration")
+            report[function]["removed"]["invalid configuration"] = len(items)
+            report[function]["error"] = str(e)
+            continue
+        report[function]["adopted"] = manager.adopted_count
+        # 超出容量 (surplus)、内存上限与当前配置不一致、update 失败的容器由 FunctionManager 删除
+        report[function]["removed"].update(manager.adopt_removed)
+    client.close()
+    duration = time.time() - start
+    print(f"[Reconcile] 检查了 {len(found)} 个遗留容器，接管 {sum(r['adopted'] for r in report.values())} 个，"
+          f"用时 {duration:.2f}s")
+    return {"duration": duration, "functions": report}
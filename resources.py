@@ -0,0 +1,139 @@
+# resources.py
+"""
+每个函数的容器资源配置和纵向自动伸缩：
+- ResourceProfile: CPU 配额 (cpu_period/cpu_quota，不用 nano_cpus —— docker 不允许对用 NanoCPUs 创建的容器
+  再 update CPU 配额)、内存上限 (同时设置 memswap_limit，不使用 swap)、CPU shares；
+- VerticalAutoscaler: 根据最近若干次调用的 cgroup 计数 (throttled_ratio、cpu_utilization、memory_peak)
+  决定函数的新配额，由 FunctionManager.resize 通过 docker update 原地修改所有运行中的容器，
+  之后新建的容器也使用新配额。内存只增不减 (把上限降到当前用量以下会触发 OOM)。
+"""
+import statistics
+import time
+from collections import deque
+
+CPU_PERIOD = 100000  # 微秒
+
+
+class ResourceProfile:
+    def __init__(self, cpus=0.2, memory_mb=None, cpu_shares=None):
+        self.cpus = float(cpus)              # CPU 配额 (核数)
+        self.memory_mb = int(memory_mb) if memory_mb else None  # None 表示不限制内存
+        self.cpu_shares = int(cpu_shares) if cpu_shares else None
+
+    @classmethod
+    def from_body(cls, body):
+        """/create_manager 的请求体: {"cpus": 0.2, "memory_mb": 512, "cpu_shares": 1024}"""
+        cpus = float(body.get("cpus", 0.2))
+        if cpus <= 0:
+            raise ValueError("cpus must be positive")
+        return cls(cpus, body.get("memory_mb"), body.get("cpu_shares"))
+
+    def cpu_quota(self):
+        return max(1000, int(round(self.cpus * CPU_PERIOD)))  # 内核要求 quota 至少 1ms
+
+    def docker_kwargs(self):
+        """docker run 和 docker update (container.update) 的参数，两者参数名相同"""
+        kwargs = {"cpu_period": CPU_PERIOD, "cpu_quota": self.cpu_quota()}
+        if self.memory_mb:
+            kwargs["mem_limit"] = f"{self.memory_mb}m"
+            kwargs["memswap_limit"] = f"{self.memory_mb}m"
+        if self.cpu_shares:
+            kwargs["cpu_shares"] = self.cpu_shares
+        return kwargs
+
+    def to_dict(self):
+        return {"cpus": self.cpus, "cpu_period": CPU_PERIOD, "cpu_quota": self.cpu_quota(),
+                "memory_mb": self.memory_mb, "cpu_shares": self.cpu_shares}
+
+
+class VerticalAutoscaler:
+    """
+    每个函数一个实例 (与 keep-alive 策略一样挂在 FunctionManager 上)。
+    observe() 在每次调用拿到 cgroup 计数后调用，需要伸缩时返回 {"cpus": ..., "memory_mb": ...}：
+    - 最近 window 次调用的 throttled_ratio 中位数 >= throttle_high：CPU 乘以 step，不超过 max_cpus；
+    - 所有调用的 throttled_ratio <= throttle_low 且 cpu_utilization 的 p90 不到配额的 low_utilization：
+      CPU 降到 p90 * (1 + headroom) 和当前配额 / step 中较大的一个，不低于 min_cpus (默认为初始配额)；
+    - 设置了内存上限且 memory_peak 的最大值 >= 上限 * memory_high：内存乘以 step，不超过 max_memory_mb。
+    至少积累 min_samples 次调用才做决定，伸缩后清空窗口并冷却 cooldown 秒。
+    """
+    def __init__(self, profile, min_cpus=None, max_cpus=2.0, max_memory_mb=4096, step=1.5, window=10, min_samples=5,
+                 throttle_high=0.1, throttle_low=0.01, low_utilization=0.5, headroom=0.25, memory_high=0.9,
+                 cooldown=30.0):
+        self.min_cpus = float(min_cpus) if min_cpus is not None else profile.cpus
+        self.max_cpus = float(max_cpus)
+        self.max_memory_mb = int(max_memory_mb)
+        self.step = step
+        self.min_samples = min_samples
+        self.throttle_high = throttle_high
+        self.throttle_low = throttle_low
+        self.low_utilization = low_utilization
+        self.headroom = headroom
+        self.memory_high = memory_high
+        self.cooldown = cooldown
+        self.samples = deque(maxlen=window)
+        self.last_resize = None
+        self.history = deque(maxlen=50)  # 最近的伸缩记录
+
+    @staticmethod
+    def _round_cpus(cpus):
+        return round(round(cpus / 0.05) * 0.05, 2) or 0.05
+
+    def observe(self, profile, stats, now=None):
+        if not stats:
+            return None
+        now = now or time.time()
+        self.samples.append({
+            "throttled_ratio": stats.get("throttled_ratio"),
+            "cpu_utilization": stats.get("cpu_utilization"),
+            "memory_peak": stats.get("memory_peak"),
+        })
+        if len(self.samples) < self.min_samples:
+            return None
+        if self.last_resize is not None and now - self.last_resize < self.cooldown:
+            return None
+
+        target = {}
+        throttled = [s["throttled_ratio"] for s in self.samples if s["throttled_ratio"] is not None]
+        utilization = sorted(s["cpu_utilization"] for s in self.samples if s["cpu_utilization"] is not None)
+        if throttled and statistics.median(throttled) >= self.throttle_high:
+            cpus = self._round_cpus(min(self.max_cpus, profile.cpus * self.step))
+            if cpus > profile.cpus:
+                target["cpus"] = cpus
+        elif throttled and utilization and max(throttled) <= self.throttle_low:
+            p90 = utilization[min(len(utilization) - 1, int(0.9 * len(utilization)))]
+            if p90 < profile.cpus * self.low_utilization:
+                cpus = self._round_cpus(max(self.min_cpus, p90 * (1 + self.headroom), profile.cpus / self.step))
+                if cpus < profile.cpus:
+                    target["cpus"] = cpus
+
+        peaks = [s["memory_peak"] for s in self.samples if s["memory_peak"] is not None]
+        if profile.memory_mb and peaks and max(peaks) >= profile.memory_mb * 1024 * 1024 * self.memory_high:
+            memory_mb = min(self.max_memory_mb, int(profile.memory_mb * self.step))
+            if memory_mb > profile.memory_mb:
+                target["memory_mb"] = memory_mb
+
+        if not target:
+            return None
+        self.history.append({"time": now, "from": {"cpus": profile.cpus, "memory_mb": profile.memory_mb}, "to": dict(target),
+                             "median_throttled_ratio": statistics.median(throttled) if throttled else None,
+                             "max_memory_peak": max(peaks) if peaks else None})
+        self.samples.clear()
+        self.last_resize = now
+        return target
+
+    def describe(self):
+        return {"min_cpus": self.min_cpus, "max_cpus": self.max_cpus, "max_memory_mb": self.max_memory_mb,
+                "step": self.step, "throttle_high": self.throttle_high, "throttle_low": self.throttle_low,
+                "memory_high": self.memory_high, "cooldown": self.cooldown, "samples": len(self.samples),
+                "history": list(self.history)}
+
+
+def make_autoscaler(spec, profile):
+    """spec: None/False 表示关闭，True 使用默认参数，dict 为 VerticalAutoscaler 的参数"""
+    if not spec:
+        return None
+    if spec is True:
+        return VerticalAutoscaler(profile)
+    if isinstance(spec, dict):
+        return VerticalAutoscaler(profile, **spec)
+    raise ValueError("autoscale must be a boolean or an object of autoscaler parameters")
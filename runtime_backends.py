@@ -0,0 +1,372 @@
+# runtime_backends.py
+"""
+FunctionManager 创建沙箱的运行时后端：
+- DockerBackend  (默认) docker 容器；
+- ProcessBackend 在本机直接以子进程运行 proxy.py，不需要 docker daemon 和 root，冷启动只有进程启动的开销，
+  用于在普通 Linux 机器上压测控制器的调度逻辑。每个沙箱有自己的工作目录；容器里的 /storage 卷
+  由 proxy 把输入输出中的 /storage 路径改写为 FAAS_STORAGE_ROOT 代替；配置了 cgroup v2 目录时
+  (FAAS_PROCESS_CGROUP，需要对该目录有写权限) 每个沙箱一个子 cgroup，按与 docker 相同的参数限制 CPU / 内存 / cpuset。
+
+后端接口：
+  run(name, image, host_port, container_port, labels, environment, storage_path, resources) -> 沙箱
+      启动一个沙箱，proxy 监听宿主机的 host_port；resources 为 docker run / docker update 的资源参数
+      (cpu_period、cpu_quota、mem_limit、memswap_limit、cpu_shares、cpuset_cpus、cpuset_mems)。
+      端口被占用时抛出 PortConflict
+  pid(沙箱) -> 沙箱内 init 进程的 pid (perf / cgroup 计数用)
+  has_cgroup(沙箱) -> 沙箱是否有自己的 cgroup；没有时 cgroup 计数和按 cgroup 统计的 perf 会把控制器和其他沙箱一起算进去
+  subscribe(callback) / unsubscribe(callback)
+      沙箱生命周期事件 callback(action, sandbox_id, attributes)，action 为 docker 的事件名 (die / oom / ...)
+沙箱对象提供 FunctionManager 用到的 docker Container 方法：id、name、status、reload()、start()、stop(timeout)、
+pause()、unpause()、update(**resources)、logs(tail)、remove(force)。
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+import docker
+
+from container_events import readiness, get_watcher
+
+BACKENDS = ("docker", "process")
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class PortConflict(Exception):
+    """宿主端口在分配和绑定之间被其他进程占用，换一个端口重试"""
+    pass
+
+
+class DockerBackend:
+    name = "docker"
+
+    def __init__(self):
+        self.client = docker.from_env()
+
+    def run(self, name, image, host_port, container_port, labels, environment=None, storage_path=None, resources=None):
+        run_kwargs = {
+            "detach": True,
+            "ports": {f"{container_port}/tcp": host_port},
+            "name": name,
+            "labels": labels,
+        }
+        run_kwargs.update(resources or {})
+        if environment:
+            run_kwargs["environment"] = environment
+            # 容器通过 host-gateway 访问宿主机上的控制器 (就绪回调)
+            run_kwargs["extra_hosts"] = {"host.docker.internal": "host-gateway"}
+        # 仅在 storage_path 存在时才挂载 /storage
+        if storage_path:
+            print(f"  > Mounting volume: {storage_path} -> /storage")
+            run_kwargs["volumes"] = {storage_path: {'bind': '/storage', 'mode': 'rw'}}
+        else:
+            print("  > No host_storage_path provided. Running without volume.")
+        try:
+            return self.client.containers.run(image, **run_kwargs)
+        except docker.errors.APIError as e:
+            if "already allocated" not in str(e) and "address already in use" not in str(e):
+                raise
+            # 容器可能已经创建但没能启动，删掉后用同一个名字重试
+            try:
+                self.client.containers.get(name).remove(force=True)
+            except Exception:
+                pass
+            raise PortConflict(str(e))
+
+    def pid(self, container):
+        container.reload()
+        return container.attrs['State']['Pid']
+
+    def has_cgroup(self, container):
+        return True
+
+    def subscribe(self, callback):
+        get_watcher().subscribe(callback)
+
+    def unsubscribe(self, callback):
+        get_watcher().unsubscribe(callback)
+
+
+def _parse_bytes(value):
+    """docker 的内存参数 ("512m"、"1g" 或字节数) -> 字节数"""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().lower()
+    units = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class ProcessSandbox:
+    """一个 proxy.py 子进程 (独立的进程组)，状态变化与 docker 容器对应：running / paused / exited"""
+    def __init__(self, backend, name, argv, env, workdir, cgroup=None, labels=None):
+        self.backend = backend
+        self.id = os.urandom(32).hex()
+        self.name = name
+        self.labels = labels or {}
+        self.argv = argv
+        self.env = env
+        self.workdir = workdir
+        self.cgroup = cgroup
+        self.log_path = os.path.join(workdir, "proxy.log")
+        self.proc = None
+        self.status = "created"
+        self.lock = threading.Lock()
+
+    # --- 生命周期 ---
+    def start(self):
+        with self.lock:
+            if self.proc is not None and self.proc.poll() is None:
+                return
+            with open(self.log_path, "ab") as log:
+                proc = subprocess.Popen(self.argv, env=self.env, cwd=self.workdir, stdin=subprocess.DEVNULL,
+                                        stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            if self.cgroup:
+                # proxy 启动 (导入 flask / gevent) 之前就移入 cgroup，之后创建的线程都继承
+                try:
+                    with open(os.path.join(self.cgroup, "cgroup.procs"), "w") as f:
+                        f.write(str(proc.pid))
+                except OSError as e:
+                    print(f"[Process] 警告: 无法把 {self.name} 移入 cgroup {self.cgroup}: {e}")
+            self.proc = proc
+            self.status = "running"
+        threading.Thread(target=self._wait_exit, args=(proc,), daemon=True).start()
+
+    def _wait_exit(self, proc):
+        code = proc.wait()
+        with self.lock:
+            if self.proc is not proc:
+                return
+            self.status = "exited"
+        # 与 docker 的 die 事件一致：就绪前退出时让等待者立即失败，并通知订阅者
+        readiness.fail(self.name, f"process exited before ready (exitCode={code})")
+        self.backend.emit("die", self.id, {"name": self.name, "exitCode": str(code)})
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def stop(self, timeout=10):
+        with self.lock:
+            proc = self.proc
+            paused = self.status == "paused"
+        if proc is None or proc.poll() is not None:
+            return
+        if paused:
+            self.unpause()  # 冻结的进程收不到 SIGTERM
+        self._signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._signal(signal.SIGKILL)
+            proc.wait()
+        with self.lock:
+            self.status = "exited"
+
+    def pause(self):
+        if self.cgroup:
+            self._write("cgroup.freeze", "1")
+        else:
+            self._signal(signal.SIGSTOP)
+        with self.lock:
+            self.status = "paused"
+
+    def unpause(self):
+        if self.cgroup:
+            self._write("cgroup.freeze", "0")
+        else:
+            self._signal(signal.SIGCONT)
+        with self.lock:
+            self.status = "running"
+
+    def remove(self, force=False):
+        with self.lock:
+            proc = self.proc
+        if proc is not None and proc.poll() is None:
+            if not force:
+                raise RuntimeError(f"sandbox {self.name} is running")
+            if self.status == "paused" and self.cgroup:
+                self._write("cgroup.freeze", "0")
+            self._signal(signal.SIGKILL)
+            proc.wait()
+        with self.lock:
+            self.status = "removed"
+        if self.cgroup:
+            try:
+                os.rmdir(self.cgroup)
+            except OSError as e:
+                print(f"[Process] 警告: 删除 cgroup {self.cgroup} 失败: {e}")
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def reload(self):
+        with self.lock:
+            if self.proc is not None and self.proc.poll() is not None and self.status in ("running", "paused"):
+                self.status = "exited"
+
+    def logs(self, tail=50):
+        try:
+            with open(self.log_path, "rb") as f:
+                return b"".join(f.readlines()[-tail:])
+        except OSError:
+            return b""
+
+    # --- 资源限制 ---
+    def _write(self, filename, value):
+        with open(os.path.join(self.cgroup, filename), "w") as f:
+            f.write(str(value))
+
+    def update(self, **resources):
+        """与 docker update 的参数相同；没有 cgroup 时只有 cpuset_cpus 通过 CPU 亲和性生效"""
+        if not self.cgroup:
+            cpus = resources.get("cpuset_cpus")
+            if cpus is not None and self.proc is not None and self.proc.poll() is None:
+                self._set_affinity(self._parse_cpus(cpus))
+            return
+        if "cpu_quota" in resources or "cpu_period" in resources:
+            period = resources.get("cpu_period") or 100000
+            quota = resources.get("cpu_quota")
+            self._write("cpu.max", f"{quota if quota and quota > 0 else 'max'} {period}")
+        if resources.get("cpu_shares"):
+            # 与 runc 相同的 shares (2..262144) -> weight (1..10000) 换算
+            self._write("cpu.weight", 1 + ((int(resources["cpu_shares"]) - 2) * 9999) // 262142)
+        if resources.get("mem_limit"):
+            memory = _parse_bytes(resources["mem_limit"])
+            self._write("memory.max", memory)
+            if resources.get("memswap_limit"):
+                # docker 的 memswap_limit 是内存 + swap 的总量
+                self._write("memory.swap.max", max(0, _parse_bytes(resources["memswap_limit"]) - memory))
+        if resources.get("cpuset_cpus") is not None:
+            self._write("cpuset.cpus", resources["cpuset_cpus"])
+        if resources.get("cpuset_mems") is not None:
+            self._write("cpuset.mems", resources["cpuset_mems"])
+
+    @staticmethod
+    def _parse_cpus(spec):
+        cpus = set()
+        for part in str(spec).split(","):
+            if "-" in part:
+                low, high = part.split("-")
+                cpus.update(range(int(low), int(high) + 1))
+            elif part.strip():
+                cpus.add(int(part))
+        return cpus
+
+    def _set_affinity(self, cpus):
+        # 已经存在的线程逐个设置，之后创建的线程继承创建者的亲和性
+        try:
+            tasks = os.listdir(f"/proc/{self.proc.pid}/task")
+        except OSError:
+            tasks = [str(self.proc.pid)]
+        for tid in tasks:
+            try:
+                os.sched_setaffinity(int(tid), cpus)
+            except OSError:
+                pass
+
+
+class ProcessBackend:
+    """
+    root: 各沙箱工作目录的父目录
+    actions_path: action 代码目录 (对应镜像中的 /proxy/exec/actions)
+    cgroup_root: cgroup v2 目录，None 表示不限制资源 (只有 cpuset 通过 CPU 亲和性生效)
+    """
+    name = "process"
+
+    def __init__(self, root=None, actions_path=None, cgroup_root=None, python=None):
+        self.root = root or os.path.join(tempfile.gettempdir(), "faas-sandboxes")
+        self.actions_path = actions_path or os.path.join(REPO_DIR, "actions")
+        self.proxy_path = os.path.join(REPO_DIR, "proxy.py")
+        self.python = python or sys.executable
+        self.cgroup_root = cgroup_root
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self._warned = False
+        os.makedirs(self.root, exist_ok=True)
+        if cgroup_root:
+            self._enable_controllers()
+
+    def _enable_controllers(self):
+        os.makedirs(self.cgroup_root, exist_ok=True)
+        for controller in ("cpu", "memory", "cpuset"):
+            try:
+                with open(os.path.join(self.cgroup_root, "cgroup.subtree_control"), "w") as f:
+                    f.write(f"+{controller}")
+            except OSError as e:
+                print(f"[Process] 警告: 无法在 {self.cgroup_root} 启用 {controller} 控制器: {e}")
+
+    def run(self, name, image, host_port, container_port, labels, environment=None, storage_path=None, resources=None):
+        # image / container_port 只对 docker 有意义：进程沙箱直接运行本仓库的 proxy.py 和 actions
+        workdir = os.path.join(self.root, name)
+        os.makedirs(workdir, exist_ok=True)
+        env = dict(os.environ)
+        env.update(environment or {})
+        if env.get("FAAS_READY_URL"):
+            # 回调地址是给容器用的 (host.docker.internal)，进程直接访问本机
+            env["FAAS_READY_URL"] = env["FAAS_READY_URL"].replace("host.docker.internal", "127.0.0.1")
+        env.update({
+            "FAAS_PROXY_HOST": "127.0.0.1",
+            "FAAS_PROXY_PORT": str(host_port),
+            "FAAS_EXEC_PATH": self.actions_path,
+        })
+        if storage_path:
+            print(f"  > Mapping /storage -> {storage_path}")
+            env["FAAS_STORAGE_ROOT"] = storage_path
+        cgroup = None
+        if self.cgroup_root:
+            cgroup = os.path.join(self.cgroup_root, name)
+            os.makedirs(cgroup, exist_ok=True)
+        elif resources and not self._warned:
+            self._warned = True
+            print("[Process] 未配置 FAAS_PROCESS_CGROUP，CPU / 内存限制不生效 (cpuset 通过 CPU 亲和性生效)")
+        sandbox = ProcessSandbox(self, name, [self.python, self.proxy_path], env, workdir, cgroup, labels)
+        try:
+            if cgroup and resources:
+                sandbox.update(**resources)  # 启动前写好限制
+            sandbox.start()
+            if not cgroup and resources and resources.get("cpuset_cpus") is not None:
+                sandbox.update(cpuset_cpus=resources["cpuset_cpus"])
+        except Exception:
+            sandbox.remove(force=True)
+            raise
+        return sandbox
+
+    def pid(self, sandbox):
+        return sandbox.proc.pid if sandbox.proc is not None else None
+
+    def has_cgroup(self, sandbox):
+        # 未配置 cgroup_root 时沙箱留在控制器自己的 cgroup 中
+        return sandbox.cgroup is not None
+
+    # --- 事件 ---
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def emit(self, action, sandbox_id, attributes):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(action, sandbox_id, attributes)
+            except Exception as e:
+                print(f"[Process] subscriber error: {e}")
+
+
+def make_backend(name, process_backend=None):
+    """name: docker / process；process 后端由所有 FunctionManager 共享"""
+    if name == "docker":
+        return DockerBackend()
+    if name == "process":
+        return process_backend or ProcessBackend()
+    raise ValueError(f"Unknown runtime: {name} (expected one of {list(BACKENDS)})")
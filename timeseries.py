@@ -0,0 +1,138 @@
+# timeseries.py
+"""
+一次调用的分区间计数 (perf stat -I / IntervalSampler) 的紧凑存储与简单的阶段划分：
+- compact_series: [(t, {事件: 值})] -> 按列存放的 {"t": [...], "events": {事件: [...]}}，计数取整；
+- segment_phases: 按每个区间的 IPC、每千条指令的缓存缺失数 (MPKI)、CPU 利用率给区间打标签，
+  合并相邻的同类区间，过短的片段并入前一个片段，得到 idle / memory-bound / compute-bound / mixed 阶段。
+  没有硬件事件 (cycles/instructions) 时只区分 idle / active。
+"""
+
+# 打标签的默认阈值
+IDLE_UTILIZATION = 0.1   # task-clock / 区间长度低于该值视为空闲 (等待 I/O、网络、睡眠)
+MEMORY_MPKI = 10.0       # 每千条指令的缓存缺失数不低于该值视为访存密集
+MEMORY_IPC = 0.7         # 没有缓存缺失数据时，IPC 低于该值视为访存受限
+COMPUTE_IPC = 1.5        # IPC 不低于该值 (且不是访存密集) 视为计算密集
+# 判断访存的缓存缺失事件，按优先级取第一个测到的
+MISS_EVENTS = ("LLC-load-misses", "cache-misses", "L1-dcache-load-misses")
+
+
+def compact_series(samples, interval_ms):
+    """
+    samples: [(区间结束时间 (秒，相对采样开始), {事件名: 值})]，时间换算为毫秒；
+    某个区间没有测到的事件记为 None
+    """
+    if not samples:
+        return {"interval_ms": interval_ms, "t": [], "events": {}}
+    events = sorted({e for _, values in samples for e in values})
+    columns = {e: [] for e in events}
+    for _, values in samples:
+        for e in events:
+            v = values.get(e)
+            columns[e].append(None if v is None else (round(v, 3) if e == "task-clock" else int(round(v))))
+    return {
+        "interval_ms": interval_ms,
+        "t": [int(round(t * 1000)) for t, _ in samples],
+        "events": columns,
+    }
+
+
+def _label(values, duration_ms, thresholds):
+    task_clock = values.get("task-clock")
+    if task_clock is not None and duration_ms > 0 and task_clock / duration_ms < thresholds["idle_utilization"]:
+        return "idle"
+    cycles = values.get("cycles")
+    instructions = values.get("instructions")
+    if not cycles or instructions is None:
+        return "active"
+    ipc = instructions / cycles
+    misses = next((values[e] for e in MISS_EVENTS if values.get(e) is not None), None)
+    mpki = misses * 1000.0 / instructions if misses is not None and instructions else None
+    if mpki is not None:
+        if mpki >= thresholds["memory_mpki"]:
+            return "memory-bound"
+    elif ipc < thresholds["memory_ipc"]:
+        return "memory-bound"  # 没有缓存缺失数据时只能按 IPC 判断
+    if ipc >= thresholds["compute_ipc"]:
+        return "compute-bound"
+    return "mixed"
+
+
+def _summary(segment, columns, indices):
+    totals = {}
+    for e, values in columns.items():
+        picked = [values[i] for i in indices if values[i] is not None]
+        if picked:
+            totals[e] = sum(picked)
+    if totals.get("cycles"):
+        segment["ipc"] = totals.get("instructions", 0) / totals["cycles"]
+    misses = next((totals[e] for e in MISS_EVENTS if e in totals), None)
+    if misses is not None and totals.get("instructions"):
+        segment["mpki"] = misses * 1000.0 / totals["instructions"]
+    if "task-clock" in totals and segment["duration_ms"] > 0:
+        segment["cpu_utilization"] = totals["task-clock"] / segment["duration_ms"]
+    return segment
+
+
+def segment_phases(series, min_intervals=2, idle_utilization=IDLE_UTILIZATION, memory_mpki=MEMORY_MPKI,
+                   memory_ipc=MEMORY_IPC, compute_ipc=COMPUTE_IPC):
+    """
+    series: compact_series 的结果。返回 [{"label", "start_ms", "end_ms", "duration_ms", "intervals", "ipc", "mpki", "cpu_utilization"}]；
+    短于 min_intervals 个区间的片段并入前一个片段 (第一个片段并入后一个)
+    """
+    thresholds = {"idle_utilization": idle_utilization, "memory_mpki": memory_mpki,
+                  "memory_ipc": memory_ipc, "compute_ipc": compute_ipc}
+    times = series.get("t") or []
+    columns = series.get("events") or {}
+    if not times:
+        return []
+    labels = []
+    prev_end = 0
+    for i, end in enumerate(times):
+        values = {e: col[i] for e, col in columns.items()}
+        labels.append(_label(values, end - prev_end, thresholds))
+        prev_end = end
+
+    # 合并相邻的同类区间: [[label, 第一个区间下标, 最后一个区间下标]]
+    runs = []
+    for i, label in enumerate(labels):
+        if runs and runs[-1][0] == label:
+            runs[-1][2] = i
+        else:
+            runs.append([label, i, i])
+    # 过短的片段并入相邻片段，直到没有可合并的
+    merged = True
+    while merged and len(runs) > 1:
+        merged = False
+        for k, (label, first, last) in enumerate(runs):
+            if last - first + 1 >= min_intervals:
+                continue
+            if k > 0:
+                runs[k - 1][2] = last
+            else:
+                runs[1][1] = first
+            del runs[k]
+            merged = True
+            break
+        # 合并后相邻片段可能同类
+        i = 1
+        while i < len(runs):
+            if runs[i][0] == runs[i - 1][0]:
+                runs[i - 1][2] = runs[i][2]
+                del runs[i]
+            else:
+                i += 1
+
+    segments = []
+    for label, first, last in runs:
+        start_ms = times[first - 1] if first > 0 else 0
+        segment = {"label": label, "start_ms": start_ms, "end_ms": times[last],
+                   "duration_ms": times[last] - start_ms, "intervals": last - first + 1}
+        segments.append(_summary(segment, columns, range(first, last + 1)))
+    return segments
+
+
+def build_timeseries(samples, interval_ms, **kwargs):
+    """compact_series + segment_phases，保存到调用记录的 timeseries 字段"""
+    series = compact_series(samples, interval_ms)
+    series["segments"] = segment_phases(series, **kwargs)
+    return series
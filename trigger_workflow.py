@@ -194,6 +194,7 @@ def trigger_workflow(workflow_name):
         
         if resp.status_code == 202:
             print("\n工作流已在后台启动。请在 controller.py 日志中查看进度！")
+            print(f"运行状态与各阶段耗时: GET {CONTROLLER_URL}/workflow_runs/{resp.json().get('run_id')}")
         elif resp.status_code == 200:
             print("\n简单 Action 执行完毕。")
         
@@ -0,0 +1,334 @@
+# workflow_engine.py
+"""
+工作流定义 (JSON / YAML)：
+{
+  "name": "video",
+  "nodes": {
+    "split":     {"function": "video_split", "input": {"video_name": "$input.video_name"}},
+    "transcode": {"function": "video_transcode", "map": "$split.split_keys",
+                  "input": {"split_file": "$item"}, "output": "$result.transcoded_file"},
+    "merge":     {"function": "video_merge", "input": {"transcoded_files": "$transcode"}}
+  },
+  "output": "$merge.final_video"
+}
+
+表达式：
+- "$input.a.b"             工作流输入；"$<node>.x" 某个节点的输出；"$item"/"$index" map 中的当前元素/下标；
+                           "$result.x" 节点 output 投影中的函数原始返回值
+- {"$ref": "x.y", "default": v}  路径不存在时取默认值
+- {"$coalesce": [e1, e2]}  第一个不为 None 的值
+- {"$any": [...]} / {"$all": [...]} / {"$not": e}  布尔运算，用于 "when" 条件分支
+- 其他 dict / list 递归求值，普通字符串和数字原样返回
+
+节点：
+- function: 要调用的函数名
+- input:    传给函数的 payload 表达式
+- map:      (可选) 求值为 list，对每个元素并发调用一次函数 (fan-out)，节点输出为结果列表 (join)；
+            如果 map 直接是另一个 map 节点的输出 ("$<node>")，两者逐元素流水线执行，不等上游全部完成
+- when:     (可选) 条件为假时跳过节点，输出为 None
+- output:   (可选) 对函数返回值的投影，默认为整个返回值
+- after:    (可选) 没有数据依赖但需要等待的节点
+每个节点在它引用的节点全部完成后立即调度，不存在按"阶段"的同步屏障。
+"""
+import asyncio
+import json
+import os
+
+try:
+    import yaml
+except ImportError:  # YAML 定义是可选的，没有 PyYAML 时只加载 JSON
+    yaml = None
+
+
+class WorkflowError(ValueError):
+    """工作流定义非法 (引用了不存在的节点、存在环等)"""
+    pass
+
+
+# 表达式中保留的根名字，其余的根名字都是节点 id
+RESERVED_ROOTS = ("input", "item", "index", "result")
+
+
+def _is_ref(value):
+    return isinstance(value, str) and value.startswith("$") and len(value) > 1
+
+
+def _split_path(path):
+    return [p for p in path.split(".") if p]
+
+
+def _collect_roots(expr, roots):
+    """收集表达式中引用到的根名字"""
+    if _is_ref(expr):
+        roots.add(_split_path(expr[1:])[0])
+    elif isinstance(expr, dict):
+        if "$ref" in expr:
+            roots.add(_split_path(expr["$ref"])[0])
+        for value in expr.values():
+            _collect_roots(value, roots)
+    elif isinstance(expr, list):
+        for value in expr:
+            _collect_roots(value, roots)
+    return roots
+
+
+_MISSING = object()
+
+
+def _lookup(scope, path):
+    parts = _split_path(path)
+    if not parts or parts[0] not in scope:
+        return _MISSING
+    value = scope[parts[0]]
+    for part in parts[1:]:
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def evaluate(expr, scope):
+    if _is_ref(expr):
+        value = _lookup(scope, expr[1:])
+        if value is _MISSING:
+            raise KeyError(f"unresolved reference {expr}")
+        return value
+    if isinstance(expr, dict):
+        if "$ref" in expr:
+            value = _lookup(scope, expr["$ref"])
+            return expr.get("default") if value is _MISSING or value is None else value
+        if "$coalesce" in expr:
+            for item in expr["$coalesce"]:
+                try:
+                    value = evaluate(item, scope)
+                except KeyError:
+                    continue
+                if value is not None:
+                    return value
+            return None
+        if "$any" in expr:
+            return any(_truthy(item, scope) for item in expr["$any"])
+        if "$all" in expr:
+            return all(_truthy(item, scope) for item in expr["$all"])
+        if "$not" in expr:
+            return not _truthy(expr["$not"], scope)
+        return {k: evaluate(v, scope) for k, v in expr.items()}
+    if isinstance(expr, list):
+        return [evaluate(v, scope) for v in expr]
+    return expr
+
+
+def _truthy(expr, scope):
+    try:
+        return bool(evaluate(expr, scope))
+    except KeyError:
+        # 引用了被跳过节点的字段等情况，按假处理
+        return False
+
+
+class WorkflowNode:
+    def __init__(self, node_id, spec):
+        if "function" not in spec:
+            raise WorkflowError(f"node '{node_id}' has no 'function'")
+        self.id = node_id
+        self.function = spec["function"]
+        self.input = spec.get("input", {})
+        self.map = spec.get("map")
+        self.when = spec.get("when")
+        self.output = spec.get("output")
+        self.after = list(spec.get("after", []))
+        self.deps = set()
+        # map 直接引用另一个 map 节点的整个输出时，逐元素流水线执行
+        self.stream_source = None
+
+
+class WorkflowSpec:
+    def __init__(self, name, spec):
+        self.name = name
+        nodes = spec.get("nodes")
+        if not isinstance(nodes, dict) or not nodes:
+            raise WorkflowError(f"workflow '{name}' has no nodes")
+        self.nodes = {nid: WorkflowNode(nid, nspec) for nid, nspec in nodes.items()}
+        self.output = spec.get("output")
+        self.description = spec.get("description", "")
+
+        for node in self.nodes.values():
+            roots = set()
+            for expr in (node.input, node.map, node.when):
+                _collect_roots(expr, roots)
+            roots.update(node.after)
+            for root in roots - set(RESERVED_ROOTS):
+                if root not in self.nodes:
+                    raise WorkflowError(f"workflow '{name}': node '{node.id}' references unknown node '{root}'")
+            node.deps = roots - set(RESERVED_ROOTS)
+            if node.deps & {node.id}:
+                raise WorkflowError(f"workflow '{name}': node '{node.id}' depends on itself")
+            if _is_ref(node.map):
+                source = _split_path(node.map[1:])
+                if len(source) == 1 and source[0] in self.nodes and self.nodes[source[0]].map is not None:
+                    node.stream_source = source[0]
+        for root in _collect_roots(self.output, set()) - set(RESERVED_ROOTS):
+            if root not in self.nodes:
+                raise WorkflowError(f"workflow '{name}': output references unknown node '{root}'")
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        state = {}
+
+        def visit(nid, stack):
+            if state.get(nid) == "done":
+                return
+            if state.get(nid) == "visiting":
+                raise WorkflowError(f"workflow '{self.name}' has a cycle: {' -> '.join(stack + [nid])}")
+            state[nid] = "visiting"
+            for dep in self.nodes[nid].deps:
+                visit(dep, stack + [nid])
+            state[nid] = "done"
+
+        for nid in self.nodes:
+            visit(nid, [])
+
+    def dependencies(self):
+        return {nid: sorted(n.deps) for nid, n in self.nodes.items()}
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "description": self.description,
+            "nodes": {nid: {"function": n.function, "deps": sorted(n.deps), "map": n.map is not None,
+                            "conditional": n.when is not None} for nid, n in self.nodes.items()},
+        }
+
+
+def load_workflows(directory):
+    """加载目录下所有 *.json (以及安装了 PyYAML 时的 *.yaml/*.yml) 工作流定义"""
+    workflows = {}
+    if not os.path.isdir(directory):
+        return workflows
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        stem, ext = os.path.splitext(filename)
+        if ext == ".json":
+            with open(path, "r") as f:
+                spec = json.load(f)
+        elif ext in (".yaml", ".yml"):
+            if yaml is None:
+                print(f"[Workflow] Skipping {filename}: PyYAML is not installed.")
+                continue
+            with open(path, "r") as f:
+                spec = yaml.safe_load(f)
+        else:
+            continue
+        name = spec.get("name", stem)
+        workflows[name] = WorkflowSpec(name, spec)
+    return workflows
+
+
+class WorkflowEngine:
+    """
+    在 asyncio 事件循环中执行 WorkflowSpec。
+    dispatch: 协程 dispatch(function_name, payload, trace) -> 函数返回值，
+              trace 为 InvocationTrace (不跟踪时为 None)，由 dispatch 填充各阶段耗时
+    """
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+
+    async def run(self, spec, payload, tracker=None):
+        """tracker: 可选的 WorkflowRun，记录节点状态和每次调用的阶段时间线"""
+        loop = asyncio.get_running_loop()
+        results = {"input": payload}
+        items_ready = {nid: loop.create_future() for nid, n in spec.nodes.items() if n.map is not None}
+        tasks = {}
+
+        async def run_item(node, index, source_fut):
+            item = await source_fut
+            scope = dict(results)
+            scope["item"] = item
+            scope["index"] = index
+            return await self._call(node, evaluate(node.input, scope), tracker, index)
+
+        async def run_node(node):
+            status = "failed"
+            try:
+                await asyncio.gather(*(tasks[d] for d in node.deps if d != node.stream_source))
+                if tracker:
+                    tracker.node_started(node.id)
+                if node.when is not None and not _truthy(node.when, results):
+                    print(f"[workflow:{spec.name}] 跳过节点 {node.id} (条件不满足)")
+                    if node.id in items_ready:
+                        items_ready[node.id].set_result([])
+                    results[node.id] = None
+                    status = "skipped"
+                    return None
+
+                if node.map is None:
+                    value = await self._call(node, evaluate(node.input, results), tracker, None)
+                else:
+                    if node.stream_source:
+                        source_items = await items_ready[node.stream_source]
+                    else:
+                        values = evaluate(node.map, results)
+                        if not isinstance(values, list):
+                            raise TypeError(f"map of node '{node.id}' is not a list: {type(values).__name__}")
+                        source_items = []
+                        for v in values:
+                            fut = loop.create_future()
+                            fut.set_result(v)
+                            source_items.append(fut)
+                    item_tasks = [loop.create_task(run_item(node, i, f)) for i, f in enumerate(source_items)]
+                    items_ready[node.id].set_result(item_tasks)
+                    value = list(await asyncio.gather(*item_tasks))
+                results[node.id] = value
+                status = "succeeded"
+                return value
+            finally:
+                if tracker and node.id in tracker.nodes:
+                    tracker.node_finished(node.id, status)
+                fut = items_ready.get(node.id)
+                if fut is not None and not fut.done():
+                    fut.cancel()
+
+        print(f"[workflow:{spec.name}] 工作流已启动...")
+        if tracker:
+            tracker.started()
+        for nid, node in spec.nodes.items():
+            tasks[nid] = loop.create_task(run_node(node))
+
+        done, pending = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+        failure = None
+        for nid, task in tasks.items():
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                failure = failure or (nid, task.exception())
+        if failure:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            nid, exc = failure
+            error = RuntimeError(f"node '{nid}' failed: {exc}")
+            if tracker:
+                tracker.finished(error=error)
+            raise error from exc
+
+        output = evaluate(spec.output, results) if spec.output is not None else {
+            nid: results.get(nid) for nid in spec.nodes
+        }
+        if tracker:
+            tracker.finished(result=output)
+        return output
+
+    async def _call(self, node, payload, tracker, index):
+        trace = tracker.new_trace(node.id, index, node.function) if tracker else None
+        try:
+            result = await self.dispatch(node.function, payload, trace)
+        except Exception as e:
+            if trace:
+                trace.finish(error=e)
+            raise
+        if trace:
+            trace.finish()
+        if node.output is None:
+            return result
+        return evaluate(node.output, {"result": result})
@@ -0,0 +1,240 @@
+# workflow_runs.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class InvocationTrace:
+    """
+    一次函数调用的阶段时间线。阶段按发生顺序追加，互不重叠：
+    acquire_warm / queue_wait / cold_start  获取容器 (直接拿到空闲容器 / 排队等别人释放 / 等新容器冷启动)
+    baseline                                 去噪基准 (noop) 调用
+    init / perf_start / run / perf_stop      初始化、启动 perf、/run 往返、停止 perf
+    perf_parse / save                        解析 perf 输出、保存 clean 指标
+    """
+    def __init__(self, function, node=None, index=None):
+        self.function = function
+        self.node = node
+        self.index = index
+        self.start = time.time()
+        self.end = None
+        self.phases = []
+        self.start_type = None
+        self.container = None
+        self.proxy_duration = None  # proxy 在容器内测得的 main() 执行时间
+        self.counters = {}  # 本次 /run 的 perf 计数
+        self.counter_quality = {}  # 每个事件的计数状态与运行时间占比
+        self.event_group = None  # 事件分组轮换时本次测量的组
+        self.cgroup_stats = {}  # 本次 /run 的 cgroup 资源计数差值
+        self.timeseries = None  # 开启分区间采样时本次 /run 的计数时间序列与阶段划分
+        self.error = None
+
+    def add(self, name, start, end=None):
+        end = time.time() if end is None else end
+        self.phases.append({"phase": name, "start": start, "end": end, "duration": end - start})
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def finish(self, error=None):
+        self.end = time.time()
+        if error is not None:
+            self.error = str(error)
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def breakdown(self):
+        totals = {}
+        for p in self.phases:
+            totals[p["phase"]] = totals.get(p["phase"], 0.0) + p["duration"]
+        return totals
+
+    def to_dict(self):
+        return {
+            "function": self.function,
+            "node": self.node,
+            "index": self.index,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "start_type": self.start_type,
+            "container": self.container[:12] if self.container else None,
+            "proxy_duration": self.proxy_duration,
+            "counters": self.counters,
+            "event_group": self.event_group,
+            "cgroup_stats": self.cgroup_stats,
+            "counter_phases": self.timeseries["segments"] if self.timeseries else None,
+            "phases": self.phases,
+            "error": self.error,
+        }
+
+
+class WorkflowRun:
+    def __init__(self, workflow, payload, deps=None):
+        self.run_id = os.urandom(8).hex()
+        self.workflow = workflow
+        self.payload = payload
+        self.deps = deps or {}  # {node_id: [依赖的 node_id]}，用于计算关键路径
+        self.status = "pending"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.nodes = {}  # {node_id: {"status", "start", "end", "traces": [InvocationTrace]}}
+
+    # --- 由 WorkflowEngine 调用 ---
+    def started(self):
+        self.status = "running"
+        self.started_at = time.time()
+
+    def node_started(self, node_id):
+        self.nodes[node_id] = {"status": "running", "start": time.time(), "end": None, "traces": []}
+
+    def node_finished(self, node_id, status):
+        node = self.nodes.setdefault(node_id, {"start": time.time(), "traces": []})
+        node["status"] = status
+        node["end"] = time.time()
+
+    def new_trace(self, node_id, index, function):
+        trace = InvocationTrace(function, node=node_id, index=index)
+        self.nodes.setdefault(node_id, {"status": "running", "start": trace.start, "end": None, "traces": []})["traces"].append(trace)
+        return trace
+
+    def finished(self, result=None, error=None):
+        self.finished_at = time.time()
+        if error is not None:
+            self.status = "failed"
+            self.error = str(error)
+        else:
+            self.status = "succeeded"
+            self.result = result
+
+    # --- 分析 ---
+    def critical_path(self):
+        """
+        从最后完成的节点开始回溯：每一步取"最晚完成的依赖"，即真正卡住该节点启动的上游；
+        map 节点取最慢的那个元素。返回沿路径的调用列表和按阶段汇总的时间。
+        """
+        done = {nid: n for nid, n in self.nodes.items() if n.get("end") and n.get("status") != "skipped"}
+        if not done:
+            return None
+        path = []
+        current = max(done, key=lambda nid: done[nid]["end"])
+        while current is not None:
+            node = done[current]
+            traces = node["traces"]
+            slowest = max(traces, key=lambda t: t.end or t.start) if traces else None
+            path.append({
+                "node": current,
+                "function": slowest.function if slowest else None,
+                "index": slowest.index if slowest else None,
+                "node_start": node["start"],
+                "node_end": node["end"],
+                "invocation_duration": slowest.duration if slowest else None,
+                "start_type": slowest.start_type if slowest else None,
+                "phases": slowest.breakdown() if slowest else {},
+            })
+            upstream = [d for d in self.deps.get(current, []) if d in done]
+            current = max(upstream, key=lambda d: done[d]["end"]) if upstream else None
+        path.reverse()
+
+        phase_totals = {}
+        for step in path:
+            for name, value in step["phases"].items():
+                phase_totals[name] = phase_totals.get(name, 0.0) + value
+        total = (self.finished_at or time.time()) - (self.started_at or self.created_at)
+        accounted = sum(phase_totals.values())
+        # 关键路径上未被任何阶段覆盖的时间：调度、数据传递、控制器自身开销
+        phase_totals["orchestration"] = max(0.0, total - accounted)
+        return {
+            "path": path,
+            "end_to_end": total,
+            "phase_totals": phase_totals,
+            "phase_share": {k: (v / total if total > 0 else 0.0) for k, v in phase_totals.items()},
+        }
+
+    def summary(self):
+        return {
+            "run_id": self.run_id,
+            "workflow": self.workflow,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": (self.finished_at - self.started_at) if self.finished_at and self.started_at else None,
+            "error": self.error,
+        }
+
+    def to_dict(self):
+        data = self.summary()
+        data["result"] = self.result
+        data["nodes"] = {
+            nid: {
+                "status": n.get("status"),
+                "start": n.get("start"),
+                "end": n.get("end"),
+                "invocations": [t.to_dict() for t in n.get("traces", [])],
+            } for nid, n in self.nodes.items()
+        }
+        data["critical_path"] = self.critical_path()
+        return data
+
+
+class WorkflowRunRegistry:
+    """保留最近 max_runs 次工作流运行记录"""
+    def __init__(self, max_runs=1000):
+        self.max_runs = max_runs
+        self.runs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, workflow, payload, deps=None):
+        run = WorkflowRun(workflow, payload, deps)
+        with self.lock:
+            self.runs[run.run_id] = run
+            while len(self.runs) > self.max_runs:
+                self.runs.popitem(last=False)
+        return run
+
+    def get(self, run_id):
+        with self.lock:
+            return self.runs.get(run_id)
+
+    def list(self, workflow=None):
+        with self.lock:
+            runs = list(self.runs.values())
+        return [r for r in runs if workflow is None or r.workflow == workflow]
+
+    def aggregate(self, workflow):
+        """同一工作流所有已成功运行的关键路径阶段平均耗时"""
+        runs = [r for r in self.list(workflow) if r.status == "succeeded"]
+        totals = {}
+        end_to_end = []
+        for run in runs:
+            cp = run.critical_path()
+            if not cp:
+                continue
+            end_to_end.append(cp["end_to_end"])
+            for name, value in cp["phase_totals"].items():
+                totals[name] = totals.get(name, 0.0) + value
+        n = len(end_to_end)
+        if not n:
+            return {"workflow": workflow, "runs": 0}
+        end_to_end.sort()
+        return {
+            "workflow": workflow,
+            "runs": n,
+            "mean_end_to_end": sum(end_to_end) / n,
+            "p50_end_to_end": end_to_end[n // 2],
+            "p95_end_to_end": end_to_end[min(n - 1, int(n * 0.95))],
+            "mean_critical_path_phases": {k: v / n for k, v in totals.items()},
+        }